@@ -0,0 +1,88 @@
+#!/usr/bin/env conda run -n ska3 python
+
+'''
+Micro-benchmarks for the time conversions in chandratime.py: the vectorized,
+leap-second-table ones against what the plotters used to do (Chandra.Time's
+DateTime, Ska.Matplotlib's cxctime2plotdate and matplotlib's num2date).
+
+    $ ./benchmarks/bench_chandratime.py
+    $ ./benchmarks/bench_chandratime.py --sizes 1000 100000 --repeats 5
+
+Prints the best time per element (in ns) for each conversion at each array
+size. The old conversions make a Python object per element, so they're
+skipped above --max_legacy_size (1e7 datetimes is a lot of memory, and
+minutes of waiting).
+'''
+
+import argparse
+import os
+import sys
+import time
+
+import matplotlib.dates as mdate
+import numpy as np
+from Chandra.Time import DateTime as cxcDateTime
+from Ska.Matplotlib import cxctime2plotdate as cxc2pd
+
+# The modules in hrcsentinel/ import each other by bare name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hrcsentinel'))
+
+from chandratime import (cxctime_to_datetime64, cxctime_to_doy, cxctime_to_plotdate,  # noqa: E402
+                         cxctime_to_unix)
+
+
+def legacy_cxctime_to_datetime(times):
+    # What chandratime.cxctime_to_datetime() used to be
+    return mdate.num2date(cxc2pd(cxcDateTime(times).secs))
+
+
+# name: (legacy, new). Every legacy conversion is one the plotters (or fetch_client etc.) actually used.
+CONVERSIONS = {'datetimes for plotting': (legacy_cxctime_to_datetime, cxctime_to_plotdate),
+               'plot dates': (cxc2pd, cxctime_to_plotdate),
+               'unix seconds': (lambda times: cxcDateTime(times).unix, cxctime_to_unix),
+               'datetime64': (legacy_cxctime_to_datetime, cxctime_to_datetime64),
+               'DOY strings': (lambda times: cxcDateTime(times).date, cxctime_to_doy)}
+
+
+def best_time(function, times, repeats):
+    best = np.inf
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function(times)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmark the CXC time conversions in chandratime.py')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000, 10000000],
+                        help='Array sizes to convert')
+    parser.add_argument('--repeats', type=int, default=3, help='Take the best of this many runs')
+    parser.add_argument('--max_legacy_size', type=int, default=1000000,
+                        help="Don't run the old conversions on arrays bigger than this")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+
+    # (Five days of full-resolution telemetry is ~1e6 samples.) The times start well before the last leap second,
+    # so the new conversions have to look up the leap second table, rather than take their all-recent fast path.
+    rng = np.random.default_rng(42)
+
+    print(f'{"conversion":<24}{"size":>10}{"old (ns/elem)":>16}{"new (ns/elem)":>16}{"speedup":>10}')
+    for name, (legacy, new) in CONVERSIONS.items():
+        for size in args.sizes:
+            times = np.sort(rng.uniform(5.5e8, 8.5e8, size))
+
+            new_per_element = best_time(new, times, args.repeats) / size * 1e9
+            if size <= args.max_legacy_size:
+                legacy_per_element = best_time(legacy, times, args.repeats) / size * 1e9
+                print(f'{name:<24}{size:>10}{legacy_per_element:>16.1f}{new_per_element:>16.1f}'
+                      f'{legacy_per_element / new_per_element:>9.1f}x')
+            else:
+                print(f'{name:<24}{size:>10}{"(skipped)":>16}{new_per_element:>16.1f}{"":>10}')
+
+
+if __name__ == '__main__':
+    main()
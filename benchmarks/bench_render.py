@@ -0,0 +1,350 @@
+#!/usr/bin/env conda run -n ska3 python
+
+'''
+Render-time benchmarks for every plotting function, on synthetic telemetry.
+
+Each plot is driven through the same client= (or archive=) hook it uses for
+MAUDE, cheta or the local archive, but handed a SyntheticClient instead, so
+nothing is fetched and the data volume is whatever we ask for:
+
+    $ ./benchmarks/bench_render.py                                  # every plot, 5 days of full-res data
+    $ ./benchmarks/bench_render.py --plots realtime_dashboard shield --spans 1d 30d 1y --samplings full 5min daily
+    $ ./benchmarks/bench_render.py --profiles live archive --compare benchmarks/results/bench_render_abc1234_....json
+
+Every case (plot x span x sampling) runs in a fresh process, so its peak RSS
+is its own. The first call is reported separately (it includes generating the
+synthetic data, and matplotlib's font cache etc.), then the best and median of
+--repeats more. Each file the plot writes is listed with its size. Samplings
+a plot can't draw (e.g. 5min for the realtime dashboard) are skipped.
+
+Results are saved as JSON (under benchmarks/results/ by default, named for
+the git commit), and --compare prints the change against an earlier run.
+'''
+
+import argparse
+import datetime as dt
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# The modules in hrcsentinel/ import each other by bare name
+HRCSENTINEL_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hrcsentinel')
+sys.path.insert(0, HRCSENTINEL_DIRECTORY)
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Seconds between samples at each sampling. 'full' is one major frame (most of the MSIDs we plot come once per major frame).
+SAMPLE_PERIODS = {'full': 32.8, '5min': 328.0, 'daily': 86400.0}
+
+SPANS = {'1d': 1, '5d': 5, '30d': 30, '1y': 365, '5y': 5 * 365, '25y': 25 * 365}
+
+
+class SyntheticMsid:
+    '''
+    Looks enough like a cheta MSID (full-resolution, or 5min/daily stats) for any of our plots
+    '''
+
+    def __init__(self, msid, times, vals, raw_vals=None, stats=False):
+        self.msid = msid
+        self.times = times
+        self.vals = vals
+        self.raw_vals = raw_vals if raw_vals is not None else vals
+        if stats:
+            self.means = vals
+            self.mins = vals - 1
+            self.maxes = vals + 1
+            self.stds = np.full_like(vals, 0.5)
+
+    def __len__(self):
+        return len(self.times)
+
+
+class SyntheticClient:
+    '''
+    A drop-in for FetchClient (and LocalArchive) that makes up telemetry instead of fetching it:
+    a noisy sinusoid for each MSID, with a sample every SAMPLE_PERIODS[sampling] seconds, for
+    whatever window is asked for. The same MSID and window always gives the same data.
+    '''
+
+    def __init__(self, now, sampling=None):
+        '''
+        :param now: The end of every window (CXC seconds)
+        :param sampling: Force this sampling, whatever the plot asks for (None to give it what it asks for)
+        '''
+        self.now = now
+        self.sampling = sampling
+        self._cache = {}
+
+    def get_telem(self, msids, start=None, stop=None, sampling='full'):
+        from fetch_client import start_secs
+
+        if isinstance(msids, str):
+            msids = [msids]
+        sampling = self.sampling if self.sampling is not None else sampling
+        start = start_secs(start) if start is not None else self.now - 25 * 365 * 86400
+        stop = min(start_secs(stop), self.now) if stop is not None else self.now
+
+        return {msid: self._make(msid, start, stop, sampling) for msid in msids}
+
+    def _make(self, msid, start, stop, sampling):
+        key = (msid, start, stop, sampling)
+        if key not in self._cache:
+            # Seeded by MSID, so every MSID is different but every run is the same
+            rng = np.random.default_rng(sum(msid.encode()))
+            times = np.arange(start, max(stop, start + 1), SAMPLE_PERIODS[sampling])
+            level = rng.uniform(1, 100)
+            vals = level + 0.1 * level * np.sin(times / 86400) + rng.normal(0, 0.01 * level, len(times))
+
+            if msid == 'CCSDSTMF':
+                # Telemetry formats are strings
+                vals = np.where(np.sin(times / 20000) > 0, 'FMT1', 'FMT2')
+                self._cache[key] = SyntheticMsid(msid, times, vals)
+            else:
+                self._cache[key] = SyntheticMsid(msid, times, vals, raw_vals=np.round(vals) % 2,
+                                                 stats=sampling != 'full')
+        return self._cache[key]
+
+
+def synthetic_orbit_metadata(start, stop):
+    # An orbit every 63.5 hours (with ~15 hours of radzone around perigee), and three DSN comms a day
+    orbits = [{'t_perigee': t_perigee, 'dt_start_radzone': -30000, 'dt_stop_radzone': 25000, 'orbit_num': 3000 + i}
+              for i, t_perigee in enumerate(np.arange(start, stop, 63.5 * 3600))]
+    dsn_comms = [{'tstart': tstart, 'tstop': tstart + 3 * 3600, 'dur': 3 * 3600, 'station': 'DSS-24'}
+                 for tstart in np.arange(start, stop, 8 * 3600)]
+    return {'orbits': orbits, 'dsn_comms': dsn_comms}
+
+
+# What each benchmark draws. Every function takes the SyntheticClient, the window, the sampling, where to save, and
+# the render profiles, and calls the real plotting function with everything it would otherwise fetch.
+
+def render_realtime_dashboard(client, plot_start, plot_stop, sampling, fig_save_directory, profiles):
+    import matplotlib.dates as mdate
+    from plot_dashboard import make_realtime_plot
+    make_realtime_plot(plot_start=plot_start, plot_stop=plot_stop, sampling=sampling, date_format=mdate.DateFormatter('%m-%d'),
+                       force_limits=True, fig_save_directory=fig_save_directory, client=client, profiles=profiles)
+
+
+def render_persistent_dashboard(client, plot_start, plot_stop, sampling, fig_save_directory, profiles, _dashboards={}):
+    # The long-lived dashboard (see dashboard_renderer.py). Built on the first call, so that's in the cold time only.
+    import matplotlib.dates as mdate
+    from dashboard_renderer import RealtimeDashboard
+    if fig_save_directory not in _dashboards:
+        _dashboards[fig_save_directory] = RealtimeDashboard(fig_save_directory=fig_save_directory,
+                                                            date_format=mdate.DateFormatter('%m-%d'), client=client)
+    _dashboards[fig_save_directory].update(plot_start, plot_stop, profiles=profiles)
+
+
+def render_missionwide(client, plot_start, plot_stop, sampling, fig_save_directory, profiles):
+    import msidlists
+    from fetch_planner import flatten
+    from plot_dashboard import render_missionwide_dashboard
+    latest_telem = client.get_telem(flatten(msidlists.dashboard_msids_missionwide), start=client.now - 86400)
+    render_missionwide_dashboard(fig_save_directory, latest_telem=latest_telem, archive=client, profiles=profiles)
+
+
+def render_shield(client, plot_start, plot_stop, sampling, fig_save_directory, profiles):
+    from chandratime import cxctime_to_plotdate
+    from fetch_client import start_secs
+    from plot_rates import make_shield_plot
+    goes_times = np.arange(start_secs(plot_start), client.now, 300.0)
+    make_shield_plot(fig_save_directory=fig_save_directory, plot_start=plot_start, plot_stop=plot_stop, client=client,
+                     orbit_metadata=synthetic_orbit_metadata(start_secs(plot_start), client.now + 2 * 86400),
+                     goes_data=(cxctime_to_plotdate(goes_times), np.full(len(goes_times), 500.0)), profiles=profiles)
+
+
+def render_motors(client, plot_start, plot_stop, sampling, fig_save_directory, profiles):
+    import matplotlib.dates as mdate
+    from plot_motors import make_motor_plots
+    make_motor_plots(fig_save_directory=fig_save_directory, plot_start=plot_start, plot_end=plot_stop, sampling=sampling,
+                     date_format=mdate.DateFormatter('%m-%d'), client=client, profiles=profiles)
+
+
+def render_thermals(client, plot_start, plot_stop, sampling, fig_save_directory, profiles):
+    import msidlists
+    from plot_thermals import make_thermal_plots
+    # Mission-long daily stats, plus the latest value of each
+    latest_datapoints = client.get_telem(msidlists.monitor_temperature_msids, start=client.now - 86400)
+    make_thermal_plots(fig_save_directory=fig_save_directory, archive=client, latest_datapoints=latest_datapoints,
+                       profiles=profiles)
+
+
+def render_comm_status(client, plot_start, plot_stop, sampling, fig_save_directory, profiles):
+    from plot_dashboard import comm_status_stamp
+    comm_status_stamp(True, dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=3), platform.node(),
+                      fig_save_directory=fig_save_directory, profiles=profiles)
+
+
+PLOTS = {'realtime_dashboard': render_realtime_dashboard,
+         'persistent_dashboard': render_persistent_dashboard,
+         'missionwide': render_missionwide,
+         'shield': render_shield,
+         'motors': render_motors,
+         'thermals': render_thermals,
+         'comm_status': render_comm_status}
+
+# Plots that always use one sampling, whatever --samplings says
+FIXED_SAMPLING = {'missionwide': 'daily', 'thermals': 'daily', 'comm_status': 'full', 'persistent_dashboard': 'full'}
+
+# Plots that only draw some samplings (make_realtime_plot draws nothing at all at 5min), so timing the others is meaningless
+SUPPORTED_SAMPLINGS = {'realtime_dashboard': ('full', 'daily')}
+
+# Plots that always span the whole mission (they pick their own start), whatever --spans says
+MISSION_LONG = ('missionwide', 'thermals')
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux, but bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_case(plot, span_days, sampling, profiles, repeats):
+    '''
+    Runs in its own (spawned) process, so the peak RSS is this case's alone
+    '''
+    if sampling not in SUPPORTED_SAMPLINGS.get(plot, SAMPLE_PERIODS):
+        raise ValueError(f"{plot} doesn't draw {sampling} data")
+
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+    import matplotlib.pyplot as plt
+    import plot_stylers
+    from cxotime import CxoTime
+    plot_stylers.styleplots()
+
+    now = CxoTime.now().secs
+    client = SyntheticClient(now, sampling=sampling)
+    plot_stop = dt.datetime.utcnow() + dt.timedelta(days=2)
+    plot_start = dt.datetime.utcnow() - dt.timedelta(days=span_days)
+    fig_save_directory = tempfile.mkdtemp(prefix='hrcsentinel_bench_') + '/'
+
+    render = PLOTS[plot]
+    baseline_rss = peak_rss_bytes()
+    try:
+        started = time.perf_counter()
+        render(client, plot_start, plot_stop, sampling, fig_save_directory, profiles)
+        plt.close('all')
+        cold = time.perf_counter() - started
+
+        warm = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            render(client, plot_start, plot_stop, sampling, fig_save_directory, profiles)
+            plt.close('all')
+            warm.append(time.perf_counter() - started)
+
+        # Everything it published, apart from artifact_publisher's bookkeeping
+        artifacts = {name: os.path.getsize(os.path.join(fig_save_directory, name))
+                     for name in sorted(os.listdir(fig_save_directory))
+                     if os.path.isfile(os.path.join(fig_save_directory, name)) and not name.startswith('manifest.json')}
+        samples = sum(len(msid) for msid in client._cache.values())
+    finally:
+        shutil.rmtree(fig_save_directory, ignore_errors=True)
+
+    return {'plot': plot, 'span_days': span_days, 'sampling': sampling, 'profiles': list(profiles),
+            'samples': samples, 'cold_seconds': cold,
+            'best_seconds': min(warm) if warm else None, 'median_seconds': float(np.median(warm)) if warm else None,
+            'baseline_rss_bytes': baseline_rss, 'peak_rss_bytes': peak_rss_bytes(), 'artifacts': artifacts}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HRCSENTINEL_DIRECTORY, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def case_key(result):
+    return (result['plot'], result['span_days'], result['sampling'], tuple(result['profiles']))
+
+
+def print_result(result, previous=None):
+    seconds = result['best_seconds'] if result['best_seconds'] is not None else result['cold_seconds']
+    line = (f'{result["plot"]:<22}{result["span_days"]:>7}d {result["sampling"]:<6}{result["samples"]:>11}'
+            f'{seconds:>9.2f} s{result["cold_seconds"]:>9.2f} s{result["peak_rss_bytes"] / 2 ** 20:>9.0f} MB'
+            f'{sum(result["artifacts"].values()) / 2 ** 10:>10.0f} kB')
+    if previous is not None:
+        previous_seconds = previous['best_seconds'] if previous['best_seconds'] is not None else previous['cold_seconds']
+        line += f'  ({(seconds / previous_seconds - 1) * 100:+.0f}% time, ' \
+                f'{(result["peak_rss_bytes"] / previous["peak_rss_bytes"] - 1) * 100:+.0f}% RSS)'
+    print(line, flush=True)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmark every plotting function on synthetic telemetry')
+    parser.add_argument('--plots', nargs='+', choices=list(PLOTS), default=list(PLOTS), help='Which plots to draw')
+    parser.add_argument('--spans', nargs='+', choices=list(SPANS), default=['5d'],
+                        help="How much telemetry to draw (the mission-wide and thermal plots always draw the whole mission)")
+    parser.add_argument('--samplings', nargs='+', choices=list(SAMPLE_PERIODS), default=['full'],
+                        help='The sampling of the synthetic telemetry')
+    parser.add_argument('--profiles', nargs='+', default=['live', 'archive'],
+                        help='Render profiles to save with (see render_profiles.py)')
+    parser.add_argument('--repeats', type=int, default=3, help='How many timed renders, after the first')
+    parser.add_argument('--output', help='Where to save the results (default: benchmarks/results/bench_render_<commit>_<time>.json)')
+    parser.add_argument('--compare', help='An earlier results file to compare against')
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+
+    previous = {}
+    if args.compare is not None:
+        with open(args.compare) as previous_file:
+            previous = {case_key(result): result for result in json.load(previous_file)['results']}
+
+    cases = []
+    for plot in args.plots:
+        samplings = [FIXED_SAMPLING[plot]] if plot in FIXED_SAMPLING else args.samplings
+        if plot in MISSION_LONG:
+            span_days = [(dt.datetime.utcnow() - dt.datetime(2000, 1, 4)).days]
+        else:
+            span_days = [SPANS[span] for span in args.spans]
+        supported = SUPPORTED_SAMPLINGS.get(plot, SAMPLE_PERIODS)
+        for sampling in samplings:
+            if sampling not in supported:
+                print(f'Skipping {plot} at {sampling} sampling: it only draws {", ".join(supported)}')
+        for days in span_days:
+            for sampling in samplings:
+                if sampling in supported:
+                    cases.append((plot, days, sampling))
+
+    print(f'{"plot":<22}{"span":>8} {"samp.":<6}{"samples":>11}{"best":>11}{"cold":>11}{"peak RSS":>12}{"output":>10}')
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for plot, span_days, sampling in cases:
+        # A new process per case, so one case's memory doesn't count against the next
+        with context.Pool(1) as pool:
+            try:
+                result = pool.apply(run_case, (plot, span_days, sampling, tuple(args.profiles), args.repeats))
+            except Exception as e:
+                print(f'{plot:<22}{span_days:>7}d {sampling:<6} failed: {type(e).__name__}: {e}', flush=True)
+                continue
+        results.append(result)
+        print_result(result, previous.get(case_key(result)))
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        output = os.path.join(RESULTS_DIRECTORY, f'bench_render_{git_commit()}_{dt.datetime.now():%Y%m%dT%H%M%S}.json')
+
+    import matplotlib
+    with open(output, 'w') as output_file:
+        json.dump({'commit': git_commit(), 'run_at': dt.datetime.now().isoformat(), 'host': platform.node(),
+                   'python': platform.python_version(), 'numpy': np.__version__, 'matplotlib': matplotlib.__version__,
+                   'results': results}, output_file, indent=1)
+    print(f'Saved results to {output}')
+
+
+if __name__ == '__main__':
+    main()
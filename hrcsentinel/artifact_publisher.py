@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+'''
+Atomic, versioned publishing of the plots we put on the web.
+
+The plots used to be saved straight into the web directory (allowed_hosts in
+global_configuration.py), so the web server could hand out a half-written
+status.png, and the last copy was all we ever had. Now every file is:
+
+    1. saved to a hidden temp file next to its final name,
+    2. fsynced,
+    3. hard-linked into history/ as a new version (a link, so no copy is made),
+    4. and atomically renamed over the old copy, which readers see either all of or none of.
+
+Each directory keeps a manifest.json with, for every file: when it was
+published, the fingerprint of its inputs (see render_fingerprint.py), how long
+it took to render, and its last few versions in history/. Older versions are
+pruned as new ones come in:
+
+    >>> publisher = ArtifactPublisher(fig_save_directory)
+    >>> publisher.publish_figure(fig, 'status.png', dpi=120)
+    >>> publisher.manifest()['artifacts']['status.png']['versions'][0]
+    {'path': 'history/status.20261018T140512.123456.png', 'published': '2026-10-18T14:05:12.123456', ...}
+
+render_profiles.save_figure() publishes everything through here. Wrap a
+render in publishing() to have its fingerprint (and render time) recorded
+with whatever it saves.
+'''
+
+import contextvars
+import datetime as dt
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from global_configuration import artifact_history_length
+
+MANIFEST_NAME = 'manifest.json'
+HISTORY_DIRECTORY = 'history'
+
+# The render that's saving right now (its fingerprint, and when it started), if there is one.
+# contextvars follow us into the render thread, and RenderPool workers set their own.
+_current_publication = contextvars.ContextVar('hrcsentinel_publication', default=None)
+
+
+@contextmanager
+def publishing(fingerprint=None):
+    '''
+    Everything published inside is recorded with this fingerprint, and with the time since
+    the block started as its render time.
+    '''
+    token = _current_publication.set({'fingerprint': fingerprint, 'started': time.monotonic()})
+    try:
+        yield
+    finally:
+        _current_publication.reset(token)
+
+
+def _fsync_directory(directory):
+    # So the rename itself survives a crash, not just the file's contents
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # Some filesystems (e.g. some NFS mounts) don't do this
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_atomically(path, write):
+    '''
+    Call write(temp_path), fsync what it wrote, and rename it to path
+    '''
+    directory, file_name = os.path.split(path)
+    # Unique per thread too, since e.g. the CommScheduler and the monitor both save the orbit metadata
+    temp_path = os.path.join(directory, f'.{file_name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        write(temp_path)
+        with open(temp_path, 'rb') as temp_file:
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    _fsync_directory(directory or os.curdir)
+
+
+class ArtifactPublisher:
+    '''
+    Publishes files into one directory, atomically, keeping the last few versions of each.
+    Safe to use from several processes at once (e.g. the RenderPool workers).
+    '''
+
+    def __init__(self, directory, history=artifact_history_length):
+        '''
+        :param directory: Where to publish (e.g. fig_save_directory)
+        :param history: How many previous versions of each file to keep in history/ (0 for none)
+        '''
+        self.directory = directory
+        self.history = history
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+
+    def publish_figure(self, fig, file_name, dpi=120, file_format=None, bbox_inches=None):
+        '''
+        Save a matplotlib figure as file_name (relative to the directory), e.g. 'status.png'
+        '''
+        if file_format is None:
+            file_format = os.path.splitext(file_name)[1].lstrip('.')
+        self.publish(file_name, lambda temp_path: fig.savefig(temp_path, dpi=dpi, format=file_format,
+                                                              bbox_inches=bbox_inches))
+
+    def publish(self, file_name, write, fingerprint=None, render_time=None):
+        '''
+        Publish whatever write(path) writes to path as file_name.
+
+        :param fingerprint: What it was made from. Defaults to the fingerprint given to publishing(), if any.
+        :param render_time: How long it took to make (seconds). Defaults to the time since publishing() started,
+            or else how long write() took.
+        '''
+        publication = _current_publication.get()
+        if fingerprint is None and publication is not None:
+            fingerprint = publication['fingerprint']
+
+        started = time.monotonic()
+        path = os.path.join(self.directory, file_name)
+        write_atomically(path, write)
+        if render_time is None:
+            render_time = time.monotonic() - (publication['started'] if publication is not None else started)
+
+        published = dt.datetime.now()
+        entry = {'published': published.isoformat(),
+                 'fingerprint': fingerprint,
+                 'render_time': round(render_time, 3),
+                 'bytes': os.path.getsize(path)}
+
+        if self.history > 0:
+            stem, extension = os.path.splitext(file_name)
+            version_path = os.path.join(HISTORY_DIRECTORY, f'{stem}.{published.strftime("%Y%m%dT%H%M%S.%f")}{extension}')
+            os.makedirs(os.path.join(self.directory, HISTORY_DIRECTORY), exist_ok=True)
+            try:
+                # The published copy never changes again (the next one replaces it, rather than writing over it),
+                # so the version can share its inode
+                os.link(path, os.path.join(self.directory, version_path))
+                entry['path'] = version_path
+            except OSError:
+                # e.g. a filesystem without hard links. Go without this version, rather than without the plot.
+                pass
+
+        self._update_manifest(file_name, entry)
+
+    def _update_manifest(self, file_name, entry):
+        # Every writer (in every process) takes this lock to read, update and replace the manifest
+        with open(self.manifest_path + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            manifest = self.manifest()
+
+            artifact = manifest['artifacts'].setdefault(file_name, {'versions': []})
+            artifact['current'] = {key: value for key, value in entry.items() if key != 'path'}
+            if 'path' in entry:
+                artifact['versions'].insert(0, entry)
+
+            # Prune the oldest versions
+            for version in artifact['versions'][self.history:]:
+                try:
+                    os.remove(os.path.join(self.directory, version['path']))
+                except OSError:
+                    pass
+            del artifact['versions'][self.history:]
+
+            manifest['updated'] = entry['published']
+
+            def write(temp_path):
+                with open(temp_path, 'w') as manifest_file:
+                    json.dump(manifest, manifest_file, indent=1)
+            write_atomically(self.manifest_path, write)
+
+    def manifest(self):
+        '''
+        The manifest as a dict (an empty one if nothing's been published here yet)
+        '''
+        try:
+            with open(self.manifest_path) as manifest_file:
+                return json.load(manifest_file)
+        except (OSError, ValueError):
+            return {'updated': None, 'artifacts': {}}
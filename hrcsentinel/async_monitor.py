@@ -0,0 +1,376 @@
+#!/usr/bin/env conda run -n ska3 python
+
+'''
+An asyncio version of monitor_telemetry's main loop (./monitor_telemetry.py --async_engine).
+
+The classic loop does everything in turn: comm check, status stamp, fetch,
+realtime plot, shield plot (which waits on web-Kadi, with its 10 second pauses,
+and on GOES), then a 3 second countdown. Here each of those is its own task,
+on its own cadence:
+
+    watch_comm()              polls for comm (on the CommScheduler's cadence) and publishes AOS and LOS
+    refresh_telemetry()       fetches the dashboard telemetry every few seconds in comm, rarely out of it
+    refresh_goes()            downloads the GOES proxy every 5 minutes
+    refresh_orbit_metadata()  downloads the web-Kadi orbit & DSN schedule every 30 minutes
+    render_plots()            redraws whatever those events made out of date (see plot_events.py)
+
+so a slow Kadi request no longer stalls the dashboard, and a refresh takes
+about as long as its slowest stage rather than the sum of all of them.
+The next fetch also overlaps the current render.
+
+Matplotlib isn't thread-safe, so every plot is drawn on one render thread,
+in order. Events that arrive while it's busy just mark plots as due again,
+so we only ever draw the newest telemetry, never a backlog.
+'''
+
+import asyncio
+import datetime as dt
+import functools
+import json
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import matplotlib.dates as mdate
+import matplotlib.pyplot as plt
+import pytz
+
+import fetch_metrics
+from deadlines import TimeoutException, wait_for
+from fetch_client import start_secs
+from fetch_planner import fetch_planned, plan_refresh
+from goes_proxy import get_goes_proxy
+from heartbeat import are_we_in_comm, timestamp_string
+from plot_dashboard import comm_status_stamp, make_ancillary_plots
+from plot_events import (AOS, GOES_UPDATED, LOS, NEW_SAMPLES, ORBIT_METADATA_UPDATED,
+                         EventBus, SampleWatcher, dashboard_registry)
+from plot_rates import fetch_orbit_metadata, make_shield_plot
+from vcdu_tracker import VcduTracker
+from dashboard_renderer import RealtimeDashboard
+from render_fingerprint import realtime_dashboard_inputs, render_if_changed, shield_inputs
+from render_profiles import profiles_for
+
+
+class AsyncTelemetryMonitor:
+    '''
+    Runs the telemetry monitor as a set of concurrent asyncio tasks.
+
+    >>> monitor = AsyncTelemetryMonitor(fig_save_directory, hostname, engine, telemetry_cache)
+    >>> asyncio.run(monitor.run())
+    '''
+
+    def __init__(self, fig_save_directory, hostname, engine, telemetry_cache, scheduler=None, bus=None,
+                 forced_client=None, fake_comm=False, chatty=False, debug=False, refresh_interval=3,
+                 out_of_comm_refresh_interval=600, goes_interval=300, orbit_metadata_interval=1800, render_pool=None,
+                 fingerprints=None, data_publisher=None):
+        '''
+        :param engine: The FetchEngine for telemetry fan-out and the GOES/Kadi downloads
+        :param telemetry_cache: The TelemetryCache the dashboard fetches go through
+        :param refresh_interval: Seconds between dashboard refreshes while in comm
+        :param out_of_comm_refresh_interval: Seconds between full (dashboard, shield, motors) refreshes out of comm
+        :param goes_interval: Seconds between GOES proxy downloads (NOAA updates it every 5 minutes)
+        :param orbit_metadata_interval: Seconds between web-Kadi orbit metadata downloads
+        :param render_pool: A RenderPool. If given, the ancillary plots are drawn in parallel on its worker processes.
+        :param fingerprints: A FingerprintStore. If given, plots drawn from the same inputs as their published copy are skipped.
+        :param data_publisher: A DataSlicePublisher. If given, every fetch's new samples are published as data for the
+            web client, and the dashboard PNG is only drawn when its archive copies are due (at startup and LOS).
+        '''
+        self.fig_save_directory = fig_save_directory
+        self.hostname = hostname
+        self.engine = engine
+        self.telemetry_cache = telemetry_cache
+        self.scheduler = scheduler
+        self.bus = bus
+        self.forced_client = forced_client
+        self.fake_comm = fake_comm
+        self.chatty = chatty
+        self.debug = debug
+        self.refresh_interval = refresh_interval
+        self.out_of_comm_refresh_interval = out_of_comm_refresh_interval
+        self.goes_interval = goes_interval
+        self.orbit_metadata_interval = orbit_metadata_interval
+        self.render_pool = render_pool
+        self.fingerprints = fingerprints
+        self.data_publisher = data_publisher
+
+        # Blocking calls that fan out onto the engine (fetch_planned, comm checks) run here,
+        # never on the engine's own pool, so they can't starve it of workers
+        self._stage_executor = ThreadPoolExecutor(
+            max_workers=3, thread_name_prefix='hrcsentinel-stage')
+        # Matplotlib isn't thread-safe, so every plot is drawn on this one thread
+        self._render_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='hrcsentinel-render')
+
+        self.code_start_time = dt.datetime.now(tz=pytz.timezone('US/Eastern'))
+        self.in_comm = None
+        self.refreshes_this_pass = 0
+        self.events = EventBus()
+        self.plots = dashboard_registry(self.events)
+        self.sample_watcher = SampleWatcher(self.events)
+        # Watches the frames each comm check fetches (when there's no telemetry bus to do it for us)
+        self.vcdu_tracker = VcduTracker()
+        # Built on the render thread the first time it's drawn, and redrawn in place after that
+        self.realtime_dashboard = None
+        self.telem = None
+        self.telem_includes_motors = False
+        self.goes_data = None
+
+        # Until web-Kadi answers, use whatever we saved last time (and say it's stale)
+        try:
+            with open('last_orbit_metadata.json') as orbit_metadata_json_file:
+                self.orbit_metadata = json.load(orbit_metadata_json_file)
+        except Exception:
+            self.orbit_metadata = {'orbits': [], 'dsn_comms': []}
+        self.stale_orbit_metadata = True
+
+        self._save_cache = False
+
+    async def run(self):
+        '''
+        Run every task until interrupted. None of them ever returns, and none of them dies on an error.
+        '''
+        # These have to be made inside the running event loop
+        self._render_wanted = asyncio.Event()
+        self._comm_started = asyncio.Event()
+        # The registry has already subscribed, so by the time we're woken the plots are marked as due
+        for kind in (AOS, LOS, NEW_SAMPLES, GOES_UPDATED, ORBIT_METADATA_UPDATED):
+            self.events.subscribe(kind, lambda kind, payload: self._render_wanted.set())
+
+        await asyncio.gather(self.watch_comm(), self.refresh_telemetry(), self.refresh_goes(),
+                             self.refresh_orbit_metadata(), self.render_plots())
+
+    async def watch_comm(self):
+        while True:
+            try:
+                if self.scheduler is not None:
+                    # Only reads the schedule we've got (it's refreshed on the scheduler's own thread)
+                    cadence = self.scheduler.next_cadence()
+                else:
+                    cadence = 2
+                await asyncio.sleep(cadence)
+
+                in_comm = await self._in_thread(are_we_in_comm, verbose=False, cadence=0, fake_comm=self.fake_comm,
+                                                bus=self.bus, vcdu_tracker=self.vcdu_tracker, timeout=60, stage='comm check')
+                if self.scheduler is not None:
+                    self.scheduler.observe(in_comm)
+
+                previously_in_comm = self.in_comm
+                self.in_comm = in_comm
+
+                if previously_in_comm is None:
+                    # The first check. Draw the stamp, whatever we found.
+                    self.plots.invalidate('comm_status')
+                    self._render_wanted.set()
+
+                if in_comm and not previously_in_comm:
+                    self.refreshes_this_pass = 0
+                    self._comm_started.set()
+                    self.events.publish(AOS)
+                elif not in_comm:
+                    self._comm_started.clear()
+                    if previously_in_comm:
+                        # Comm just ended, so this is a good time to write the cache to disk
+                        self._save_cache = True
+                        self.events.publish(LOS)
+
+                if in_comm:
+                    print(
+                        f"({timestamp_string()}) In Comm! Refreshing Dashboard (Refresh {self.refreshes_this_pass})                                   ", end="\r", flush=True)
+                else:
+                    print(
+                        f'({timestamp_string()}) Not in Comm.                                                     ', end='\r', flush=True)
+
+            except Exception as e:
+                self._report(e, 'comm check')
+
+    async def refresh_telemetry(self):
+        loop = asyncio.get_running_loop()
+        last_full_refresh = -self.out_of_comm_refresh_interval
+
+        while True:
+            try:
+                if self._save_cache:
+                    self._save_cache = False
+                    await self._in_thread(self.telemetry_cache.save, timeout=300, stage='cache save')
+
+                in_comm = bool(self.in_comm)
+                full_refresh = not in_comm and loop.time() - last_full_refresh >= self.out_of_comm_refresh_interval
+
+                if not in_comm and not full_refresh:
+                    # Nothing to do until comm starts, or it's time for the next out-of-comm refresh
+                    wait_seconds = last_full_refresh + self.out_of_comm_refresh_interval - loop.time()
+                    try:
+                        await asyncio.wait_for(self._comm_started.wait(), timeout=wait_seconds)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                five_days_ago = dt.date.today() - dt.timedelta(days=5)
+                # Out of comm, also fetch what the motor plots need. In comm, honor --force_cheta.
+                self.telem = await self._in_thread(fetch_planned, plan_refresh(motors=full_refresh), start=five_days_ago,
+                                                   telemetry_cache=self.telemetry_cache, bus=self.bus,
+                                                   client=self.forced_client if in_comm else None, engine=self.engine,
+                                                   timeout=300, stage='telemetry refresh')
+                self.telem_includes_motors = full_refresh
+                # This is what makes the plots that show these MSIDs due for a redraw
+                self.sample_watcher.observe(self.telem)
+                if self.data_publisher is not None:
+                    await self._in_thread(self.data_publisher.publish, self.telem, plot_start=five_days_ago,
+                                          plot_stop=dt.date.today() + dt.timedelta(days=2), timeout=60, stage='data slices')
+
+                if full_refresh:
+                    last_full_refresh = loop.time()
+                else:
+                    self.refreshes_this_pass += 1
+
+                fetch_metrics.end_iteration(label='in_comm' if in_comm else 'not_in_comm')
+
+                if in_comm:
+                    await asyncio.sleep(self.refresh_interval)
+
+            except Exception as e:
+                self._report(e, 'telemetry refresh')
+                await asyncio.sleep(self.refresh_interval)
+
+    async def refresh_goes(self):
+        while True:
+            try:
+                goes_data = await self._download(get_goes_proxy, timeout=60, stage='GOES download')
+                previous_goes_data = self.goes_data
+                self.goes_data = goes_data
+                # NOAA only updates every 5 minutes, so most downloads bring nothing new
+                if previous_goes_data is None or len(goes_data[0]) == 0 or goes_data[0][-1] != previous_goes_data[0][-1]:
+                    self.events.publish(GOES_UPDATED)
+            except Exception as e:
+                self._report(e, 'GOES download')
+            await asyncio.sleep(self.goes_interval)
+
+    async def refresh_orbit_metadata(self):
+        while True:
+            try:
+                orbit_metadata, stale = await self._download(fetch_orbit_metadata, plot_start=dt.date.today() - dt.timedelta(days=5),
+                                                             timeout=300, stage='orbit metadata download')
+                if orbit_metadata is not None and (orbit_metadata, stale) != (self.orbit_metadata, self.stale_orbit_metadata):
+                    self.orbit_metadata, self.stale_orbit_metadata = orbit_metadata, stale
+                    self.events.publish(ORBIT_METADATA_UPDATED)
+            except Exception as e:
+                self._report(e, 'orbit metadata download')
+            await asyncio.sleep(self.orbit_metadata_interval)
+
+    async def render_plots(self):
+        while True:
+            # Sleep until an event makes something due, or something gets too old
+            try:
+                await asyncio.wait_for(self._render_wanted.wait(), timeout=self.plots.seconds_until_due())
+            except asyncio.TimeoutError:
+                pass
+            self._render_wanted.clear()
+
+            for plot in self.plots.take_due():
+                try:
+                    await self._render(plot, self.plots.render_trigger(plot))
+                except Exception as e:
+                    # It'll be drawn again on its next event
+                    self._report(e, f'{plot} render')
+
+    async def _render(self, plot, trigger='refresh'):
+        # trigger picks the render profiles: 'refresh' for just the live PNGs, 'los' for the archive copies too
+        if plot == 'comm_status':
+            if self.in_comm is None:
+                # No comm check yet. The first one will make this due again.
+                return
+            await self._on_render_thread(comm_status_stamp, comm_status=self.in_comm, code_start_time=self.code_start_time,
+                                         fig_save_directory=self.fig_save_directory, hostname=self.hostname,
+                                         debug_prints=self.debug, timeout=60, stage='comm status stamp')
+
+        elif plot == 'ancillary':
+            # Without the motor telemetry, make_ancillary_plots() fetches what it needs itself
+            telem = self.telem if self.telem_includes_motors else None
+            await self._on_render_thread(self._draw_ancillary, telem, trigger, timeout=300, stage='ancillary plots')
+
+        elif self.telem is None:
+            # Nothing fetched yet. The first fetch will bring NEW_SAMPLES, and make this due again.
+            return
+
+        elif plot == 'realtime_dashboard' and trigger == 'refresh' and self.data_publisher is not None:
+            # The web client draws it from the data slices
+            return
+
+        # Everything a render uses is captured now, so newer data arriving mid-render can't mix in
+        elif plot == 'realtime_dashboard':
+            vcdu_events = await self._in_thread(self._vcdu_timeline, timeout=30, stage='VCDU timeline')
+            await self._on_render_thread(self._draw_realtime, self.telem, vcdu_events, trigger, timeout=120,
+                                         stage='realtime dashboard')
+
+        elif plot == 'shield':
+            await self._on_render_thread(self._draw_shield, self.telem, self.orbit_metadata, self.stale_orbit_metadata,
+                                         self.goes_data, trigger, timeout=120, stage='shield plot')
+
+        if trigger == 'los':
+            self.plots.mark_archived(plot)
+
+    def _vcdu_timeline(self):
+        five_days_ago = start_secs(dt.date.today() - dt.timedelta(days=5))
+        # If there's a telemetry bus, it's been watching every frame, not just the ones we fetched
+        if self.bus is not None:
+            return self.bus.vcdu_timeline(start=five_days_ago)
+        return self.vcdu_tracker.timeline(start=five_days_ago)
+
+    def _draw_realtime(self, telem, vcdu_events=None, trigger='refresh'):
+        five_days_ago = dt.date.today() - dt.timedelta(days=5)
+        two_days_hence = dt.date.today() + dt.timedelta(days=2)
+        if self.realtime_dashboard is None:
+            self.realtime_dashboard = RealtimeDashboard(fig_save_directory=self.fig_save_directory,
+                                                        date_format=mdate.DateFormatter('%m-%d'))
+        render_if_changed(self.fingerprints, 'realtime_dashboard',
+                          realtime_dashboard_inputs(telem, five_days_ago, two_days_hence, vcdu_events),
+                          self.realtime_dashboard.update, plot_start=five_days_ago, plot_stop=two_days_hence, telem=telem,
+                          vcdu_events=vcdu_events, profiles=profiles_for('realtime_dashboard', trigger))
+
+    def _draw_shield(self, telem, orbit_metadata, stale_orbit_metadata, goes_data, trigger='refresh'):
+        five_days_ago = dt.date.today() - dt.timedelta(days=5)
+        two_days_hence = dt.date.today() + dt.timedelta(days=2)
+        # If GOES hasn't come in yet, plot without it rather than downloading it here
+        render_if_changed(self.fingerprints, 'shield',
+                          shield_inputs(telem, five_days_ago, two_days_hence, goes_data, orbit_metadata, stale_orbit_metadata),
+                          make_shield_plot, fig_save_directory=self.fig_save_directory, plot_start=five_days_ago, plot_stop=two_days_hence,
+                          telem=telem, engine=self.engine, orbit_metadata=orbit_metadata,
+                          stale_orbit_metadata=stale_orbit_metadata, goes_data=goes_data if goes_data is not None else ([], []),
+                          profiles=profiles_for('shield', trigger))
+        plt.close('all')
+
+    def _draw_ancillary(self, telem, trigger='refresh'):
+        make_ancillary_plots(fig_save_directory=self.fig_save_directory, telem=telem, engine=self.engine,
+                             render_pool=self.render_pool, fingerprints=self.fingerprints, trigger=trigger)
+        plt.close('all')
+
+    async def _in_thread(self, function, *args, timeout=None, stage=None, **kwargs):
+        future = asyncio.get_running_loop().run_in_executor(
+            self._stage_executor, functools.partial(function, *args, **kwargs))
+        return await wait_for(future, timeout=timeout, stage=stage)
+
+    async def _on_render_thread(self, function, *args, timeout=None, stage=None, **kwargs):
+        future = asyncio.get_running_loop().run_in_executor(
+            self._render_executor, functools.partial(function, *args, **kwargs))
+        # If this times out the render still finishes in the background (threads can't be killed),
+        # and the next one queues up behind it on the render thread
+        return await wait_for(future, timeout=timeout, stage=stage)
+
+    async def _download(self, function, *args, timeout=None, stage=None, **kwargs):
+        # On the engine, so the download gets a pooled keep-alive session
+        future = asyncio.wrap_future(self.engine.submit_download(function, *args, **kwargs))
+        return await wait_for(future, timeout=timeout, stage=stage)
+
+    def _report(self, e, stage):
+        if isinstance(e, TimeoutException):
+            print(
+                f"({timestamp_string()}) Timed out: {e}. Pressing on...                             ", end="\r", flush=True)
+        elif self.chatty:
+            print(f"({timestamp_string()}) ERROR in {stage}: {e}")
+            print("Heres the traceback:")
+            print(traceback.format_exc())
+            print(f"({timestamp_string()}) Pressing on...")
+        else:
+            print(
+                f'({timestamp_string()}) ERROR encountered! Use --report_errors to display them.                                   ', end='\r', flush=True)
+        sys.stdout.flush()
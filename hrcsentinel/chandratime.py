@@ -5,7 +5,100 @@ import matplotlib.dates as mdate
 import numpy as np
 from astropy.time import Time
 from Chandra.Time import DateTime as cxcDateTime
-from Ska.Matplotlib import cxctime2plotdate as cxc2pd
+
+SECONDS_PER_DAY = 86400.0
+
+# CXC time is seconds of Terrestrial Time (TT) since 1998-01-01T00:00:00 TT. Unix time is seconds of UTC
+# since 1970, not counting leap seconds. So unix = cxc + CXC_EPOCH_UNIX - TT_MINUS_TAI - (TAI - UTC),
+# and all it takes to get it right is TAI - UTC at each time, i.e. a table of leap seconds.
+CXC_EPOCH_UNIX = 883612800.0  # 1998-01-01T00:00:00 UTC
+TT_MINUS_TAI = 32.184
+
+# TAI - UTC was 31 s when the CXC epoch began. Each entry is a UTC date it went up a second, and what it went up to.
+# IERS Bulletin C announces these six months ahead. There hasn't been one since 2017, but if there's ever another, add it here!
+LEAP_SECONDS = [(dt.datetime(1999, 1, 1), 32),
+                (dt.datetime(2006, 1, 1), 33),
+                (dt.datetime(2009, 1, 1), 34),
+                (dt.datetime(2012, 7, 1), 35),
+                (dt.datetime(2015, 7, 1), 36),
+                (dt.datetime(2017, 1, 1), 37)]
+
+# The same table, precomputed for searchsorted(): the CXC time at which each leap second takes effect,
+# and the Unix - CXC offset before the first one and after each of them
+_TAI_MINUS_UTC = np.array([31] + [tai_minus_utc for _, tai_minus_utc in LEAP_SECONDS], dtype=np.float64)
+_UNIX_OFFSETS = CXC_EPOCH_UNIX - TT_MINUS_TAI - _TAI_MINUS_UTC
+_LEAP_CXC = np.array([(date - dt.datetime(1970, 1, 1)).total_seconds() - _UNIX_OFFSETS[i + 1]
+                      for i, (date, _) in enumerate(LEAP_SECONDS)])
+
+# matplotlib's date number for the Unix epoch (it depends on which epoch matplotlib is set to use)
+_PLOTDATE_UNIX_EPOCH = mdate.date2num(dt.datetime(1970, 1, 1))
+
+
+def _scalar_or_array(values, like):
+    return values[()] if like.ndim == 0 else values
+
+
+def cxctime_to_unix(cxctimes):
+    '''
+    Convert CXC seconds (a scalar or an array of any size) to Unix seconds, vectorized.
+    Like Unix time itself, a leap second (23:59:60) reads as the start of the next day.
+    '''
+    cxctimes = np.asarray(cxctimes, dtype=np.float64)
+    if cxctimes.size > 0 and cxctimes.min() >= _LEAP_CXC[-1]:
+        # Everything's after the last leap second (i.e. anything we're plotting live), so it's one offset
+        unix = cxctimes + _UNIX_OFFSETS[-1]
+    else:
+        unix = cxctimes + _UNIX_OFFSETS[np.searchsorted(_LEAP_CXC, cxctimes, side='right')]
+    return _scalar_or_array(unix, cxctimes)
+
+
+def cxctime_to_plotdate(cxctimes):
+    '''
+    Convert CXC seconds to matplotlib date numbers, vectorized. Hand the result straight to
+    plot_date(), axvspan() etc. instead of cxctime_to_datetime(), which makes a Python
+    datetime object for every single sample.
+    '''
+    return cxctime_to_unix(cxctimes) / SECONDS_PER_DAY + _PLOTDATE_UNIX_EPOCH
+
+
+def cxctime_to_datetime64(cxctimes):
+    '''
+    Convert CXC seconds to numpy datetime64[ns] (UTC), e.g. for plotly, which doesn't take matplotlib date numbers
+    '''
+    unix = np.asarray(cxctime_to_unix(cxctimes))
+    return _scalar_or_array(np.round(unix * 1e9).astype(np.int64).astype('datetime64[ns]'), unix)
+
+
+def cxctime_to_doy(cxctimes):
+    '''
+    Convert CXC seconds to DOY strings like '2020:001:00:00:00.000' (the format of Chandra.Time's
+    DateTime.date), vectorized. A scalar in gives a str back.
+    '''
+    times = np.atleast_1d(cxctime_to_datetime64(cxctimes)).astype('datetime64[ms]')
+    years = times.astype('datetime64[Y]')
+    days = times.astype('datetime64[D]')
+    day_of_year = (days - years.astype('datetime64[D]')).astype(np.int32) + 1
+    # (Everything fits in 32 bits, which numpy divides about twice as fast)
+    milliseconds = (times - days).astype(np.int32)
+
+    # Formatting a string per element is what we're trying to avoid, so work out every digit with integer
+    # arithmetic instead, write them into rows of characters, and read each row back as one string
+    fields = [(years.astype(np.int32) + 1970, 4), (day_of_year, 3), (milliseconds // 3600000, 2),
+              (milliseconds // 60000 % 60, 2), (milliseconds // 1000 % 60, 2), (milliseconds % 1000, 3)]
+    # One row per character to start with (so each is written in one contiguous go), transposed at the end
+    characters = np.empty((sum(width for _, width in fields) + len(fields) - 1, len(times)), dtype=np.uint32)
+    row = 0
+    for i, (value, width) in enumerate(fields):
+        if i > 0:
+            characters[row] = ord('.') if i == len(fields) - 1 else ord(':')
+            row += 1
+        for power in range(width - 1, -1, -1):
+            characters[row] = value // 10 ** power % 10 + ord('0')
+            row += 1
+    characters = np.ascontiguousarray(characters.T)
+    doy_strings = characters.view(f'U{characters.shape[1]}').reshape(len(times))
+
+    return str(doy_strings[0]) if np.ndim(cxctimes) == 0 else doy_strings
 
 
 def cxctime_to_datetime(rawtimes):
@@ -27,18 +120,29 @@ def cxctime_to_datetime(rawtimes):
     plotdate_start = mdate.epoch2num(delta_time) # convert to days since start of Year 1 AD
 
     DEPRECATE THIS. JUST USE CXOTIME! 
+
+    (Kept for compatibility. For plotting, use cxctime_to_plotdate() instead, and see
+    cxctime_to_unix(), cxctime_to_datetime64() and cxctime_to_doy() for the rest.)
     """
 
-    # TODO
-    # As currently implemented, this is stupid. What you're actually doing
-    # is taking a DateTime, converting it into plot_date format, and then re-converting it into
-    # a DateTime. Lol.
+    # This used to take a DateTime, convert it into plot_date format, and then re-convert it into
+    # a DateTime. Lol. Now it's just the vectorized conversion (and then the datetimes, which is
+    # still slow, so only use this when you actually need datetimes).
 
-    plot_date_time = mdate.num2date(cxc2pd(cxcDateTime(rawtimes).secs))
+    rawtimes = np.asarray(rawtimes)
+    if rawtimes.dtype.kind not in 'iuf':
+        # e.g. DOY strings, which DateTime understands
+        rawtimes = cxcDateTime(rawtimes).secs
+
+    plot_date_time = mdate.num2date(cxctime_to_plotdate(rawtimes))
 
     return plot_date_time
 
 
+# Some older scripts (e.g. plot_motors_anomaly.py) import it by this name
+cxc2dt = cxctime_to_datetime
+
+
 def convert_to_doy(datetime_start):
     '''
     Return a string like '2020:237' that will be passed to start= in
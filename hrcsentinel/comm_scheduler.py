@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from cxotime import CxoTime
+
+from heartbeat import timestamp_string
+
+
+class CommScheduler:
+    '''
+    Decide how long to wait before the next comm check, based on the DSN
+    schedule (the dsn_comms events that plot_rates.grab_orbit_metadata()
+    already pulls from web-Kadi).
+
+    Far from any scheduled pass we only check every max_cadence seconds. As a
+    scheduled AOS or LOS gets closer, the wait shrinks (to a tenth of the time
+    left, by default) all the way down to min_cadence, so we catch the start of
+    a pass sooner than the old fixed 2 second loop while making a small fraction
+    of the MAUDE queries.
+
+    The DSN schedule is refreshed on a background thread (fetching it from
+    web-Kadi can take minutes), so next_cadence() only ever reads the copy we
+    already have, and never holds up a comm check.
+
+    >>> scheduler = CommScheduler()
+    >>> in_comm = are_we_in_comm(scheduler=scheduler)  # sleeps scheduler.next_cadence() first
+    '''
+
+    def __init__(self, metadata_path='last_orbit_metadata.json', min_cadence=0.5, max_cadence=60,
+                 in_comm_cadence=2, ramp_factor=10, refresh_interval=3600):
+        '''
+        :param metadata_path: The orbit metadata JSON that make_shield_plot() keeps up to date
+        :param min_cadence: The fastest we'll ever poll (seconds), right at a scheduled AOS or LOS
+        :param max_cadence: The slowest we'll ever poll (seconds). Keep it well under the monitors' iteration Deadline.
+        :param in_comm_cadence: How often to poll during a pass (or whenever we don't know the schedule)
+        :param ramp_factor: Wait 1/ramp_factor of the time left until the next scheduled AOS or LOS
+        :param refresh_interval: Re-fetch the DSN schedule from web-Kadi if our copy is older than this (seconds)
+        '''
+        self.metadata_path = metadata_path
+        self.min_cadence = min_cadence
+        self.max_cadence = max_cadence
+        self.in_comm_cadence = in_comm_cadence
+        self.ramp_factor = ramp_factor
+        self.refresh_interval = refresh_interval
+
+        self.in_comm = False
+        self.pass_starts = np.array([])
+        self.pass_stops = np.array([])
+        self._schedule_loaded = 0
+        # Guards pass_starts and pass_stops, which the refresh thread replaces together
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    def set_schedule(self, dsn_comms):
+        '''
+        Use a list of dsn_comms events (dicts with tstart and tstop in CXC seconds)
+        '''
+        passes = sorted((event['tstart'], event['tstop']) for event in dsn_comms)
+        with self._lock:
+            self.pass_starts = np.array([start for start, _ in passes])
+            self.pass_stops = np.array([stop for _, stop in passes])
+            self._schedule_loaded = time.time()
+
+    def refresh_schedule(self, now=None):
+        '''
+        Load the DSN schedule from the metadata file, fetching a fresh copy from
+        web-Kadi first if it's stale or has no upcoming passes. Never raises:
+        if everything fails we just keep the schedule we had.
+
+        This blocks for as long as web-Kadi takes. next_cadence() calls it on a background thread.
+        '''
+        now = CxoTime.now().secs if now is None else now
+
+        try:
+            metadata_age = time.time() - os.path.getmtime(self.metadata_path)
+            with open(self.metadata_path) as metadata_file:
+                self.set_schedule(json.load(metadata_file)['dsn_comms'])
+        except Exception:
+            metadata_age = np.inf
+
+        if metadata_age > self.refresh_interval or not np.any(self.pass_stops > now):
+            try:
+                # Imported here, because plot_rates drags in matplotlib and kadi, which nothing else in here needs
+                from plot_rates import grab_orbit_metadata, save_orbit_metadata
+                import datetime as dt
+                orbit_metadata = grab_orbit_metadata(
+                    plot_start=dt.date.today() - dt.timedelta(days=1))
+                save_orbit_metadata(orbit_metadata, self.metadata_path)
+                self.set_schedule(orbit_metadata['dsn_comms'])
+            except Exception as e:
+                print(f'({timestamp_string()}) Could not refresh the DSN schedule: {e}')
+                # Don't try again until the next refresh_interval
+                self._schedule_loaded = time.time()
+
+    def _refresh_in_background(self, now=None):
+        # One refresh at a time. Until it's done, we carry on with the schedule we've got.
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+        self._refresh_thread = threading.Thread(target=self.refresh_schedule, kwargs={'now': now}, daemon=True,
+                                                name='DSN schedule refresh')
+        self._refresh_thread.start()
+
+    def observe(self, in_comm):
+        '''
+        Tell the scheduler what the last comm check found
+        '''
+        self.in_comm = in_comm
+
+    def next_cadence(self, now=None):
+        '''
+        How many seconds to wait before the next comm check
+        '''
+        if time.time() - self._schedule_loaded > self.refresh_interval:
+            self._refresh_in_background(now=now)
+
+        now = CxoTime.now().secs if now is None else now
+
+        with self._lock:
+            pass_starts, pass_stops = self.pass_starts, self.pass_stops
+
+        upcoming = pass_stops > now
+        if not np.any(upcoming):
+            # We don't know the schedule (or it's run out, or the first refresh is still going). Play it safe.
+            return self.in_comm_cadence
+
+        # Time until the next scheduled AOS or LOS, whichever comes first
+        edges = np.concatenate([pass_starts, pass_stops])
+        time_to_edge = np.min(edges[edges > now] - now)
+        cadence = np.clip(time_to_edge / self.ramp_factor,
+                          self.min_cadence, self.max_cadence)
+
+        in_scheduled_pass = np.any((pass_starts <= now) & (now <= pass_stops))
+        if self.in_comm or in_scheduled_pass:
+            # During a pass the monitors still want their regular updates (and a pass may start late)
+            cadence = min(cadence, self.in_comm_cadence)
+
+        return float(cadence)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+'''
+The comm state, shared through memory with every HRCSentinel process on the box.
+
+Every daemon (and plot_critical_dashboard.update_plot(), via
+are_we_in_comm(cadence=0)) used to make its own MAUDE query just to find out
+whether we're in comm. With the telemetry bus running, asking it meant a
+socket round trip per check. Now the bus publishes its comm state (in comm,
+AOS time, last VCDU, last frame time...) to a small fixed-size record in a
+memory-mapped file, and everyone else just reads it:
+
+    >>> reader = CommStateReader()
+    >>> reader.read(max_age=150)
+    {'in_comm': True, 'aos_time': 752112345.2, 'last_vcdu': 1234567, ...}
+
+The record is guarded by a seqlock, so neither side ever takes a lock. The
+(single) writer bumps a sequence number to an odd value, writes the fields,
+then bumps it to the next even value. A reader copies the fields out and
+keeps them only if the sequence number was the same even value before and
+after, retrying otherwise. A writer that died mid-write leaves the sequence
+number odd, and readers give up and fall back to asking MAUDE.
+'''
+
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+from global_configuration import comm_state_path
+
+MAGIC = b'HRCCOMM1'
+HEADER = struct.Struct('<8sQ')
+# in_comm, aos_time, last_vcdu, last_frame_time, frame_rate, updated (CXC seconds), published (Unix time), writer pid
+PAYLOAD = struct.Struct('<?7xdqdddd q')
+RECORD_SIZE = HEADER.size + PAYLOAD.size
+
+
+def _encode(value):
+    # The record is fixed-size, so a missing time or rate is a NaN (and a missing VCDU is -1)
+    return np.nan if value is None else float(value)
+
+
+def _decode(value):
+    return None if np.isnan(value) else value
+
+
+class CommStateWriter:
+    '''
+    Publishes the comm state. Only one process (the telemetry bus) should ever write to a given path.
+    '''
+
+    def __init__(self, path=comm_state_path):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < RECORD_SIZE:
+                os.ftruncate(fd, RECORD_SIZE)
+            self._map = mmap.mmap(fd, RECORD_SIZE)
+        finally:
+            # The mapping keeps the file open for us
+            os.close(fd)
+
+        magic, sequence = HEADER.unpack_from(self._map, 0)
+        # Carry on from a previous writer's sequence number (rounded up to even, in case it died mid-write),
+        # so a reader can never mistake our first record for one it has already seen
+        self.sequence = sequence + (sequence % 2) if magic == MAGIC else 0
+
+    def publish(self, comm_state):
+        '''
+        :param comm_state: A dict like TelemetryBus.comm_state
+        '''
+        payload = PAYLOAD.pack(bool(comm_state['in_comm']),
+                               _encode(comm_state.get('aos_time')),
+                               -1 if comm_state.get('last_vcdu') is None else int(comm_state['last_vcdu']),
+                               _encode(comm_state.get('last_frame_time')),
+                               _encode(comm_state.get('frame_rate')),
+                               _encode(comm_state.get('updated')),
+                               time.time(),
+                               os.getpid())
+
+        # Odd while we're writing, so readers know to retry
+        HEADER.pack_into(self._map, 0, MAGIC, self.sequence + 1)
+        self._map[HEADER.size:RECORD_SIZE] = payload
+        self.sequence += 2
+        HEADER.pack_into(self._map, 0, MAGIC, self.sequence)
+
+    def close(self):
+        self._map.close()
+
+
+class CommStateReader:
+    '''
+    Reads what a CommStateWriter publishes. Cheap enough to call on every comm check.
+    '''
+
+    def __init__(self, path=comm_state_path, retries=100):
+        self.path = path
+        self.retries = retries
+        self._map = None
+
+    def _open(self):
+        try:
+            with open(self.path, 'rb') as comm_state_file:
+                if os.fstat(comm_state_file.fileno()).st_size < RECORD_SIZE:
+                    return None
+                return mmap.mmap(comm_state_file.fileno(), RECORD_SIZE, access=mmap.ACCESS_READ)
+        except OSError:
+            # Nobody's publishing (yet)
+            return None
+
+    def read(self, max_age=None):
+        '''
+        The latest comm state as a dict, or None if there isn't one (or it's older than max_age seconds,
+        e.g. because the telemetry bus has stopped).
+        '''
+        state = self._read()
+        if state is None or (max_age is not None and time.time() - state['published'] > max_age):
+            # The writer may have been restarted with a fresh file, so map it again next time.
+            # (Just drop our mapping rather than closing it, in case another thread is halfway through reading it.)
+            self._map = None
+            return None
+        return state
+
+    def _read(self):
+        if self._map is None:
+            self._map = self._open()
+        mapping = self._map
+        if mapping is None:
+            return None
+
+        for _ in range(self.retries):
+            magic, before = HEADER.unpack_from(mapping, 0)
+            if magic != MAGIC:
+                return None
+            if before % 2 == 1:
+                # Caught the writer mid-write. It only takes a microsecond, so try again.
+                time.sleep(0)
+                continue
+            payload = mapping[HEADER.size:RECORD_SIZE]
+            _, after = HEADER.unpack_from(mapping, 0)
+            if before == after:
+                break
+        else:
+            # The writer must have died mid-write
+            return None
+
+        in_comm, aos_time, last_vcdu, last_frame_time, frame_rate, updated, published, pid = PAYLOAD.unpack(payload)
+
+        return {'in_comm': in_comm,
+                'aos_time': _decode(aos_time),
+                'last_vcdu': None if last_vcdu < 0 else last_vcdu,
+                'last_frame_time': _decode(last_frame_time),
+                'frame_rate': _decode(frame_rate),
+                'updated': _decode(updated),
+                'published': published,
+                'pid': pid,
+                'sequence': before}
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+'''
+A long-lived version of the realtime 12-panel dashboard.
+
+make_realtime_plot() builds a whole new figure every time it's called: a new
+gridspec, 12 axes, every line, legend, title and tick formatter, and then a
+constrained_layout pass, only to throw it all away once it's saved. In comm
+that happens every few seconds, and most of the CPU goes on layout rather
+than data.
+
+RealtimeDashboard builds the figure (and works out its layout) once. Each
+refresh only swaps new data into the existing lines with set_data(), moves
+the "Now" lines, redraws the VCDU dropout shading, updates the limits and the
+suptitle, and saves it again:
+
+    >>> dashboard = RealtimeDashboard(fig_save_directory='/tmp/')
+    >>> dashboard.update(plot_start=five_days_ago, plot_stop=two_days_hence, telem=telem)
+
+The figure isn't managed by pyplot, so the plt.close('all') calls in the
+other plotting functions can't close it out from under us. It's not
+thread-safe (nothing in matplotlib is), so keep it on one thread.
+'''
+
+import datetime as dt
+
+import matplotlib.dates as mdate
+import numpy as np
+import pytz
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import msidlists
+import plot_stylers
+from chandratime import cxctime_to_plotdate as cxc2pd
+from decimation import decimate_for_axes
+from fetch_client import FetchClient
+from monitor_comms import convert_bus_current_to_dn
+from plot_dashboard import get_dashboard_telem
+from render_profiles import DEFAULT_PROFILES, save_figure
+
+# The panels with something extra on them (see make_realtime_plot)
+BUS_VOLTAGE_PANEL = 0
+BUS_CURRENT_PANEL = 2
+RATES_PANEL = 10
+PITCH_PANEL = 11
+
+
+def _to_plotdate(value):
+    # The "Now" lines are datetimes, the telemetry is CXC seconds
+    return mdate.date2num(value) if isinstance(value, (dt.date, dt.datetime)) else value
+
+
+class RealtimeDashboard:
+    '''
+    The realtime (missionwide=False, full resolution) dashboard, built once and redrawn in place.
+    '''
+
+    def __init__(self, fig_save_directory=None, date_format=mdate.DateFormatter('%m-%d'), force_limits=True,
+                 client=None):
+        '''
+        :param fig_save_directory: Where to save status.png, status.pdf, etc. (None to not save)
+        :param date_format: How to label the x axes
+        :param force_limits: Pin each panel to its dashboard_limits_latest range, rather than autoscaling
+        :param client: The FetchClient to use for anything not in the telem handed to update()
+        '''
+        self.fig_save_directory = fig_save_directory
+        self.force_limits = force_limits
+        self.client = client if client is not None else FetchClient('maude', allow_subset=False)
+
+        self.fig = Figure(figsize=(16, 6), constrained_layout=True)
+        FigureCanvasAgg(self.fig)
+        gs = self.fig.add_gridspec(3, 4)
+
+        self.axes = []
+        # One Line2D per MSID, keyed by MSID, in the same order (and so the same colors) as make_realtime_plot
+        self.lines = {}
+        self.now_lines = []
+        self.now_labels = []
+        self.vcdu_artists = []
+
+        for plotnum in range(12):
+            ax = self.fig.add_subplot(gs[plotnum // 4, plotnum % 4])
+            self.axes.append(ax)
+            ax.xaxis_date()
+
+            for msid in msidlists.dashboard_msids_latest[plotnum]:
+                self.lines[msid], = ax.plot([], [], marker='o', linestyle='', markersize=1,
+                                            label=msid, zorder=1, rasterized=True)
+
+            if force_limits:
+                ax.set_ylim(msidlists.dashboard_limits_latest[plotnum])
+
+            self.now_labels.append(ax.text(0, ax.get_ylim()[1], 'Now', fontsize=6, color='slategray', zorder=3))
+            self.now_lines.append(ax.axvline(0, color='gray', alpha=0.5))
+
+            if plotnum == BUS_CURRENT_PANEL:
+                # Overplot the CAUTION and WARNING limits
+                ax.axhspan(2.3, 2.5, facecolor=plot_stylers.yellow, alpha=0.3)
+                ax.axhspan(2.5, 3.5, facecolor=plot_stylers.red, alpha=0.3)
+
+            if plotnum == RATES_PANEL:
+                # The shield/det event rates are better in log y
+                ax.set_yscale('symlog')
+
+            if plotnum == PITCH_PANEL:
+                # Underplot FIFO resets and format changes. The formats are strings, so they get their own
+                # (hidden) y axis, where each format is numbered in the order we first see it.
+                ax_resets = ax.twinx()
+                ax_formats = ax.twinx()
+                self.fifo_reset_line, = ax_resets.plot([], [], linewidth=0.5, alpha=0.7, color=plot_stylers.blue,
+                                                       label='FIFO Reset', zorder=0, rasterized=True)
+                self.format_line, = ax_formats.plot([], [], linewidth=0.5, alpha=0.7, color=plot_stylers.purple,
+                                                    label='Format Changes', zorder=0, rasterized=True)
+                self.format_codes = {}
+                for twin in (ax_resets, ax_formats):
+                    twin.set_yticks([])
+                ax_resets.legend(handles=[self.fifo_reset_line, self.format_line], prop={'size': 8}, loc=3)
+                self.twin_axes = (ax_resets, ax_formats)
+
+            ax.set_ylabel(msidlists.dashboard_units_latest[plotnum], color='slategray', size=8)
+            if plotnum >= 8:
+                # Only label the x axes of the bottom row of plots
+                ax.set_xlabel('Date (UTC)', color='slategray', size=6)
+            ax.xaxis.set_major_formatter(date_format)
+            ax.tick_params(axis='x', labelrotation=0)
+
+            if plotnum != BUS_VOLTAGE_PANEL:
+                # Legend gets too busy on the Bus Voltage plot
+                ax.legend(prop={'size': 8}, loc=2)
+            ax.set_title(msidlists.dashboard_tiles_latest[plotnum], color='slategray', loc='center')
+
+        # Lay out around a suptitle as long as the real one, so there's room for it
+        self.suptitle = self.fig.suptitle('Latest Bus Current: 000 DN (0.0 A) | Updated as of 2000-Jan-01 00:00:00 EST',
+                                          color='slategray', size=6)
+
+        # Work out the layout once, then freeze it. Every refresh after this skips constrained_layout entirely.
+        self.fig.canvas.draw()
+        if hasattr(self.fig, 'set_layout_engine'):
+            self.fig.set_layout_engine('none')
+        else:
+            # Older matplotlib
+            self.fig.set_constrained_layout(False)
+
+    def update(self, plot_start, plot_stop, telem=None, telemetry_cache=None, vcdu_events=None,
+               profiles=DEFAULT_PROFILES):
+        '''
+        Swap in the latest telemetry and re-save the figure.
+
+        :param telem: Pre-fetched telemetry keyed by MSID (e.g. from fetch_planner). Anything missing is fetched.
+        :param vcdu_events: A VcduTracker timeline. Dropouts are shaded and VCDU counter resets marked.
+        :param profiles: The render profiles to save it with (see render_profiles.py)
+        '''
+        xlim = (_to_plotdate(plot_start), _to_plotdate(plot_stop))
+        now = mdate.date2num(dt.datetime.now(tz=pytz.timezone('US/Eastern')))
+
+        for plotnum, ax in enumerate(self.axes):
+            # The decimation bins are sized to the panel's pixels over this window, so set it first
+            ax.set_xlim(*xlim)
+
+            for msid in msidlists.dashboard_msids_latest[plotnum]:
+                data = get_dashboard_telem(msid, plot_start, 'full', telemetry_cache=telemetry_cache,
+                                           telem=telem, client=self.client)[msid]
+                times, vals = decimate_for_axes(ax, data.times, data.vals)
+                self.lines[msid].set_data(cxc2pd(times), vals)
+
+                if plotnum == BUS_CURRENT_PANEL:
+                    latest_bus_current = data.vals[-1]
+
+            if not self.force_limits:
+                ax.relim()
+                ax.autoscale_view(scalex=False)
+
+            self.now_lines[plotnum].set_xdata([now, now])
+            self.now_labels[plotnum].set_position((now, ax.get_ylim()[1]))
+
+        self._update_pitch_panel(plot_start, telem, telemetry_cache)
+        self._update_vcdu_events(vcdu_events)
+
+        self.suptitle.set_text('Latest Bus Current: {} DN ({} A) | Updated as of {} EST'.format(
+            convert_bus_current_to_dn(latest_bus_current), np.round(latest_bus_current, 2),
+            dt.datetime.now(tz=pytz.timezone('US/Eastern')).strftime("%Y-%b-%d %H:%M:%S")))
+
+        if self.fig_save_directory is not None:
+            save_figure(self.fig, self.fig_save_directory, 'status', profiles)
+
+    def _update_pitch_panel(self, plot_start, telem, telemetry_cache):
+        ax = self.axes[PITCH_PANEL]
+        try:
+            fifo_resets = get_dashboard_telem('2FIFOAVR', plot_start, 'full', telemetry_cache=telemetry_cache,
+                                              telem=telem, client=self.client)['2FIFOAVR']
+            format_changes = get_dashboard_telem('CCSDSTMF', plot_start, 'full', telemetry_cache=telemetry_cache,
+                                                 telem=telem, client=self.client)['CCSDSTMF']
+        except ValueError:
+            # Same as make_realtime_plot: go without them
+            return
+
+        reset_times, reset_vals = decimate_for_axes(ax, fifo_resets.times, fifo_resets.vals)
+        self.fifo_reset_line.set_data(cxc2pd(reset_times), reset_vals)
+
+        formats = [str(telemetry_format).strip() for telemetry_format in format_changes.vals]
+        codes = [self.format_codes.setdefault(telemetry_format, len(self.format_codes))
+                 for telemetry_format in formats]
+        self.format_line.set_data(cxc2pd(format_changes.times), codes)
+
+        for twin in self.twin_axes:
+            twin.relim()
+            twin.autoscale_view(scalex=False)
+
+    def _update_vcdu_events(self, vcdu_events):
+        # There are only ever a handful of these, so just replace them
+        for artist in self.vcdu_artists:
+            artist.remove()
+        self.vcdu_artists = []
+
+        for event in vcdu_events or []:
+            for ax in self.axes:
+                if event['kind'] == 'dropout':
+                    self.vcdu_artists.append(ax.axvspan(cxc2pd(event['start']), cxc2pd(event['stop']),
+                                                        color=plot_stylers.red, alpha=0.2, zorder=0))
+                elif event['kind'] == 'counter_reset':
+                    self.vcdu_artists.append(ax.axvline(cxc2pd(event['stop']), color=plot_stylers.red,
+                                                        linestyle='--', linewidth=0.8, zorder=0))
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+'''
+Publishes the realtime dashboard as data, for a web page to draw (./monitor_telemetry.py --data_dashboard).
+
+Drawing the dashboard into a PNG every few seconds in comm costs seconds of CPU,
+and every browser then downloads the whole image again. Instead, each refresh
+here appends only the samples that are new since the last one, as a small chunk
+of Float32 arrays, and rewrites data.json, which lists the panels (the MSIDs,
+titles, units and limits in msidlists.dashboard_*_latest) and the chunks:
+
+    data/
+        index.html           the client (web/data_dashboard.html), which draws the panels
+        data.json            the manifest
+        chunk.00000123.f32   one refresh's new samples
+
+The client polls data.json, and only downloads the chunks it hasn't seen yet, so
+once it's loaded, it only ever fetches the newest samples.
+
+A chunk holds, for each MSID in data.json's 'msids' (in that order), its
+chunk['counts'][i] times (Unix seconds since the chunk's 'epoch') and then its
+chunk['counts'][i] values, all little-endian Float32. Series are decimated to
+the min & max of fixed-width time bins, about points_per_panel of them across
+the window (see decimation.minmax_decimate_by_width()).
+
+So the chunk list doesn't grow forever, every fan_in chunks at one level are
+merged into one chunk at the next level up (and redecimated), and chunks that
+have scrolled out of the window are dropped. A client re-downloads a merged
+chunk once, which is rare at the higher levels.
+'''
+
+import datetime as dt
+import json
+import os
+import shutil
+
+import numpy as np
+
+import msidlists
+from artifact_publisher import write_atomically
+from chandratime import cxctime_to_unix
+from decimation import minmax_decimate_by_width
+from fetch_client import start_secs
+from fetch_planner import flatten
+
+MANIFEST_NAME = 'data.json'
+CLIENT_NAME = 'index.html'
+CLIENT_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'web', 'data_dashboard.html')
+
+
+class DataSlicePublisher:
+    '''
+    Writes the dashboard's telemetry into directory as incremental data chunks.
+
+    >>> publisher = DataSlicePublisher(os.path.join(fig_save_directory, 'data'))
+    >>> publisher.publish(telem, plot_start=five_days_ago, plot_stop=two_days_hence)
+    '''
+
+    def __init__(self, directory, msidlist=msidlists.dashboard_msids_latest, tiles=msidlists.dashboard_tiles_latest,
+                 units=msidlists.dashboard_units_latest, limits=msidlists.dashboard_limits_latest,
+                 points_per_panel=2000, fan_in=8):
+        '''
+        :param directory: Where to publish (the web server should serve it as-is)
+        :param msidlist: One list of MSIDs per panel
+        :param tiles, units, limits: Each panel's title, y-axis label and y limits
+        :param points_per_panel: Roughly how many points to keep across the window for each MSID
+        :param fan_in: How many chunks at one level are merged into one at the next
+        '''
+        self.directory = directory
+        self.msids = list(dict.fromkeys(flatten(msidlist)))
+        self.panels = [{'title': title, 'units': unit, 'limits': list(limit), 'msids': list(panel_msids)}
+                       for panel_msids, title, unit, limit in zip(msidlist, tiles, units, limits)]
+        self.points_per_panel = points_per_panel
+        self.fan_in = fan_in
+
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = self._load_manifest()
+        # Files dropped from the manifest. They're deleted on the next publish, so that a client
+        # that read the previous manifest can still fetch them.
+        self._retired = []
+        self._remove_orphans()
+        self._install_client()
+
+    def _load_manifest(self):
+        # Carry on from where the last run left off, unless the MSIDs have changed since
+        try:
+            with open(os.path.join(self.directory, MANIFEST_NAME)) as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest['msids'] != self.msids:
+                raise ValueError('The dashboard MSIDs have changed')
+        except (OSError, ValueError, KeyError):
+            manifest = {'updated': None, 'sequence': 0, 'msids': self.msids, 'window': None,
+                        'last_cxctime': {}, 'chunks': []}
+        manifest['panels'] = self.panels
+        return manifest
+
+    def _remove_orphans(self):
+        # e.g. chunks written by a run that died before it updated the manifest
+        published = {chunk['file'] for chunk in self.manifest['chunks']}
+        for file_name in os.listdir(self.directory):
+            if file_name.startswith('chunk.') and file_name not in published:
+                os.remove(os.path.join(self.directory, file_name))
+
+    def _install_client(self):
+        write_atomically(os.path.join(self.directory, CLIENT_NAME),
+                         lambda temp_path: shutil.copyfile(CLIENT_SOURCE, temp_path))
+
+    def publish(self, telem, plot_start, plot_stop):
+        '''
+        Publish whatever's new in telem since the last call (or the last run).
+
+        :param telem: A dict of telemetry keyed by MSID (anything with times and vals), e.g. from fetch_planned()
+        :param plot_start, plot_stop: The window the client should show (datetimes, dates or CXC seconds).
+            Chunks that end before plot_start are dropped.
+
+        Returns how many samples (after decimation) were published.
+        '''
+        window = [float(cxctime_to_unix(start_secs(plot_start))), float(cxctime_to_unix(start_secs(plot_stop)))]
+        bin_width = (window[1] - window[0]) / max(1, self.points_per_panel // 2)
+
+        # Only the samples newer than the last ones we published. Nothing else is touched.
+        new_series = {}
+        for msid in self.msids:
+            if msid not in telem or len(telem[msid].times) == 0:
+                continue
+            times = np.asarray(telem[msid].times)
+            vals = np.asarray(telem[msid].vals)
+            if vals.dtype.kind not in 'iufb':
+                # State MSIDs are published as their raw (numeric) values
+                vals = np.asarray(getattr(telem[msid], 'raw_vals', vals))
+                if vals.dtype.kind not in 'iufb':
+                    continue
+
+            first_new = np.searchsorted(times, self.manifest['last_cxctime'].get(msid, -np.inf), side='right')
+            if first_new == len(times):
+                continue
+            self.manifest['last_cxctime'][msid] = float(times[-1])
+
+            unix_times = cxctime_to_unix(times[first_new:])
+            in_window = unix_times >= window[0]
+            unix_times, new_vals = minmax_decimate_by_width(unix_times[in_window], vals[first_new:][in_window].astype(np.float64),
+                                                            bin_width)
+            if len(unix_times) > 0:
+                new_series[msid] = (unix_times, new_vals)
+
+        if not new_series and window == self.manifest['window']:
+            return 0
+
+        self._delete_retired()
+        self.manifest['window'] = window
+
+        if new_series:
+            self.manifest['chunks'].append(self._write_chunk(new_series, level=0))
+
+        # Drop what's scrolled out of the window
+        for chunk in [chunk for chunk in self.manifest['chunks'] if chunk['last'] < window[0]]:
+            self._retire(chunk)
+
+        self._compact(window, bin_width)
+
+        self.manifest['updated'] = dt.datetime.now().isoformat()
+        write_atomically(os.path.join(self.directory, MANIFEST_NAME), self._write_manifest)
+
+        return sum(len(times) for times, _ in new_series.values())
+
+    def _compact(self, window, bin_width):
+        # Chunks are in time order, with levels that never go up, so each level's chunks are contiguous
+        level = 0
+        while level <= max((chunk['level'] for chunk in self.manifest['chunks']), default=0):
+            same_level = [chunk for chunk in self.manifest['chunks'] if chunk['level'] == level]
+            if len(same_level) >= self.fan_in:
+                merged = {}
+                for chunk in same_level:
+                    for msid, (times, vals) in self._read_chunk(chunk).items():
+                        merged.setdefault(msid, []).append((times, vals))
+                merged_series = {}
+                for msid, pieces in merged.items():
+                    times = np.concatenate([times for times, _ in pieces])
+                    vals = np.concatenate([vals for _, vals in pieces]).astype(np.float64)
+                    in_window = times >= window[0]
+                    times, vals = minmax_decimate_by_width(times[in_window], vals[in_window], bin_width)
+                    if len(times) > 0:
+                        merged_series[msid] = (times, vals)
+
+                position = self.manifest['chunks'].index(same_level[0])
+                for chunk in same_level:
+                    self._retire(chunk)
+                if merged_series:
+                    self.manifest['chunks'].insert(position, self._write_chunk(merged_series, level=level + 1))
+            level += 1
+
+    def _write_chunk(self, series, level):
+        self.manifest['sequence'] += 1
+        file_name = f'chunk.{self.manifest["sequence"]:08d}.f32'
+
+        # Float32 can't hold Unix seconds to better than a couple of minutes, but it can hold the seconds since the
+        # chunk's first sample (to milliseconds, over days)
+        epoch = np.floor(min(times[0] for times, _ in series.values()))
+        counts = [len(series[msid][0]) if msid in series else 0 for msid in self.msids]
+        arrays = []
+        for msid in self.msids:
+            if msid in series:
+                times, vals = series[msid]
+                arrays.extend([times - epoch, vals])
+        data = np.concatenate(arrays).astype('<f4')
+
+        write_atomically(os.path.join(self.directory, file_name), data.tofile)
+
+        return {'file': file_name, 'sequence': self.manifest['sequence'], 'level': level, 'epoch': float(epoch),
+                'first': float(min(times[0] for times, _ in series.values())),
+                'last': float(max(times[-1] for times, _ in series.values())),
+                'counts': counts, 'bytes': int(data.nbytes)}
+
+    def _read_chunk(self, chunk):
+        data = np.fromfile(os.path.join(self.directory, chunk['file']), dtype='<f4')
+        series = {}
+        offset = 0
+        for msid, count in zip(self.manifest['msids'], chunk['counts']):
+            if count > 0:
+                series[msid] = (chunk['epoch'] + data[offset:offset + count].astype(np.float64),
+                                data[offset + count:offset + 2 * count])
+            offset += 2 * count
+        return series
+
+    def _retire(self, chunk):
+        self.manifest['chunks'].remove(chunk)
+        self._retired.append(chunk['file'])
+
+    def _delete_retired(self):
+        for file_name in self._retired:
+            try:
+                os.remove(os.path.join(self.directory, file_name))
+            except OSError:
+                pass
+        self._retired = []
+
+    def _write_manifest(self, temp_path):
+        with open(temp_path, 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file, separators=(',', ':'))
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+'''
+Deadlines and per-operation timeouts that work anywhere: the main thread,
+worker threads, and asyncio tasks.
+
+heartbeat.force_timeout() uses SIGALRM, which only works in the main thread,
+so nothing wrapped in it could ever run on a thread pool or an event loop.
+Instead:
+
+    with Deadline(600, name='monitor_telemetry iteration'):
+        telem = fetch_planned(...)              # every FetchClient fetch is bounded by the deadline
+        with stage('realtime dashboard', timeout=120):
+            make_realtime_plot(...)
+
+Anything that blows its budget raises DeadlineExceeded, which names the stage
+(and is a TimeoutException, so the monitors' existing handlers still catch it).
+'''
+
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+# The Deadline that applies to whatever is running right now. contextvars follow
+# asyncio tasks automatically, and call_with_timeout() / FetchEngine carry them into threads.
+_current_deadline = contextvars.ContextVar('hrcsentinel_deadline', default=None)
+
+# The CallSlot (see call_slot()) that whatever is running right now counts against, if any
+_current_slot = contextvars.ContextVar('hrcsentinel_call_slot', default=None)
+
+
+class TimeoutException(Exception):
+    # Lives here (and is re-exported by heartbeat) so that fetch_client can use deadlines without a circular import
+    pass
+
+
+class DeadlineExceeded(TimeoutException):
+    '''
+    Raised when an operation runs past its own timeout or its Deadline.
+    '''
+
+    def __init__(self, stage, budget, deadline_name=None):
+        self.stage = stage
+        self.budget = budget
+        self.deadline_name = deadline_name
+        message = f'{stage} exceeded its {budget:.3g} s budget'
+        if deadline_name is not None:
+            message += f' (in {deadline_name})'
+        super().__init__(message)
+
+
+class Deadline:
+    '''
+    A point in time by which a whole unit of work (e.g. one monitor loop
+    iteration) has to be done. Use it as a context manager to make it the
+    current deadline for everything called inside, including fetches made on
+    FetchEngine worker threads and in asyncio tasks.
+    '''
+
+    def __init__(self, seconds, name='deadline'):
+        self.seconds = seconds
+        self.name = name
+        self.started = time.monotonic()
+        self.expires = self.started + seconds
+        # (stage, seconds it took) for everything run with stage() under this deadline
+        self.stages = []
+        self._token = None
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+    def budget(self, timeout=None):
+        '''
+        The time an operation may take: its own timeout, or whatever's left of the deadline if that's sooner.
+        '''
+        if timeout is None:
+            return self.remaining()
+        return min(timeout, self.remaining())
+
+    def check(self, stage='iteration'):
+        '''
+        Raise DeadlineExceeded if the deadline has already passed
+        '''
+        if self.expired():
+            raise DeadlineExceeded(stage, self.seconds, self.name)
+
+    def __enter__(self):
+        self._token = _current_deadline.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current_deadline.reset(self._token)
+        return False
+
+
+def current_deadline():
+    '''
+    The Deadline in effect for the calling code, or None
+    '''
+    return _current_deadline.get()
+
+
+def effective_timeout(timeout=None):
+    '''
+    Combine an operation's own timeout with the current deadline (if any). None means "no limit".
+    '''
+    deadline = current_deadline()
+    if deadline is None:
+        return timeout
+    return deadline.budget(timeout)
+
+
+class CallSlot:
+    '''
+    One of a limited number of places for calls to run in (a FetchEngine has max_workers of them).
+    It's freed when everyone holding it lets go, which for a call that call_with_timeout()
+    abandoned is whenever that call finally returns.
+    '''
+
+    def __init__(self, semaphore):
+        self._semaphore = semaphore
+        self._holders = 1
+        self._lock = threading.Lock()
+
+    def hold(self):
+        with self._lock:
+            self._holders += 1
+
+    def release(self):
+        with self._lock:
+            self._holders -= 1
+            freed = self._holders == 0
+        if freed:
+            self._semaphore.release()
+
+
+@contextmanager
+def call_slot(semaphore, timeout=None, stage='call'):
+    '''
+    Take one of semaphore's slots for everything run inside, waiting at most timeout
+    seconds (or until the current deadline) for one to come free.
+    '''
+    timeout = effective_timeout(timeout)
+    if not semaphore.acquire(timeout=None if timeout is None else max(0.0, timeout)):
+        deadline = current_deadline()
+        raise DeadlineExceeded(f'{stage} (waiting for a free slot, held by earlier calls that timed out)',
+                               timeout, deadline.name if deadline else None)
+
+    slot = CallSlot(semaphore)
+    token = _current_slot.set(slot)
+    try:
+        yield slot
+    finally:
+        _current_slot.reset(token)
+        slot.release()
+
+
+def call_with_timeout(function, *args, timeout=None, stage=None, **kwargs):
+    '''
+    Call function(*args, **kwargs), but give up after timeout seconds (or when
+    the current deadline passes, whichever is sooner) and raise DeadlineExceeded.
+
+    The call runs on its own daemon thread, so this works from any thread.
+    Python can't kill a thread, so a call that hangs is abandoned rather than stopped:
+    it keeps running in the background until it returns (or the process exits).
+    Inside a call_slot(), it keeps that slot taken until then, too.
+    '''
+    stage = stage if stage is not None else getattr(
+        function, '__name__', 'call')
+    timeout = effective_timeout(timeout)
+
+    if timeout is None:
+        return function(*args, **kwargs)
+
+    deadline = current_deadline()
+    if timeout <= 0:
+        raise DeadlineExceeded(stage, 0.0, deadline.name if deadline else None)
+
+    results = queue.Queue(maxsize=1)
+    context = contextvars.copy_context()
+    slot = _current_slot.get()
+    if slot is not None:
+        slot.hold()
+
+    def run():
+        try:
+            results.put((True, context.run(function, *args, **kwargs)))
+        except BaseException as e:
+            results.put((False, e))
+        finally:
+            if slot is not None:
+                slot.release()
+
+    threading.Thread(target=run, daemon=True,
+                     name=f'hrcsentinel-{stage}').start()
+
+    try:
+        succeeded, result = results.get(timeout=timeout)
+    except queue.Empty:
+        raise DeadlineExceeded(
+            stage, timeout, deadline.name if deadline else None) from None
+
+    if not succeeded:
+        raise result
+    return result
+
+
+@contextmanager
+def stage(name, timeout=None):
+    '''
+    Time a block of work against its own budget (and the current deadline).
+
+    This can't interrupt the block (matplotlib, for one, has to stay on the
+    thread it started on), so it checks on the way in that there's any time
+    left at all, and on the way out that the block didn't run over. Either
+    way, DeadlineExceeded says which stage was to blame. For calls that must
+    actually be cut off, use call_with_timeout().
+    '''
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.check(name)
+
+    started = time.monotonic()
+    yield
+    elapsed = time.monotonic() - started
+
+    if deadline is not None:
+        deadline.stages.append((name, elapsed))
+
+    if timeout is not None and elapsed > timeout:
+        raise DeadlineExceeded(
+            name, timeout, deadline.name if deadline else None)
+    if deadline is not None:
+        deadline.check(name)
+
+
+async def wait_for(awaitable, timeout=None, stage='task'):
+    '''
+    asyncio.wait_for(), bounded by the current deadline too, raising DeadlineExceeded instead of asyncio.TimeoutError
+    '''
+    timeout = effective_timeout(timeout)
+    try:
+        return await asyncio.wait_for(awaitable, timeout=timeout)
+    except asyncio.TimeoutError:
+        deadline = current_deadline()
+        raise DeadlineExceeded(
+            stage, timeout, deadline.name if deadline else None) from None
+
+
+async def to_thread(function, *args, timeout=None, stage=None, **kwargs):
+    '''
+    Run a blocking call (e.g. a FetchClient fetch) from an asyncio task without
+    blocking the event loop, bounded by timeout and the current deadline.
+    '''
+    stage = stage if stage is not None else getattr(
+        function, '__name__', 'call')
+    return await wait_for(asyncio.to_thread(function, *args, **kwargs), timeout=timeout, stage=stage)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+
+def minmax_decimate(times, vals, n_bins):
+    '''
+    Split the series into n_bins equal-width time bins and keep only the
+    minimum and maximum sample in each one (in their original order). At most
+    2 * n_bins points survive, and a single-sample spike (like a shield rate
+    excursion) always does, because it's the max (or min) of its bin.
+
+    Series that are already short enough, or that aren't numeric (e.g. state
+    MSIDs like CCSDSTMF), are handed back untouched. Assumes times are sorted,
+    which they always are from cheta and MAUDE.
+
+    :param times: Sample times (CXC seconds)
+    :param vals: Sample values, the same length as times
+    :param n_bins: How many bins to reduce the series to
+    '''
+
+    times = np.asarray(times)
+    vals = np.asarray(vals)
+
+    if n_bins < 1 or len(times) <= 2 * n_bins or vals.dtype.kind not in 'iuf':
+        return times, vals
+
+    edges = np.linspace(times[0], times[-1], n_bins + 1)
+    bin_ids = np.clip(np.searchsorted(
+        edges, times, side='right') - 1, 0, n_bins - 1)
+
+    keep = _bin_extremes(vals, bin_ids)
+    return times[keep], vals[keep]
+
+
+def minmax_decimate_by_width(times, vals, bin_width):
+    '''
+    minmax_decimate(), but with bins bin_width seconds wide, lined up on multiples
+    of bin_width rather than on the series' first sample. So a series decimated in
+    pieces (e.g. each new tail of samples as it arrives) falls into the same bins
+    as it would all in one go, and redecimating the joined-up pieces gives the same
+    answer as decimating the lot.
+    '''
+
+    times = np.asarray(times)
+    vals = np.asarray(vals)
+
+    if bin_width <= 0 or len(times) <= 2 or vals.dtype.kind not in 'iuf':
+        return times, vals
+
+    keep = _bin_extremes(vals, np.floor(times / bin_width).astype(np.int64))
+    return times[keep], vals[keep]
+
+
+def _bin_extremes(vals, bin_ids):
+    '''
+    The indices of the first minimum and first maximum sample in each bin, in order.
+    bin_ids must never decrease (which they don't, for sorted times).
+    '''
+
+    # Times are sorted, so each occupied bin is one contiguous run of samples
+    run_starts_mask = np.r_[True, bin_ids[1:] != bin_ids[:-1]]
+    run_starts = np.flatnonzero(run_starts_mask)
+    run_of_sample = np.cumsum(run_starts_mask) - 1
+
+    # fmin/fmax skip NaNs, so a single dropout doesn't wipe out its whole bin
+    run_mins = np.fmin.reduceat(vals, run_starts)
+    run_maxes = np.fmax.reduceat(vals, run_starts)
+
+    keep = []
+    for run_extremes in (run_mins, run_maxes):
+        candidates = np.flatnonzero(vals == run_extremes[run_of_sample])
+        # The first sample in each run that hits the extreme
+        _, first = np.unique(run_of_sample[candidates], return_index=True)
+        keep.append(candidates[first])
+
+    # union1d sorts too, so the min and max of each bin stay in time order
+    return np.union1d(keep[0], keep[1])
+
+
+def panel_width_pixels(ax):
+    '''
+    How wide (in pixels, at the figure's dpi) a matplotlib Axes is.
+    '''
+    return int(np.ceil(ax.get_window_extent().width))
+
+
+def decimate_for_axes(ax, times, vals, points_per_pixel=2):
+    '''
+    Reduce a full-resolution series to about points_per_pixel points per pixel
+    of the panel it's about to be plotted on. Anything more is invisible, but
+    still costs matplotlib time and memory to draw.
+
+    >>> times, vals = decimate_for_axes(ax, telem['2SHEV1RT'].times, telem['2SHEV1RT'].vals)
+    >>> ax.plot_date(cxc2pd(times), vals, markersize=1)
+    '''
+    # Each bin keeps two points (its min and max)
+    n_bins = max(1, int(panel_width_pixels(ax) * points_per_pixel / 2))
+    return minmax_decimate(times, vals, n_bins)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import numpy as np
+from cxotime import CxoTime
+
+from fetch_client import CachedMsid, FetchClient, start_secs
+
+
+class DeltaPoller:
+    '''
+    "Give me everything since I last asked." Each consumer (monitor_comms,
+    monitor_anomaly, ...) owns a DeltaPoller, which keeps a cursor per MSID
+    (the timestamp of the last sample that consumer has seen) and only ever
+    fetches the samples newer than it.
+
+    Before this, every poll asked for a fixed lookback (the last 300 s, 30 min,
+    8 h, two days...) no matter what we already had, and re-processed thousands
+    of samples to look at a handful of new ones.
+
+    >>> poller = DeltaPoller(['2PRBSCR', '2SHEV1RT'])
+    >>> new = poller.poll(start=CxoTime.now() - 8 * u.h)  # only what's new since the last poll
+    >>> poller.window()['2PRBSCR'].vals[-1]  # the latest value, even if nothing new came in
+    '''
+
+    def __init__(self, msids, client=None, bus=None, window_seconds=None):
+        '''
+        :param msids: The MSIDs this consumer cares about
+        :param client: The FetchClient to poll with. Defaults to full-resolution MAUDE.
+        :param bus: A TelemetryBusClient. If given, poll the telemetry bus instead (for a MAUDE client, in the client's units).
+        :param window_seconds: How much history to hold on to for window(). By default, just the latest sample of each MSID.
+        '''
+        self.msids = list(msids)
+        self.client = client if client is not None else FetchClient(
+            'maude', allow_subset=False)
+        self.bus = bus
+        self.window_seconds = window_seconds
+
+        self.cursors = {}
+        self._retained = {}
+
+    def poll(self, start):
+        '''
+        Fetch only the samples newer than each MSID's cursor, and return them as
+        a dict of CachedMsids keyed by MSID (empty ones if nothing new came in).
+
+        :param start: The earliest time this consumer cares about. Used for MSIDs we haven't
+                      seen yet, and cursors older than this (e.g. after a long LOS) are ignored.
+        '''
+
+        earliest = start_secs(start)
+        cursors = {msid: max(self.cursors.get(msid, earliest), earliest)
+                   for msid in self.msids}
+        fetch_start = min(cursors.values())
+
+        if self.bus is not None and self.client.source == 'maude':
+            # In the same units (and with the same state codes) our own client would fetch
+            data = self.bus.get_telem(self.msids, start=fetch_start, unit_system=self.client.unit_system,
+                                      state_codes=self.client.state_codes)
+        else:
+            data = self.client.get_telem(self.msids, start=fetch_start)
+
+        new_samples = {}
+        for msid in self.msids:
+            times = np.asarray(data[msid].times)
+            vals = np.asarray(data[msid].vals)
+
+            # Anything at or before the cursor we've already handed to this consumer
+            if msid in self.cursors:
+                new = times > cursors[msid]
+            else:
+                new = times >= cursors[msid]
+
+            new_samples[msid] = CachedMsid(msid, times[new], vals[new])
+
+            if np.any(new):
+                self.cursors[msid] = times[new][-1]
+                self._retain(msid, new_samples[msid])
+
+        return new_samples
+
+    def _retain(self, msid, new_samples):
+
+        if self.window_seconds is None:
+            # Just hang on to the latest sample
+            self._retained[msid] = CachedMsid(
+                msid, new_samples.times[-1:], new_samples.vals[-1:])
+            return
+
+        if msid in self._retained:
+            retained = self._retained[msid]
+            times = np.concatenate([retained.times, new_samples.times])
+            vals = np.concatenate([retained.vals, new_samples.vals])
+        else:
+            times, vals = new_samples.times, new_samples.vals
+
+        keep = times >= CxoTime.now().secs - self.window_seconds
+        self._retained[msid] = CachedMsid(msid, times[keep], vals[keep])
+
+    def window(self):
+        '''
+        Return what we've held on to for each MSID (the latest sample, or the last
+        window_seconds of them) as a dict of CachedMsids, without fetching anything.
+        '''
+        if self.window_seconds is not None:
+            # Nothing new may have come in for a while, so trim the head of the window here too
+            oldest_allowed = CxoTime.now().secs - self.window_seconds
+            for msid, retained in self._retained.items():
+                keep = retained.times >= oldest_allowed
+                self._retained[msid] = CachedMsid(
+                    msid, retained.times[keep], retained.vals[keep])
+
+        return dict(self._retained)
+
+    def reset(self):
+        '''
+        Forget every cursor, so the next poll starts over from its start time.
+        '''
+        self.cursors = {}
+        self._retained = {}
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+import threading
+
+import maude
+import numpy as np
+import requests
+from cheta import fetch
+from cxotime import CxoTime
+
+from chandratime import convert_to_doy
+import fetch_metrics
+from deadlines import DeadlineExceeded, call_with_timeout, current_deadline, effective_timeout
+from global_configuration import maude_standin_url
+
+# cheta's fetch.data_source is process-global, so any fetch that goes through cheta
+# has to hold this lock. Plain MAUDE fetches don't touch cheta at all and never wait on it.
+# It's taken by the caller (for no longer than its timeout) and released by the fetch itself
+# when it's done, even if the caller gave up on it long before, see FetchClient._call_cheta().
+_cheta_lock = threading.Lock()
+
+
+def start_secs(start):
+    '''
+    Turn a window start given as CXC seconds, a CxoTime, or a datetime/date
+    (which, as everywhere else in HRCSentinel, is floored to the start of its day)
+    into CXC seconds.
+    '''
+    if isinstance(start, (int, float, np.number)):
+        return float(start)
+    if hasattr(start, 'secs'):
+        return float(start.secs)
+    if isinstance(start, str):
+        return CxoTime(start).secs
+    return CxoTime(convert_to_doy(start)).secs
+
+
+class CachedMsid:
+    '''
+    A lightweight stand-in for a cheta MSID object. It only carries the
+    attributes that our dashboards actually use (times, vals and, for state
+    MSIDs, raw_vals), so the plotting code can treat it exactly like the
+    result of fetch.get_telem().
+    '''
+
+    def __init__(self, msid, times, vals, raw_vals=None):
+        self.msid = msid
+        self.times = times
+        self.vals = vals
+        self.raw_vals = raw_vals
+
+    def __len__(self):
+        return len(self.times)
+
+
+class FetchClient:
+    '''
+    A fetch handle that carries its own data source and options, instead of
+    relying on (and flipping) the process-global fetch.data_source.
+
+    MAUDE clients talk to MAUDE directly, so they are safe to use from any
+    thread and never block (or get blocked by) CXC archive fetches. CXC clients,
+    and MAUDE clients created with state_codes=True or a unit_system other than
+    'eng' (which need cheta to turn MAUDE's state codes into raw_vals, or to
+    convert units), go through cheta one at a time.
+
+    >>> maude_client = FetchClient('maude', allow_subset=False)
+    >>> cxc_client = FetchClient('cxc')
+    >>> telem = maude_client.get_telem(['2P15VBVL', '2PRBSCR'], start='2023:101')
+    >>> telem['2PRBSCR'].vals[-1]
+    '''
+
+    def __init__(self, source='maude', allow_subset=True, highrate=False, state_codes=False, unit_system='eng', retries=0, timeout=None):
+        if source not in ('maude', 'cxc'):
+            raise ValueError(
+                f"Data source must be 'maude' or 'cxc', not '{source}'")
+
+        self.source = source
+        self.allow_subset = allow_subset
+        self.highrate = highrate
+        self.state_codes = state_codes
+        self.unit_system = unit_system
+        # How many times to retry a failed fetch before giving up (MAUDE hiccups are common)
+        self.retries = retries
+        # Give up on a single request after this many seconds (None means wait forever,
+        # unless there's a deadlines.Deadline in effect, which always applies)
+        self.timeout = timeout
+
+    @property
+    def data_source(self):
+        '''
+        The equivalent cheta data source string, e.g. 'maude allow_subset=False'
+        '''
+        if self.source == 'cxc':
+            return 'cxc'
+        options = f'allow_subset={self.allow_subset}'
+        if self.highrate:
+            options += ' highrate=True'
+        return f'maude {options}'
+
+    def _key(self):
+        return (self.source, self.allow_subset, self.highrate, self.state_codes, self.unit_system)
+
+    def __eq__(self, other):
+        return isinstance(other, FetchClient) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return f"FetchClient('{self.data_source}')"
+
+    def get_telem(self, msids, start, stop=None, sampling='full'):
+        '''
+        Fetch one or more MSIDs and return a dict of MSID-like objects keyed by
+        MSID (each with .times and .vals, just like fetch.get_telem()).
+
+        :param msids: An MSID or list of MSIDs
+        :param start: The start of the window, as a datetime/date, CxoTime, DOY string, or CXC seconds
+        :param stop: The end of the window (same formats), or None for "up to now"
+        :param sampling: 'full', '5min' or 'daily'. MAUDE only does 'full'.
+        '''
+
+        if isinstance(msids, str):
+            msids = [msids]
+
+        # Every request is timed and counted, see fetch_metrics.py
+        with fetch_metrics.recorder.measure(self.data_source, msids, start, stop) as measurement:
+            for attempt in range(self.retries + 1):
+                try:
+                    if self._uses_cheta():
+                        telem = self._call_cheta(msids, start, stop, sampling)
+                    else:
+                        telem = call_with_timeout(self._get_telem, msids, start, stop, sampling,
+                                                  timeout=self.timeout, stage=self._stage_name(msids))
+                    break
+                except Exception:
+                    if attempt == self.retries:
+                        raise
+                    measurement.retries += 1
+            measurement.result(telem)
+
+        return telem
+
+    def _stage_name(self, msids):
+        # What a DeadlineExceeded will say timed out
+        shown = ', '.join(msids[:3]) + (f' (+{len(msids) - 3} more)' if len(msids) > 3 else '')
+        return f'{self.data_source} fetch of {shown}'
+
+    def _uses_cheta(self):
+        # MAUDE hands back engineering units and state codes, so anything else goes through cheta
+        if self.source == 'maude':
+            return maude_standin_url is None and (self.state_codes or self.unit_system != 'eng')
+        return True
+
+    def _call_cheta(self, msids, start, stop, sampling):
+        # A hung cheta fetch can only be abandoned, not stopped, and it holds the cheta lock until it
+        # returns. So wait for the lock no longer than we'd wait for the fetch, and hand it over to
+        # the fetch, which releases it whenever it finishes.
+        stage = self._stage_name(msids)
+        timeout = effective_timeout(self.timeout)
+        if not _cheta_lock.acquire(timeout=-1 if timeout is None else max(0.0, timeout)):
+            deadline = current_deadline()
+            raise DeadlineExceeded(f'{stage} (waiting for the cheta lock, held by an earlier fetch that hung)',
+                                   timeout, deadline.name if deadline else None)
+
+        # Whoever gets here first owns the lock: the fetch if it starts, the caller if it gave up before then
+        handover = threading.Lock()
+        state = {'fetch': 'pending'}
+
+        def locked_fetch():
+            with handover:
+                if state['fetch'] == 'abandoned':
+                    return None
+                state['fetch'] = 'running'
+            try:
+                return self._get_telem(msids, start, stop, sampling)
+            finally:
+                _cheta_lock.release()
+
+        try:
+            return call_with_timeout(locked_fetch, timeout=self.timeout, stage=stage)
+        except BaseException:
+            with handover:
+                if state['fetch'] == 'pending':
+                    state['fetch'] = 'abandoned'
+                    _cheta_lock.release()
+            raise
+
+    def _get_telem(self, msids, start, stop, sampling):
+        if self.source == 'maude' and maude_standin_url is not None:
+            # We're replaying a recorded pass with maude_standin.py
+            if sampling != 'full':
+                raise ValueError(
+                    f"MAUDE only serves full-resolution data, not '{sampling}'")
+            return self._get_standin(msids, start, stop)
+
+        # MAUDE hands back engineering units and state codes, so anything else goes through cheta
+        if self.source == 'maude' and not self.state_codes and self.unit_system == 'eng':
+            if sampling != 'full':
+                raise ValueError(
+                    f"MAUDE only serves full-resolution data, not '{sampling}'")
+            return self._get_maude(msids, start, stop)
+
+        return self._get_cheta(msids, start, stop, sampling)
+
+    def _get_maude(self, msids, start, stop):
+        out = maude.get_msids(msids,
+                              start=CxoTime(start_secs(start)).date,
+                              stop=CxoTime(start_secs(stop)).date if stop is not None else None,
+                              allow_subset=self.allow_subset,
+                              highrate=self.highrate)
+
+        telem = {}
+        for data in out['data']:
+            times = np.asarray(data['times'])
+            vals = np.asarray(data['values'])
+            # Numeric MSIDs have no separate raw values. State MSIDs need state_codes=True.
+            raw_vals = vals if vals.dtype.kind in 'iuf' else None
+            telem[data['msid']] = CachedMsid(data['msid'], times, vals, raw_vals)
+
+        return telem
+
+    def _get_standin(self, msids, start, stop):
+        params = {'msids': ','.join(msids),
+                  'start': start_secs(start),
+                  'allow_subset': self.allow_subset,
+                  'highrate': self.highrate,
+                  'unit_system': self.unit_system}
+        if stop is not None:
+            params['stop'] = start_secs(stop)
+
+        response = requests.get(f'{maude_standin_url}/msids', params=params, timeout=60)
+        response.raise_for_status()
+
+        telem = {}
+        for data in response.json()['data']:
+            times = np.asarray(data['times'])
+            vals = np.asarray(data['values'])
+            if 'raw_values' in data:
+                raw_vals = np.asarray(data['raw_values'])
+            else:
+                raw_vals = vals if vals.dtype.kind in 'iuf' else None
+            telem[data['msid']] = CachedMsid(data['msid'], times, vals, raw_vals)
+
+        return telem
+
+    def _get_cheta(self, msids, start, stop, sampling):
+        # The caller holds _cheta_lock
+        with fetch.data_source(self.data_source):
+            data = fetch.get_telem(msids,
+                                   start=CxoTime(start_secs(start)).date,
+                                   stop=CxoTime(start_secs(stop)).date if stop is not None else None,
+                                   sampling=sampling, unit_system=self.unit_system,
+                                   max_fetch_Mb=100000, max_output_Mb=100000, quiet=True)
+
+        return {msid: data[msid] for msid in msids}
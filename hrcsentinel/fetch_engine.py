@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from deadlines import DeadlineExceeded, call_slot, current_deadline, effective_timeout
+
+
+class FetchEngine:
+    '''
+    A bounded thread pool for telemetry (and other network) fetches. Plotters
+    submit MSID batches and get futures back, so a dozen independent fetches
+    per refresh take about as long as the slowest one rather than their sum.
+
+    Each worker thread also gets its own keep-alive requests.Session for our
+    own HTTP downloads (web-Kadi, GOES), so we stop paying a TLS handshake on
+    every request.
+
+    >>> engine = FetchEngine(max_workers=6)
+    >>> future = engine.submit(FetchClient('maude'), ['2P15VBVL', '2PRBSCR'], start='2023:101')
+    >>> telem = future.result(timeout=60)
+
+    Work submitted from inside a deadlines.Deadline runs under that same
+    deadline on the worker thread, so its fetches are bounded by it too.
+
+    A fetch that times out can only be abandoned, not stopped, so it keeps
+    its place against max_workers until it really returns. While too many
+    are hanging, new work waits for a free slot (up to timeout seconds)
+    rather than piling even more requests onto a struggling server.
+    '''
+
+    def __init__(self, max_workers=6, timeout=120, batch_size=8):
+        '''
+        :param max_workers: How many fetches may be in flight at once, counting abandoned ones. Be kind to MAUDE.
+        :param timeout: Default per-request timeout (seconds) used by gather()
+        :param batch_size: How many MSIDs to put in each request when splitting up a large list
+        '''
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='hrcsentinel-fetch')
+        self._local = threading.local()
+        # One slot per request really in flight, whether or not anyone's still waiting for it
+        self._slots = threading.Semaphore(max_workers)
+
+    def session(self):
+        '''
+        Return this thread's keep-alive requests.Session, creating it on first use.
+        '''
+        if not hasattr(self._local, 'session'):
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._local.session = session
+        return self._local.session
+
+    def submit(self, client, msids, start, stop=None, sampling='full'):
+        '''
+        Fetch a batch of MSIDs with the given FetchClient on a worker thread.
+        Returns a Future whose result is the same dict client.get_telem() returns.
+        '''
+        return self._submit(client.get_telem, msids, start, stop=stop, sampling=sampling)
+
+    def submit_batches(self, client, msids, start, stop=None, sampling='full'):
+        '''
+        Split a long MSID list into batches of batch_size and submit each one.
+        Returns a list of Futures.
+        '''
+        msids = list(msids)
+        return [self.submit(client, msids[i:i + self.batch_size], start, stop=stop, sampling=sampling)
+                for i in range(0, len(msids), self.batch_size)]
+
+    def submit_call(self, function, *args, **kwargs):
+        '''
+        Run any other slow call (a GOES or Kadi download, say) on the pool.
+        '''
+        return self._submit(function, *args, **kwargs)
+
+    def submit_download(self, function, *args, **kwargs):
+        '''
+        Like submit_call(), but for functions that take a session= keyword (e.g.
+        goes_proxy.get_goes_proxy). The worker passes in its own pooled session.
+        '''
+        def call():
+            return function(*args, session=self.session(), **kwargs)
+        return self._submit(call)
+
+    def _submit(self, function, *args, **kwargs):
+        # Carry the caller's context (and so its Deadline, if any) over to the worker thread
+        return self._executor.submit(contextvars.copy_context().run, self._run_in_slot, function, *args, **kwargs)
+
+    def _run_in_slot(self, function, *args, **kwargs):
+        with call_slot(self._slots, timeout=self.timeout, stage='fetch engine'):
+            return function(*args, **kwargs)
+
+    def gather(self, futures, timeout=None, stage='fetch'):
+        '''
+        Wait for a list of telemetry futures and merge their results into one dict keyed by MSID.
+        Raises deadlines.DeadlineExceeded (naming the stage) if they don't all finish within
+        the timeout or the current deadline, or the first exception any of them raised.
+        '''
+        timeout = effective_timeout(self.timeout if timeout is None else timeout)
+
+        done, not_done = wait(futures, timeout=timeout)
+        if len(not_done) > 0:
+            for future in not_done:
+                future.cancel()
+            deadline = current_deadline()
+            raise DeadlineExceeded(f'{stage} ({len(not_done)} of {len(futures)} requests unfinished)',
+                                   timeout, deadline.name if deadline else None)
+
+        telem = {}
+        for future in futures:
+            telem.update(future.result())
+        return telem
+
+    def fetch(self, client, msids, start, stop=None, sampling='full', timeout=None, stage='fetch'):
+        '''
+        Convenience wrapper: submit_batches() and gather() in one go.
+        '''
+        return self.gather(self.submit_batches(client, msids, start, stop=stop, sampling=sampling),
+                           timeout=timeout, stage=stage)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+
+'''
+Instrumentation for every telemetry fetch HRCSentinel makes.
+
+FetchClient.get_telem() (and the telemetry bus client) report each request
+here: which MSIDs, from which source, over what window, how many rows and
+bytes came back, how long it took, how many retries it needed, and whether
+it failed. The monitors call end_iteration() once per loop, which
+
+    - rewrites a Prometheus-style text file (<process>.prom) with running totals, and
+    - appends that iteration's numbers to a rolling JSON log (<process>.jsonl)
+
+in the metrics directory. To find out where the time actually goes, run
+
+    ./fetch_metrics.py --top 10
+'''
+
+import argparse
+import glob
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from global_configuration import metrics_directory
+
+
+def _new_totals():
+    return {'requests': 0, 'failures': 0, 'retries': 0, 'rows': 0, 'bytes': 0, 'seconds': 0.0}
+
+
+class FetchMetrics:
+    '''
+    Thread-safe running totals of fetch activity, both since the process started
+    and since the last end_iteration(). Use the module-level recorder rather than making your own.
+    '''
+
+    def __init__(self):
+        self.process_name = None
+        self.directory = None
+        self.max_log_bytes = 5 * 1024 * 1024
+
+        self._lock = threading.Lock()
+        self._iteration_counter = 0
+        self._iteration_started = time.time()
+        self._errors = []
+
+        # Keyed by source (e.g. 'maude allow_subset=False'), and by (msid, source)
+        self._source_totals = defaultdict(_new_totals)
+        self._msid_totals = defaultdict(_new_totals)
+        self._iteration_source_totals = defaultdict(_new_totals)
+        self._iteration_msid_totals = defaultdict(_new_totals)
+
+    def configure(self, process_name, directory=metrics_directory):
+        '''
+        Start exporting. Until this is called, fetches are still counted but nothing is written to disk.
+
+        :param process_name: Used in the file names and as the Prometheus 'process' label, e.g. 'monitor_telemetry'
+        :param directory: Where to write <process_name>.prom and <process_name>.jsonl
+        '''
+        self.process_name = process_name
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, source, msids, start, stop, rows, nbytes, seconds, retries=0, failed=False, error=None):
+        '''
+        Record one fetch request.
+
+        :param rows: A dict of rows returned per MSID (empty if the request failed)
+        :param nbytes: A dict of bytes returned per MSID
+        :param seconds: Wall time of the whole request, including retries
+        '''
+
+        total_rows = sum(rows.values())
+
+        with self._lock:
+            for totals in (self._source_totals[source], self._iteration_source_totals[source]):
+                totals['requests'] += 1
+                totals['failures'] += int(failed)
+                totals['retries'] += retries
+                totals['rows'] += total_rows
+                totals['bytes'] += sum(nbytes.values())
+                totals['seconds'] += seconds
+
+            for msid in msids:
+                # A batched request can't be timed per MSID, so split its wall time by each MSID's share of the rows
+                if total_rows > 0:
+                    msid_seconds = seconds * rows.get(msid, 0) / total_rows
+                else:
+                    msid_seconds = seconds / len(msids)
+
+                for totals in (self._msid_totals[(msid, source)], self._iteration_msid_totals[(msid, source)]):
+                    totals['requests'] += 1
+                    totals['failures'] += int(failed)
+                    totals['retries'] += retries
+                    totals['rows'] += rows.get(msid, 0)
+                    totals['bytes'] += nbytes.get(msid, 0)
+                    totals['seconds'] += msid_seconds
+
+            if failed:
+                self._errors.append({'source': source, 'msids': list(msids), 'start': start,
+                                     'stop': stop, 'error': error})
+                # Don't let a process that never calls end_iteration() pile these up forever
+                self._errors = self._errors[-100:]
+
+    def measure(self, source, msids, start, stop=None):
+        '''
+        A context manager that times a fetch and records it when the block exits.
+
+        >>> with recorder.measure('maude allow_subset=False', msids, start) as measurement:
+        ...     telem = do_the_fetch()
+        ...     measurement.result(telem)
+        '''
+        return _Measurement(self, source, msids, start, stop)
+
+    def end_iteration(self, label=None):
+        '''
+        Close out one loop iteration: append its numbers to the JSON log, rewrite the
+        Prometheus file, and start counting the next iteration from zero. Returns the
+        iteration's summary as a dict.
+        '''
+
+        with self._lock:
+            self._iteration_counter += 1
+            summary = {'process': self.process_name,
+                       'iteration': self._iteration_counter,
+                       'label': label,
+                       'started': self._iteration_started,
+                       'ended': time.time(),
+                       'sources': dict(self._iteration_source_totals),
+                       'msids': [dict(msid=msid, source=source, **totals)
+                                 for (msid, source), totals in self._iteration_msid_totals.items()],
+                       'errors': self._errors}
+
+            self._iteration_source_totals = defaultdict(_new_totals)
+            self._iteration_msid_totals = defaultdict(_new_totals)
+            self._errors = []
+            self._iteration_started = time.time()
+
+            prometheus_text = self._prometheus_text()
+
+        if self.directory is not None:
+            try:
+                self._append_log(summary)
+                self._write_prometheus(prometheus_text)
+            except OSError as e:
+                # Metrics are nice to have. They must never take a monitor down.
+                print(f'Could not write fetch metrics to {self.directory}: {e}')
+
+        return summary
+
+    def _append_log(self, summary):
+        log_path = os.path.join(self.directory, f'{self.process_name}.jsonl')
+        # Roll the log over once it gets big, keeping a single previous copy
+        if os.path.exists(log_path) and os.path.getsize(log_path) > self.max_log_bytes:
+            os.replace(log_path, log_path + '.1')
+        with open(log_path, 'a') as log_file:
+            log_file.write(json.dumps(summary) + '\n')
+
+    def _write_prometheus(self, prometheus_text):
+        prom_path = os.path.join(self.directory, f'{self.process_name}.prom')
+        # node_exporter's textfile collector must never see a half-written file
+        temp_path = prom_path + '.tmp'
+        with open(temp_path, 'w') as prom_file:
+            prom_file.write(prometheus_text)
+        os.replace(temp_path, prom_path)
+
+    def _prometheus_text(self):
+        process = self.process_name or 'hrcsentinel'
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{val}"' for key, val in
+                                      [('process', process)] + labels)
+                lines.append(f'{name}{{{label_text}}} {value}')
+
+        for field, help_text in (('requests', 'Telemetry fetch requests'),
+                                 ('failures', 'Telemetry fetch requests that raised'),
+                                 ('retries', 'Telemetry fetch retries'),
+                                 ('rows', 'Telemetry samples returned'),
+                                 ('bytes', 'Bytes of telemetry returned'),
+                                 ('seconds', 'Wall time spent fetching telemetry')):
+            metric(f'hrcsentinel_fetch_{field}_total', 'counter', help_text,
+                   [([('source', source)], totals[field]) for source, totals in self._source_totals.items()])
+
+        for field, help_text in (('rows', 'Telemetry samples returned, per MSID'),
+                                 ('bytes', 'Bytes of telemetry returned, per MSID'),
+                                 ('seconds', 'Share of fetch wall time attributable to each MSID')):
+            metric(f'hrcsentinel_msid_fetch_{field}_total', 'counter', help_text,
+                   [([('msid', msid), ('source', source)], totals[field]) for (msid, source), totals in self._msid_totals.items()])
+
+        metric('hrcsentinel_iterations_total', 'counter', 'Loop iterations completed',
+               [([], self._iteration_counter)])
+
+        return '\n'.join(lines) + '\n'
+
+
+class _Measurement:
+
+    def __init__(self, recorder, source, msids, start, stop):
+        self.recorder = recorder
+        self.source = source
+        self.msids = list(msids)
+        self.start = start
+        self.stop = stop
+        self.retries = 0
+        self.rows = {}
+        self.nbytes = {}
+
+    def result(self, telem):
+        '''
+        Note what came back: a dict of MSID-like objects keyed by MSID.
+        '''
+        for msid, data in telem.items():
+            times = np.asarray(data.times)
+            self.rows[msid] = len(times)
+            self.nbytes[msid] = times.nbytes + np.asarray(data.vals).nbytes
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.recorder.record(self.source, self.msids, _as_number(self.start), _as_number(self.stop),
+                             self.rows, self.nbytes, time.perf_counter() - self._started,
+                             retries=self.retries, failed=exc_type is not None,
+                             error=f'{exc_type.__name__}: {exc_value}' if exc_type is not None else None)
+        # Never swallow the exception
+        return False
+
+
+def _as_number(t):
+    # The log is JSON, so keep times as plain CXC seconds (or None)
+    if t is None:
+        return None
+    try:
+        return float(t)
+    except (TypeError, ValueError):
+        return str(t)
+
+
+# Everything in a process reports to this one recorder
+recorder = FetchMetrics()
+
+
+def configure(process_name, directory=metrics_directory):
+    recorder.configure(process_name, directory=directory)
+
+
+def end_iteration(label=None):
+    return recorder.end_iteration(label=label)
+
+
+def summarize(log_paths, top=10):
+    '''
+    Add up every iteration in the given JSON logs and print the top slowest MSIDs and sources.
+    '''
+
+    msid_totals = defaultdict(_new_totals)
+    source_totals = defaultdict(_new_totals)
+    iterations = 0
+
+    for log_path in log_paths:
+        with open(log_path) as log_file:
+            for line in log_file:
+                summary = json.loads(line)
+                iterations += 1
+                for source, totals in summary['sources'].items():
+                    for field, value in totals.items():
+                        source_totals[source][field] += value
+                for entry in summary['msids']:
+                    key = (entry['msid'], entry['source'])
+                    for field in _new_totals():
+                        msid_totals[key][field] += entry[field]
+
+    print(f'{iterations} iterations from {len(log_paths)} log(s)\n')
+
+    print(f'Top {top} sources by total fetch time')
+    print(f"{'Source':<40}{'Seconds':>12}{'Requests':>10}{'Mean (s)':>10}{'Failures':>10}{'Retries':>9}{'MB':>10}")
+    for source, totals in sorted(source_totals.items(), key=lambda item: item[1]['seconds'], reverse=True)[:top]:
+        mean = totals['seconds'] / max(totals['requests'], 1)
+        print(f"{source:<40}{totals['seconds']:>12.1f}{totals['requests']:>10}{mean:>10.2f}{totals['failures']:>10}{totals['retries']:>9}{totals['bytes'] / 1e6:>10.1f}")
+
+    print(f'\nTop {top} MSIDs by total fetch time')
+    print(f"{'MSID':<12}{'Source':<40}{'Seconds':>12}{'Requests':>10}{'Rows':>12}{'Failures':>10}")
+    for (msid, source), totals in sorted(msid_totals.items(), key=lambda item: item[1]['seconds'], reverse=True)[:top]:
+        print(f"{msid:<12}{source:<40}{totals['seconds']:>12.1f}{totals['requests']:>10}{totals['rows']:>12}{totals['failures']:>10}")
+
+
+def get_args():
+    '''Fetch command line args, if given'''
+
+    argparser = argparse.ArgumentParser(
+        description='Summarize the fetch metrics logged by the HRCSentinel monitors.')
+
+    argparser.add_argument("--top", help="How many of the slowest MSIDs and sources to show",
+                           type=int, default=10)
+
+    argparser.add_argument("--directory", help="The metrics directory to read *.jsonl logs from",
+                           default=metrics_directory)
+
+    argparser.add_argument("--log", help="Read just this JSON log instead of every log in the directory",
+                           default=None)
+
+    args = argparser.parse_args()
+    return args
+
+
+def main():
+
+    args = get_args()
+
+    if args.log is not None:
+        log_paths = [args.log]
+    else:
+        log_paths = sorted(glob.glob(os.path.join(args.directory, '*.jsonl*')))
+
+    if len(log_paths) == 0:
+        print(f'No fetch metrics logs found in {args.directory}')
+        return
+
+    summarize(log_paths, top=args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+import msidlists
+from fetch_client import FetchClient
+
+# The dashboard and shield plot want full-resolution MAUDE data with no subsetting,
+# while the motor plots have always been happy with a subset (but need raw_vals for their state MSIDs).
+FULL_RESOLUTION_CLIENT = FetchClient('maude', allow_subset=False)
+MOTOR_CLIENT = FetchClient('maude', allow_subset=True,
+                           state_codes=True, unit_system='sci')
+
+# Panel 11 of the realtime dashboard underplots these on a twin axis
+DASHBOARD_OVERLAY_MSIDS = ['2FIFOAVR', 'CCSDSTMF']
+
+
+def flatten(nested_msidlist):
+    '''
+    Turn a per-panel list of lists (like msidlists.dashboard_msids_latest) into a flat list
+    '''
+    return [msid for panel in nested_msidlist for msid in panel]
+
+
+def plan_refresh(dashboard=True, shield=True, motors=False):
+    '''
+    Collect every MSID needed by a refresh cycle and group them by the
+    FetchClient they should be fetched with. Duplicates (e.g. the event rates,
+    which appear on both the dashboard and the shield plot) are only fetched once.
+
+    Returns a dict like {FetchClient('maude allow_subset=False'): ['2P24VBVL', ...], ...}
+    '''
+
+    plan = {}
+
+    def add(client, msids):
+        # dict.fromkeys() deduplicates while keeping the original order
+        plan[client] = list(dict.fromkeys(plan.get(client, []) + list(msids)))
+
+    if dashboard:
+        add(FULL_RESOLUTION_CLIENT, flatten(
+            msidlists.dashboard_msids_latest) + DASHBOARD_OVERLAY_MSIDS)
+    if shield:
+        add(FULL_RESOLUTION_CLIENT, msidlists.rate_msids)
+    if motors:
+        add(MOTOR_CLIENT, flatten(msidlists.motor_dashboard_msids))
+
+    return plan
+
+
+def fetch_planned(plan, start, telemetry_cache=None, bus=None, client=None, engine=None):
+    '''
+    Issue one batched request per data source in the plan and return a single
+    dict of telemetry keyed by MSID, which every plot function can share.
+
+    :param plan: The output of plan_refresh()
+    :param start: A datetime/date for the beginning of the plot window
+    :param telemetry_cache: If given, only the samples newer than what's already cached are fetched
+    :param bus: A TelemetryBusClient. If given, ask the telemetry bus rather than MAUDE (for each group, in its client's units).
+    :param client: A FetchClient that overrides the planned one for every group (e.g. to force the CXC archive)
+    :param engine: A FetchEngine. If given, every group (split into smaller batches) is fetched in parallel.
+    '''
+
+    telem = {}
+
+    if bus is not None:
+        # One bus request per planned client, in that client's units and with its state codes.
+        # The bus only relays MAUDE, so anything else (e.g. a forced CXC client) is fetched directly.
+        for planned_client, msids in plan.items():
+            group_client = client if client is not None else planned_client
+            if group_client.source == 'maude':
+                telem.update(bus.get_telem(msids, start=start, unit_system=group_client.unit_system,
+                                           state_codes=group_client.state_codes))
+            else:
+                telem.update(group_client.get_telem(msids, start=start))
+        return telem
+
+    if engine is not None and telemetry_cache is None:
+        # Put every group in flight at once, then wait for all of them
+        futures = []
+        for planned_client, msids in plan.items():
+            group_client = client if client is not None else planned_client
+            futures.extend(engine.submit_batches(group_client, msids, start))
+        return engine.gather(futures, stage='planned fetch')
+
+    for planned_client, msids in plan.items():
+        group_client = client if client is not None else planned_client
+        if telemetry_cache is not None:
+            telem.update(telemetry_cache.update_many(
+                msids, start=start, client=group_client, engine=engine))
+        else:
+            telem.update(group_client.get_telem(msids, start=start))
+
+    return telem
@@ -1,3 +1,5 @@
+import os
+
 allowed_hosts = {'han-v': '/proj/web-icxc/htdocs/hrcops/hrcmonitor/plots/',
                  'entropy': '/proj/web-icxc/htdocs/hrcops/hrcmonitor/plots/',
                  'hrccdp1': '/home/hrc/HRCSentinel/staging_area/',
@@ -5,3 +7,30 @@ allowed_hosts = {'han-v': '/proj/web-icxc/htdocs/hrcops/hrcmonitor/plots/',
                  'gravity-2': '/Users/grant/Desktop/',
                  'symmetry': '/Users/grant/Desktop/',
                  'semaphore': '/Users/grant/Desktop/'}
+
+# The Unix socket that telemetry_bus.py listens on. monitor_telemetry, monitor_comms
+# and monitor_anomaly connect here (with --use_bus) instead of polling MAUDE themselves.
+telemetry_bus_address = '/tmp/hrcsentinel_telemetry_bus'
+telemetry_bus_authkey = b'hrcsentinel'
+
+# The memory-mapped record the telemetry bus publishes its comm state to (see comm_state.py).
+# Shared memory where there is some, a plain file (which the page cache keeps in memory) where there isn't.
+comm_state_path = ('/dev/shm/hrcsentinel_comm_state' if os.path.isdir('/dev/shm')
+                   else '/tmp/hrcsentinel_comm_state')
+
+# Where local_archive.py keeps its memory-mapped daily stats for the mission-lifetime plots
+local_archive_directory = os.path.expanduser('~/.hrcsentinel/local_archive')
+
+# Where the monitors write their fetch metrics (a Prometheus text file and a rolling JSON log each)
+metrics_directory = os.path.expanduser('~/.hrcsentinel/metrics')
+
+# What each plot was last published from (see render_fingerprint.py), so unchanged plots aren't redrawn
+render_fingerprint_path = os.path.expanduser('~/.hrcsentinel/render_fingerprints.json')
+
+# How many previous versions of each published plot to keep (in history/, next to the plots; see artifact_publisher.py)
+artifact_history_length = 24
+
+# If set (e.g. HRCSENTINEL_MAUDE_STANDIN=http://localhost:8765), every MAUDE fetch goes to a
+# maude_standin.py replay server instead of the real MAUDE. Handy for testing and load-testing.
+maude_standin_url = os.environ.get('HRCSENTINEL_MAUDE_STANDIN')
+maude_standin_fixture_directory = os.path.expanduser('~/.hrcsentinel/maude_fixtures')
@@ -8,7 +8,7 @@ import requests
 from astropy.table import Table
 from astropy.time import Time
 
-from chandratime import cxctime_to_datetime
+from chandratime import cxctime_to_plotdate
 
 # Globals
 
@@ -25,14 +25,17 @@ data_types = np.dtype([('year', '<i8'), ('month', '<i8'), ('dom', '<i8'), ('hhmm
                                                                                                                                                                                                                        '<f8'), ('p8', '<f8'), ('p9', '<f8'), ('p10', '<f8'), ('p11', '<f8'), ('hrc_shield', '<f8'), ('time', '<f8'), ('p2a', '<f8'), ('p2b', '<f8'), ('p8a', '<f8'), ('p8b', '<f8'), ('p8c', '<f8'), ('satellite', '<i8')])
 
 
-def get_json_data(url):
+def get_json_data(url, session=None):
     """
-    Open the json file and return it as an astropy table
+    Open the json file and return it as an astropy table.
+    Pass a requests.Session (e.g. from a FetchEngine) to reuse its keep-alive connection.
     """
+    if session is None:
+        session = requests
     last_err = None
     for _ in range(3):  # try three times
         try:
-            json_file = requests.get(url)
+            json_file = session.get(url, timeout=30)
             data = json_file.json()
             break
         except Exception as err:
@@ -124,19 +127,19 @@ def calc_hrc_shield(dat):
     return hrc_shield
 
 
-def get_goes_proxy():
+def get_goes_proxy(session=None):
     """
-    Return an GOES proxy times (in datetime format) and rates (in counts per second)
+    Return an GOES proxy times (as matplotlib date numbers) and rates (in counts per second)
     Used for HRCMonitor's shield plot
     """
     # Fetch the raw GOES data
-    raw_goes_data = get_json_data(GOES_7DAY)
+    raw_goes_data = get_json_data(GOES_7DAY, session=session)
 
     # Reformat the table into our standard format
     parsed_goes_data, _bad_goes_data = format_proton_data(
         raw_goes_data, data_types=data_types)
 
-    goes_times = cxctime_to_datetime(parsed_goes_data['time'])
+    goes_times = cxctime_to_plotdate(parsed_goes_data['time'])
     goes_rates = parsed_goes_data['hrc_shield']
 
     return goes_times, goes_rates
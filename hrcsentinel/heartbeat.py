@@ -5,14 +5,25 @@ from astropy import units as u
 import datetime as dt
 import pytz
 from cxotime import CxoTime
-import Ska.engarchive.fetch as fetch
+
+from fetch_client import FetchClient
+from deadlines import Deadline, TimeoutException
+from comm_state import CommStateReader
+from global_configuration import maude_standin_url
 
 from contextlib import contextmanager
 import signal
+import threading
+
 
+# Comm checks always come straight from MAUDE, without touching cheta's global data source.
+# The timeout means a hung MAUDE request can't wedge the comm check, whatever thread it's on.
+comm_check_client = FetchClient('maude', allow_subset=True, timeout=60)
 
-class TimeoutException(Exception):
-    pass
+# If the telemetry bus is running, it publishes the comm state to shared memory, and reading that costs nothing.
+# Anything older than this (seconds) means the bus has stopped, so we go back to asking ourselves.
+comm_state_reader = CommStateReader()
+shared_comm_state_max_age = 150
 
 
 @contextmanager
@@ -23,7 +34,16 @@ def force_timeout(seconds):
     to figure it out, so this function will force a timeout of the call
     after a given number of seconds. If you wrap it in a try/except and a while
     loop, it will simply try again (which almost always fixes the issue).
+
+    SIGALRM only works in the main thread. Anywhere else this falls back to a
+    deadlines.Deadline, which bounds every FetchClient fetch inside the block
+    (see deadlines.py, which the monitors now use directly).
     '''
+    if threading.current_thread() is not threading.main_thread():
+        with Deadline(seconds, name='force_timeout'):
+            yield
+        return
+
     def signal_handler(signum, frame):
         raise TimeoutException("Timed out! Pressing on...")
     signal.signal(signal.SIGALRM, signal_handler)
@@ -34,35 +54,63 @@ def force_timeout(seconds):
         signal.alarm(0)
 
 
-def are_we_in_comm(verbose=False, cadence=2, fake_comm=False):
+def are_we_in_comm(verbose=False, cadence=2, fake_comm=False, bus=None, scheduler=None, vcdu_tracker=None,
+                   shared_state=True):
     """
     Check if the spacecraft is in communication with the ground by checking if there are any VCDU frame values within the last 60 seconds.
 
     :param verbose: Set to True to print status messages to the screen. Default is False.
     :param cadence: How often to check if we are in comm. Default is 2 seconds.
     :param fake_comm: Set to True to fake being in comm. Default is False.
+    :param bus: A TelemetryBusClient. If given, ask the telemetry bus instead of querying MAUDE ourselves.
+    :param scheduler: A CommScheduler. If given, it picks the cadence from the DSN schedule instead.
+    :param vcdu_tracker: A VcduTracker. If given (and we're querying MAUDE ourselves), it's fed the frames we just fetched.
+    :param shared_state: Read the telemetry bus's shared comm state (see comm_state.py) if it's fresh. Default is True.
+        It's skipped when we'd be feeding a vcdu_tracker ourselves (the shared state has no frames in it), and when
+        we're replaying a pass from maude_standin.py (the bus, if any, is watching the real MAUDE).
     :return: True if in comm, False if not.
     """
 
-    # Always be fetching from MAUDE
-    fetch.data_source.set('maude allow_subset=True')
-
     # These fetches are really fast. Slow the cadence a bit.
+    if scheduler is not None:
+        cadence = scheduler.next_cadence()
     time.sleep(cadence)  # cadence is in seconds here
 
-    # If there VCDU frame values within the last 60 seconds, this will not be empty
-    ref_vcdu = fetch.Msid('CVCDUCTR', start=CxoTime.now() - 60 * u.s)
-
-    # Will be True if in comm, False if not.
-    in_comm = len(ref_vcdu) > 0
+    use_shared_state = shared_state and maude_standin_url is None and (vcdu_tracker is None or bus is not None)
+    shared_comm_state = comm_state_reader.read(
+        max_age=shared_comm_state_max_age) if use_shared_state else None
+
+    if shared_comm_state is not None:
+        # A local memory read, no round trip to the bus or MAUDE
+        in_comm = shared_comm_state['in_comm']
+        last_vcdu = shared_comm_state['last_vcdu']
+    elif bus is not None:
+        comm_state = bus.comm_state()
+        in_comm = comm_state['in_comm']
+        last_vcdu = comm_state['last_vcdu']
+    else:
+        # If there VCDU frame values within the last 60 seconds, this will not be empty
+        ref_vcdu = comm_check_client.get_telem(
+            'CVCDUCTR', start=CxoTime.now() - 60 * u.s)['CVCDUCTR']
+
+        # Will be True if in comm, False if not.
+        in_comm = len(ref_vcdu) > 0
+        last_vcdu = ref_vcdu.vals[-1] if in_comm else None
+
+        if vcdu_tracker is not None:
+            # We've got the last minute of frames anyway, so look for dropouts and resets in them
+            vcdu_tracker.update(ref_vcdu.times, ref_vcdu.vals)
 
     if fake_comm is True:
         in_comm = True
 
+    if scheduler is not None:
+        scheduler.observe(in_comm)
+
     if verbose:
         if in_comm:
             print(
-                f'({CxoTime.now().strftime("%m/%d/%Y %H:%M:%S")} | VCDU {ref_vcdu.vals[-1]} | #{in_comm_counter}) IN COMM!', end='\r')
+                f'({CxoTime.now().strftime("%m/%d/%Y %H:%M:%S")} | VCDU {last_vcdu}) IN COMM!', end='\r')
         elif not in_comm:
             print(
                 f'({CxoTime.now().strftime("%m/%d/%Y %H:%M:%S")}) Not in Comm.                                 ', end='\r\r\r')
@@ -0,0 +1,279 @@
+#!/usr/bin/env conda run -n ska3 python
+
+'''
+A local, memory-mapped copy of the CXC archive's daily stats for the MSIDs on
+our mission-lifetime plots.
+
+The mission-wide dashboard and the thermal plots used to re-fetch 20+ years of
+daily data from the CXC archive on every refresh. Now each MSID lives on disk
+as one .npy file per column (times, means, mins, maxes, stds), built once and
+then appended to with only the days we don't have yet. Reading it back is just
+an np.load(mmap_mode='r'), which takes milliseconds.
+
+The columns of an MSID are only ever published together. Each append writes a
+whole new version of them into its own directory, and then swaps the MSID's
+.current file (which names the current version) over in one rename:
+
+    sci/
+        2CEAHVPT.current                      e.g. '2CEAHVPT.1760796312123456.4242'
+        2CEAHVPT.1760796312123456.4242/       times.npy, means.npy, mins.npy, maxes.npy, stds.npy
+        2CEAHVPT.checked
+
+so a reader (in any process) that reads .current and then the columns can
+never see times from one version and means from another.
+
+Build (or top up) the archive by hand with:
+
+    ./local_archive.py --update
+'''
+
+import argparse
+import os
+import shutil
+import time
+
+import numpy as np
+from cxotime import CxoTime
+
+import msidlists
+from artifact_publisher import write_atomically
+from fetch_client import FetchClient, start_secs
+from global_configuration import local_archive_directory
+from heartbeat import timestamp_string
+
+# The columns we keep for every MSID, as returned by a daily cheta fetch
+COLUMNS = ('times', 'means', 'mins', 'maxes', 'stds')
+
+# The earliest day we bother archiving. Nothing we plot starts before this.
+MISSION_START = '2000:001'
+
+
+class ArchivedMsid:
+    '''
+    Daily stats for one MSID, backed by read-only memory-mapped arrays. Looks
+    enough like a cheta daily MSID (times, means, mins, maxes, stds) that the
+    plotting code can't tell the difference. vals is an alias for means.
+    '''
+
+    def __init__(self, msid, columns):
+        self.msid = msid
+        for column in COLUMNS:
+            setattr(self, column, columns[column])
+        self.vals = self.means
+
+    def __len__(self):
+        return len(self.times)
+
+
+class LocalArchive:
+    '''
+    A per-MSID columnar store of daily stats, in one directory per unit system.
+
+    It has the same get_telem() as a FetchClient, so it can be passed as the
+    client= of make_realtime_plot() for the mission-wide dashboard.
+
+    >>> archive = LocalArchive(unit_system='sci')
+    >>> telem = archive.get_telem(msidlists.monitor_temperature_msids, start='2001:001')
+    >>> telem['2CEAHVPT'].means
+    '''
+
+    def __init__(self, archive_directory=local_archive_directory, unit_system='eng', check_interval=6 * 3600):
+        '''
+        :param archive_directory: Where to keep the archive. Each unit system gets its own subdirectory.
+        :param unit_system: 'eng' or 'sci', exactly as for cheta
+        :param check_interval: Don't ask the CXC archive for new days more often than this (seconds)
+        '''
+        self.unit_system = unit_system
+        self.directory = os.path.join(archive_directory, unit_system)
+        self.check_interval = check_interval
+        self.client = FetchClient('cxc', unit_system=unit_system)
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _current_path(self, msid):
+        return os.path.join(self.directory, f'{msid}.current')
+
+    def _version(self, msid):
+        '''
+        The directory holding the current version of this MSID's columns, or None if it isn't archived
+        '''
+        try:
+            with open(self._current_path(msid)) as current_file:
+                return os.path.join(self.directory, current_file.read().strip())
+        except OSError:
+            return None
+
+    def _load(self, msid, version=None, mmap_mode='r'):
+        # Always load every column from the same version, and read which one that is only once
+        if version is None:
+            version = self._version(msid)
+        if version is None:
+            return None
+        return {column: np.load(os.path.join(version, f'{column}.npy'), mmap_mode=mmap_mode)
+                for column in COLUMNS}
+
+    def __contains__(self, msid):
+        return self._version(msid) is not None
+
+    def last_time(self, msid):
+        '''
+        Return the CXC time (seconds) of the last archived day for this MSID, or None.
+        '''
+        columns = self._load(msid)
+        if columns is None:
+            return None
+        times = columns['times']
+        return float(times[-1]) if len(times) > 0 else None
+
+    def _recently_checked(self, msid):
+        '''
+        Did we (or another process) ask the CXC archive for new days of this MSID within the last check_interval?
+        '''
+        stamp_path = os.path.join(self.directory, f'{msid}.checked')
+        return os.path.exists(stamp_path) and time.time() - os.path.getmtime(stamp_path) < self.check_interval
+
+    def _mark_checked(self, msid):
+        with open(os.path.join(self.directory, f'{msid}.checked'), 'w') as stamp_file:
+            stamp_file.write(timestamp_string())
+
+    def update(self, msids, force=False):
+        '''
+        Append any complete days we don't have yet. MSIDs that aren't in the
+        archive at all are fetched from the start of the mission, which takes a
+        while, but only ever happens once. Everything else that's due for a
+        check is topped up in a single batched fetch starting at the oldest
+        last archived day.
+
+        :param msids: A list of MSIDs
+        :param force: Check the CXC archive even if we did so recently
+        '''
+
+        new_msids = [msid for msid in msids if msid not in self]
+        due_msids = [msid for msid in msids if msid in self and (
+            force or not self._recently_checked(msid))]
+
+        batches = []
+        if len(new_msids) > 0:
+            batches.append((new_msids, CxoTime(MISSION_START).secs))
+        if len(due_msids) > 0:
+            # An MSID whose archive is (somehow) empty starts over from the beginning of the mission
+            batches.append((due_msids, min(self.last_time(msid) or CxoTime(MISSION_START).secs
+                                           for msid in due_msids)))
+
+        for batch_msids, fetch_start in batches:
+            data = self.client.get_telem(
+                batch_msids, start=fetch_start, sampling='daily')
+            for msid in batch_msids:
+                self._append(msid, data[msid])
+                self._mark_checked(msid)
+
+    def _append(self, msid, data):
+
+        previous = self._version(msid)
+        old_columns = self._load(msid, version=previous, mmap_mode=None)
+        last = float(old_columns['times'][-1]) if old_columns is not None and len(old_columns['times']) > 0 else None
+        times = np.asarray(data.times)
+        # Only keep days that are genuinely newer than what's on disk
+        new = times > last if last is not None else np.ones(
+            len(times), dtype=bool)
+
+        if not np.any(new):
+            return
+
+        # Write the whole new version where no reader is looking, then publish it by swapping .current
+        # over. Anyone who has the old version open (or mapped) keeps reading the old copy.
+        version_name = f'{msid}.{time.time_ns() // 1000}.{os.getpid()}'
+        version = os.path.join(self.directory, version_name)
+        os.makedirs(version)
+        try:
+            for column in COLUMNS:
+                new_values = np.asarray(getattr(data, column))[new]
+                if old_columns is not None:
+                    new_values = np.concatenate([old_columns[column], new_values])
+                np.save(os.path.join(version, f'{column}.npy'), new_values)
+
+            def write(temp_path):
+                with open(temp_path, 'w') as current_file:
+                    current_file.write(version_name)
+            write_atomically(self._current_path(msid), write)
+        except BaseException:
+            shutil.rmtree(version, ignore_errors=True)
+            raise
+
+        self._prune(msid, keep=(version, previous))
+
+    def _prune(self, msid, keep, grace=60):
+        # Keep the version we just published and the one before it (a reader may have just read .current,
+        # and not opened the columns yet), and anything new enough that another process may still be writing
+        # it. Files that are still mapped stay readable after they're removed.
+        for entry in os.listdir(self.directory):
+            path = os.path.join(self.directory, entry)
+            if (entry.startswith(f'{msid}.') and entry[len(msid) + 1:].split('.')[0].isdigit() and os.path.isdir(path)
+                    and path not in keep and time.time() - os.path.getmtime(path) > grace):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def read(self, msid, start=None, stop=None):
+        '''
+        Return an ArchivedMsid for the days between start and stop (or the whole mission), without fetching anything.
+        '''
+        columns = self._load(msid)
+        if columns is None:
+            raise KeyError(f'{msid} is not in the local archive ({self.directory})')
+
+        first = np.searchsorted(
+            columns['times'], start_secs(start)) if start is not None else 0
+        last = np.searchsorted(
+            columns['times'], start_secs(stop)) if stop is not None else len(columns['times'])
+
+        return ArchivedMsid(msid, {column: values[first:last] for column, values in columns.items()})
+
+    def get_telem(self, msids, start=None, stop=None, sampling='daily'):
+        '''
+        A drop-in for FetchClient.get_telem() for daily data. Tops up the archive
+        if it's due (or the MSID is new) and returns a dict of ArchivedMsids keyed by MSID.
+        '''
+        if sampling != 'daily':
+            raise ValueError(
+                f"The local archive only holds daily stats, not '{sampling}'")
+
+        if isinstance(msids, str):
+            msids = [msids]
+
+        self.update(msids)
+
+        return {msid: self.read(msid, start=start, stop=stop) for msid in msids}
+
+
+def get_args():
+    '''Fetch command line args, if given'''
+
+    argparser = argparse.ArgumentParser(
+        description='Build or top up the local archive of daily stats used by the mission-lifetime plots.')
+
+    argparser.add_argument("--update", help="Fetch any days missing from the archive, even if we checked recently",
+                           action="store_true")
+
+    argparser.add_argument("--archive_directory", help="Where to keep the archive",
+                           default=local_archive_directory)
+
+    args = argparser.parse_args()
+    return args
+
+
+def main():
+
+    args = get_args()
+
+    # The mission-wide dashboard is in engineering units, the thermal plots in science units
+    for unit_system, msids in (('eng', [msid for panel in msidlists.dashboard_msids_missionwide for msid in panel]),
+                               ('sci', msidlists.monitor_temperature_msids)):
+        archive = LocalArchive(
+            archive_directory=args.archive_directory, unit_system=unit_system)
+        print(f'({timestamp_string()}) Updating {len(msids)} MSIDs in {archive.directory}...')
+        archive.update(msids, force=args.update)
+
+    print(f'({timestamp_string()}) Done.')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+#!/usr/bin/env conda run -n ska3 python
+
+'''
+A local stand-in for MAUDE that replays a recorded stretch of telemetry, sped up.
+
+First record a fixture (this needs the real MAUDE, once):
+
+    ./maude_standin.py record --start 2020:236 --stop 2020:240 --fixture_directory ~/maude_fixtures/anomaly_2020_236
+
+then serve it, here 60x faster than real time:
+
+    ./maude_standin.py serve --fixture_directory ~/maude_fixtures/anomaly_2020_236 --acceleration 60
+
+and point the monitors at it:
+
+    export HRCSENTINEL_MAUDE_STANDIN=http://localhost:8765
+    ./monitor_telemetry.py --report_errors
+
+Every MAUDE fetch made through a FetchClient (which is all of them, including the
+comm checks) then goes to the stand-in instead. The recorded sample times are
+squeezed by the acceleration factor and shifted so the replay starts "now", so a
+recorded comm pass comes and goes on the stand-in's clock exactly as it did for
+real, only faster. Pair it with fetch_metrics.py to benchmark loop throughput and latency.
+'''
+
+import argparse
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from cxotime import CxoTime
+
+import msidlists
+from fetch_client import FetchClient
+from fetch_planner import plan_refresh
+from global_configuration import maude_standin_fixture_directory
+from heartbeat import timestamp_string
+
+# MAUDE hands back a subset of the samples when allow_subset=True and the query is large
+SUBSET_MAX_SAMPLES = 10000
+
+# What the monitors ask for, plus the VCDU counter that drives the comm checks
+RECORDED_MSIDS = list(dict.fromkeys(
+    [msid for msids in plan_refresh(motors=True).values() for msid in msids]
+    + msidlists.critical_comm_msids + msidlists.anomaly_msids + ['CVCDUCTR']))
+
+
+class ReplayClock:
+    '''
+    Maps between the recorded (fixture) timeline and the real one.
+
+    At the moment the server starts, the replay is lead_seconds into the fixture.
+    From then on, each real second advances the replay by acceleration fixture seconds.
+    '''
+
+    def __init__(self, fixture_start, fixture_stop, acceleration=1.0, lead_seconds=0.0, loop=False):
+        self.fixture_start = fixture_start
+        self.fixture_stop = fixture_stop
+        self.acceleration = acceleration
+        self.lead_seconds = lead_seconds
+        self.loop = loop
+        self.started = CxoTime.now().secs
+
+    def replay_position(self, now=None):
+        '''
+        Where (in fixture time) the replay has got to
+        '''
+        now = CxoTime.now().secs if now is None else now
+        elapsed = self.lead_seconds + (now - self.started) * self.acceleration
+        span = self.fixture_stop - self.fixture_start
+        if self.loop and span > 0:
+            elapsed = elapsed % span
+        return self.fixture_start + elapsed
+
+    def to_fixture(self, real_time):
+        # Only meaningful within the current loop of the replay
+        now = CxoTime.now().secs
+        return self.replay_position(now) - (now - real_time) * self.acceleration
+
+    def to_real(self, fixture_times):
+        now = CxoTime.now().secs
+        return now - (self.replay_position(now) - fixture_times) / self.acceleration
+
+
+class Fixture:
+    '''
+    Recorded telemetry, one .npz per MSID (times, vals and maybe raw_vals) in a directory per unit system
+    '''
+
+    def __init__(self, fixture_directory):
+        self.fixture_directory = fixture_directory
+        self._data = {}
+
+        for unit_system in os.listdir(fixture_directory):
+            unit_directory = os.path.join(fixture_directory, unit_system)
+            if not os.path.isdir(unit_directory):
+                continue
+            for filename in os.listdir(unit_directory):
+                if not filename.endswith('.npz'):
+                    continue
+                with np.load(os.path.join(unit_directory, filename), allow_pickle=False) as saved:
+                    self._data[(unit_system, filename[:-len('.npz')])] = {
+                        key: saved[key] for key in saved.files}
+
+        if len(self._data) == 0:
+            raise ValueError(f'No recorded telemetry found in {fixture_directory}')
+
+        self.start = min(data['times'][0] for data in self._data.values() if len(data['times']) > 0)
+        self.stop = max(data['times'][-1] for data in self._data.values() if len(data['times']) > 0)
+
+    def get(self, msid, unit_system):
+        return self._data.get((unit_system, msid))
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    '''
+    Answers GET /msids?msids=A,B&start=<CXC secs>&stop=<CXC secs>&allow_subset=True&unit_system=eng
+    with the same {'data': [{'msid', 'times', 'values'}, ...]} that maude.get_msids() returns.
+    '''
+
+    fixture = None
+    clock = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == '/status':
+            now = CxoTime.now().secs
+            return self._reply({'replay_position': CxoTime(self.clock.replay_position(now)).date,
+                                'fixture_start': CxoTime(self.fixture.start).date,
+                                'fixture_stop': CxoTime(self.fixture.stop).date,
+                                'acceleration': self.clock.acceleration})
+
+        if url.path != '/msids':
+            return self._reply({'error': f'Unknown path {url.path}'}, status=404)
+
+        # A malformed request is the client's fault, so say so (400) rather than falling over (500)
+        missing = [key for key in ('msids', 'start') if key not in query]
+        if len(missing) > 0:
+            return self.send_error(400, f'Missing required parameter(s): {", ".join(missing)}')
+        try:
+            requested_start = float(query['start'])
+            requested_stop = float(query['stop']) if 'stop' in query else None
+        except ValueError:
+            return self.send_error(400, 'start and stop must be in CXC seconds')
+
+        now = CxoTime.now().secs
+        replay_position = self.clock.replay_position(now)
+        start = self.clock.to_fixture(requested_start)
+        stop = min(self.clock.to_fixture(requested_stop),
+                   replay_position) if requested_stop is not None else replay_position
+        allow_subset = query.get('allow_subset', 'True') == 'True'
+        unit_system = query.get('unit_system', 'eng')
+
+        data = []
+        for msid in query['msids'].split(','):
+            recorded = self.fixture.get(msid, unit_system)
+            if recorded is None:
+                return self._reply({'error': f'{msid} ({unit_system}) is not in the fixture'}, status=404)
+
+            # Only what has "arrived" by now, in the requested window
+            first = np.searchsorted(recorded['times'], start, side='left')
+            last = np.searchsorted(recorded['times'], stop, side='right')
+            selection = slice(first, last)
+            if allow_subset and last - first > SUBSET_MAX_SAMPLES:
+                selection = slice(first, last, int(np.ceil((last - first) / SUBSET_MAX_SAMPLES)))
+
+            entry = {'msid': msid,
+                     'times': self.clock.to_real(recorded['times'][selection]).tolist(),
+                     'values': recorded['vals'][selection].tolist()}
+            if 'raw_vals' in recorded:
+                entry['raw_values'] = recorded['raw_vals'][selection].tolist()
+            data.append(entry)
+
+        self._reply({'data': data})
+
+    def _reply(self, body, status=200):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # Don't spam the terminal with a line per request
+        pass
+
+
+def record(fixture_directory, start, stop, msids=RECORDED_MSIDS):
+    '''
+    Save a window of real MAUDE telemetry (in both engineering and science units) as a fixture
+    '''
+    for unit_system in ('eng', 'sci'):
+        # state_codes=True so we also get raw_vals for the state MSIDs (which the motor plots need)
+        client = FetchClient('maude', allow_subset=False,
+                             state_codes=True, unit_system=unit_system)
+        unit_directory = os.path.join(fixture_directory, unit_system)
+        os.makedirs(unit_directory, exist_ok=True)
+
+        for msid in msids:
+            print(f'({timestamp_string()}) Recording {msid} ({unit_system})...          ', end='\r', flush=True)
+            data = client.get_telem(msid, start=start, stop=stop)[msid]
+            columns = {'times': np.asarray(data.times), 'vals': np.asarray(data.vals)}
+            raw_vals = getattr(data, 'raw_vals', None)
+            if raw_vals is not None:
+                columns['raw_vals'] = np.asarray(raw_vals)
+            np.savez(os.path.join(unit_directory, f'{msid}.npz'), **columns)
+
+    print(f'({timestamp_string()}) Recorded {len(msids)} MSIDs to {fixture_directory}')
+
+
+def make_server(fixture_directory, port=8765, acceleration=1.0, lead_seconds=0.0, loop=False):
+    '''
+    Build (but don't start) a stand-in server for a recorded fixture
+    '''
+    fixture = Fixture(fixture_directory)
+    clock = ReplayClock(fixture.start, fixture.stop, acceleration=acceleration,
+                        lead_seconds=lead_seconds, loop=loop)
+
+    # Each server gets its own handler class, so several can run side by side (e.g. in a benchmark)
+    handler = type('FixtureStandinHandler', (StandinHandler,),
+                   {'fixture': fixture, 'clock': clock})
+
+    return ThreadingHTTPServer(('localhost', port), handler)
+
+
+def serve(fixture_directory, port=8765, acceleration=1.0, lead_seconds=0.0, loop=False):
+    '''
+    Serve a recorded fixture until interrupted
+    '''
+    with make_server(fixture_directory, port=port, acceleration=acceleration,
+                     lead_seconds=lead_seconds, loop=loop) as server:
+        fixture = server.RequestHandlerClass.fixture
+        print(f'({timestamp_string()}) Replaying {CxoTime(fixture.start).date} to {CxoTime(fixture.stop).date} at {acceleration}x on http://localhost:{port}')
+        print(f'Point HRCSentinel at it with: export HRCSENTINEL_MAUDE_STANDIN=http://localhost:{port}')
+        server.serve_forever()
+
+
+def start_in_background(fixture_directory, port=8765, acceleration=1.0, lead_seconds=0.0, loop=False):
+    '''
+    Serve a fixture from a daemon thread (handy for benchmarks and tests). Returns the server.
+    '''
+    server = make_server(fixture_directory, port=port, acceleration=acceleration,
+                         lead_seconds=lead_seconds, loop=loop)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_args():
+    '''Fetch command line args, if given'''
+
+    argparser = argparse.ArgumentParser(
+        description='Record MAUDE telemetry to a fixture, or replay one (sped up) in place of MAUDE.')
+
+    argparser.add_argument("mode", choices=['record', 'serve'],
+                           help="Record a fixture from the real MAUDE, or serve one")
+
+    argparser.add_argument("--fixture_directory", help="Where the fixture lives",
+                           default=maude_standin_fixture_directory)
+
+    argparser.add_argument("--start", help="(record) Start of the window to record, e.g. 2020:236",
+                           default='2020:236')
+
+    argparser.add_argument("--stop", help="(record) End of the window to record, e.g. 2020:240",
+                           default='2020:240')
+
+    argparser.add_argument("--port", help="(serve) Port to listen on", type=int, default=8765)
+
+    argparser.add_argument("--acceleration", help="(serve) How many recorded seconds pass per real second",
+                           type=float, default=1.0)
+
+    argparser.add_argument("--lead_hours", help="(serve) Start the replay this many (recorded) hours into the fixture, so there's some history to plot right away",
+                           type=float, default=0.0)
+
+    argparser.add_argument("--loop", help="(serve) Start the replay over when it reaches the end of the fixture",
+                           action="store_true")
+
+    args = argparser.parse_args()
+    return args
+
+
+def main():
+
+    print('\033[1mHRCSentinel\033[0m | MAUDE Stand-in')
+
+    args = get_args()
+
+    if args.mode == 'record':
+        record(args.fixture_directory, start=args.start, stop=args.stop)
+    elif args.mode == 'serve':
+        serve(args.fixture_directory, port=args.port, acceleration=args.acceleration,
+              lead_seconds=args.lead_hours * 3600, loop=args.loop)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,15 +12,20 @@ import traceback
 import astropy.units as u
 import numpy as np
 import requests
-from cheta import fetch_sci as fetch
 from cxotime import CxoTime
 from chandratime import cxctime_to_datetime
 from Chandra.Time import DateTime as cxcDateTime
 
-from heartbeat import are_we_in_comm, timestamp_string, force_timeout, TimeoutException
+from heartbeat import are_we_in_comm, timestamp_string, TimeoutException
+from deadlines import Deadline
 from goes_proxy import get_goes_proxy
 from monitor_comms import send_slack_message
-from chandratime import convert_to_doy, timedelta_formatter
+from msidlists import anomaly_msids
+from telemetry_bus import TelemetryBusClient
+from delta_poller import DeltaPoller
+import fetch_metrics
+from fetch_client import FetchClient
+from chandratime import timedelta_formatter
 
 import datetime as dt
 
@@ -29,7 +34,8 @@ def check_safe_modes(start_time, slack_channel=''):
     '''
     Check for any current or prior safing actions
     '''
-    scs_107_state = fetch.MSID('COSCS107S', start=start_time)
+    scs_107_state = FetchClient('maude', allow_subset=False, unit_system='sci').get_telem(
+        'COSCS107S', start=start_time)['COSCS107S']
 
 
 # def audit_telemetry(start_time, in_comm: bool):
@@ -97,6 +103,12 @@ def get_args():
     argparser.add_argument("--report_errors", help="Print the full traceback of any exception encountered. ",
                            action="store_true")
 
+    argparser.add_argument("--use_bus", help="Get telemetry from telemetry_bus.py instead of polling MAUDE directly",
+                           action="store_true")
+
+    argparser.add_argument("--no_metrics", help="Don't write fetch metrics (see fetch_metrics.py) to the metrics directory",
+                           action="store_true")
+
     args = argparser.parse_args()
 
     return args
@@ -113,7 +125,14 @@ def main():
     args = get_args()
     fake_comm = args.fake_comm
 
-    fetch.data_source.set('maude allow_subset=False')
+    bus = TelemetryBusClient() if args.use_bus else None
+
+    if not args.no_metrics:
+        fetch_metrics.configure('monitor_anomaly')
+
+    # Hold on to a rolling two days of the anomaly MSIDs, and only fetch what's new on each pass
+    anomaly_poller = DeltaPoller(anomaly_msids, client=FetchClient(
+        'maude', allow_subset=False, unit_system='sci'), bus=bus, window_seconds=2 * 86400)
 
     bot_channel = '#comm_passes'  # the default channel for alerts
 
@@ -132,27 +151,27 @@ def main():
 
         # Let's check the last 24h of data, which is longer than the longest time we'll ever be out of comm (hopefully!)
         two_days_ago = dt.datetime.now() - dt.timedelta(days=2)
-        # Convert this to a YYYY:DOY string like '2023:101'
-        pull_telem_from = convert_to_doy(two_days_ago)
 
         try:
-            with force_timeout(600):  # don't let this take longer than 10 minutes
+            with Deadline(600, name='monitor_anomaly iteration'):  # don't let this take longer than 10 minutes
 
                 # Check the Mission-critical MSIDs
 
                 # state_msidlist = ['215PCAST']
                 # telem_msidlist = ['2C05PALV', '2C15PALV', '2CEAHVPT']
-                telem_msidlist = ['2P15VAVL', '2CEAHVPT']
+                telem_msidlist = anomaly_msids
                 telem_msidlist_units = ['V', 'C']
 
-                # state = fetch.MSIDset(state_msidlist, start=pull_telem_from)
-                telem = fetch.MSIDset(telem_msidlist, start=pull_telem_from)
+                # state = fetch.MSIDset(state_msidlist, start=two_days_ago)
 
                 if args.test is True:
-                    # Then we'll pick a time when we know an anomaly occurred
+                    # Then we'll pick a time when we know an anomaly occurred (and leave live MAUDE alone)
                     bot_channel = '#bot-testing'
-                    telem = fetch.MSIDset(
+                    telem = anomaly_poller.client.get_telem(
                         telem_msidlist, start='2020:236', stop='2020:240')
+                else:
+                    anomaly_poller.poll(start=two_days_ago)
+                    telem = anomaly_poller.window()
 
                 telemetry_age_seconds = CxoTime().now().secs - \
                     telem['2P15VAVL'].times[-1]  # in units of seconds
@@ -248,6 +267,8 @@ def main():
             if args.report_errors is True:
                 print(f'({timestamp_string()}) Error! \n{traceback.format_exc()}')
 
+        fetch_metrics.end_iteration()
+
         # time.sleep(20)
 
 
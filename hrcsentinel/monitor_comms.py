@@ -10,19 +10,27 @@ import time
 import astropy.units as u
 import numpy as np
 import requests
-from cheta import fetch_sci as fetch
 from cxotime import CxoTime
 
 from chandratime import convert_to_doy
-from heartbeat import are_we_in_comm, timestamp_string, force_timeout, TimeoutException
+from msidlists import critical_comm_msids
+from telemetry_bus import TelemetryBusClient
+from delta_poller import DeltaPoller
+import fetch_metrics
+from comm_scheduler import CommScheduler
+from fetch_client import FetchClient
+from heartbeat import are_we_in_comm, timestamp_string, TimeoutException
+from deadlines import Deadline
+from vcdu_tracker import VcduTracker
 
 import psutil
 process = psutil.Process(os.getpid())
 
 
-def audit_telemetry(start, channel=None):
+def audit_telemetry(start, channel=None, poller=None):
     '''
-    Not used right now
+    Not used right now. With a DeltaPoller, each audit only checks the samples
+    that came in since the last one.
     '''
 
     print(f'({CxoTime.now().strftime("%m/%d/%Y %H:%M:%S")}) TELEMETRY AUDIT', end='\r')
@@ -33,11 +41,14 @@ def audit_telemetry(start, channel=None):
                          '2C24PALV': (24.1, 24.3),
                          }
 
-    values_since_comm_start = fetch.get_telem(
-        list(critical_msidlist.keys()), start=start, quiet=True, unit_system='eng')
+    if poller is not None:
+        values_since_comm_start = poller.poll(start=start)
+    else:
+        values_since_comm_start = FetchClient('maude', allow_subset=True, unit_system='eng').get_telem(
+            list(critical_msidlist.keys()), start=start)
 
     for msid in list(critical_msidlist.keys()):
-        out_of_limit_mask = (values_since_comm_start[msid].vals < critical_msidlist[msid][0]) or (
+        out_of_limit_mask = (values_since_comm_start[msid].vals < critical_msidlist[msid][0]) | (
             values_since_comm_start[msid].vals > critical_msidlist[msid][1])
         if sum(out_of_limit_mask) > 3:
             send_slack_message(
@@ -73,8 +84,8 @@ def send_slack_message(message, channel='#comm_passes', blocks=None):
     slack_icon_url = 'https://avatars.slack-edge.com/2021-01-28/1695804235940_26ef808c676830611f43_512.png'
     slack_user_name = 'HRC CommBot'
 
-    # Populate a JSON to push to the Slack API.
-    return requests.post('https://slack.com/api/chat.postMessage', {
+    # Populate a JSON to push to the Slack API. Don't let a slow Slack hold up the monitor.
+    return requests.post('https://slack.com/api/chat.postMessage', timeout=30, data={
         'token': slack_token,
         'channel': slack_channel,
         'text': message,
@@ -83,14 +94,23 @@ def send_slack_message(message, channel='#comm_passes', blocks=None):
         'blocks': json.dumps(blocks) if blocks else None}).json()
 
 
-def grab_critical_telemetry(start=CxoTime.now() - 60 * u.s):
+def grab_critical_telemetry(start=CxoTime.now() - 60 * u.s, bus=None, poller=None):
     '''
-    Grab the major telemetry you need from Cheta
+    Grab the major telemetry you need from Cheta (or from the telemetry bus, if given).
+
+    With a DeltaPoller, only the samples since the last grab are fetched. We only
+    ever look at the latest value of each MSID anyway.
     '''
 
-    critical_msidlist = ['CCSDSTMF', '2SHEV1RT', '2PRBSCR',
-                         '2FHTRMZT', '2CHTRPZT', '2IMTPAST', '2IMBPAST', '2SPTPAST', '2SPBPAST', '2TLEV1RT', '2VLEV1RT']
-    critical_msids = fetch.MSIDset(critical_msidlist, start=start)
+    if poller is not None:
+        poller.poll(start=start)
+        critical_msids = poller.window()
+    elif bus is not None:
+        # In science units, like fetch_sci
+        critical_msids = bus.get_telem(critical_comm_msids, start=start, unit_system='sci')
+    else:
+        critical_msids = FetchClient('maude', allow_subset=True, unit_system='sci').get_telem(
+            critical_comm_msids, start=start)
 
     error_state = False
 
@@ -159,6 +179,28 @@ def grab_critical_telemetry(start=CxoTime.now() - 60 * u.s):
     return telem
 
 
+def vcdu_pass_report(vcdu_tracker, since=None):
+    '''
+    A few lines on how clean the telemetry stream was during the pass, for the end-of-comm Slack message
+    '''
+    summary = vcdu_tracker.summary(start=since)
+
+    report = "\n\n *Telemetry stream*: "
+    if summary['frame_rate'] is not None:
+        report += f"`{summary['frame_rate']:.2f}` frames/s, "
+    if summary['dropouts'] == 0:
+        report += "no dropouts"
+    else:
+        report += f"*{summary['dropouts']} dropout(s)* totalling `{summary['dropout_seconds']:.0f} s` (`{summary['missing_frames']}` frames missing)"
+
+    for reset in summary['counter_resets']:
+        report += f"\n *VCDU counter reset* at `{CxoTime(reset['stop']).strftime('%m/%d/%Y %H:%M:%S')}` (`{reset['from']}` to `{reset['to']}`)"
+    for change in summary['format_changes']:
+        report += f"\n Format changed from `{change['from']}` to `{change['to']}` at `{CxoTime(change['start']).strftime('%m/%d/%Y %H:%M:%S')}`"
+
+    return report
+
+
 def convert_bus_current_to_dn(bus_current_in_amps):
     '''
     The DN-to-Current (Amps) conversion for 2PRBSCR is just a linear
@@ -189,6 +231,15 @@ def get_args():
     parser.add_argument("--report_errors", help="Print MAUDE exceptions (which are common) to the command line",
                         action="store_true")
 
+    parser.add_argument("--use_bus", help="Get comm status and telemetry from telemetry_bus.py instead of polling MAUDE directly",
+                        action="store_true")
+
+    parser.add_argument("--fixed_cadence", help="Check for comm every 2 seconds, rather than adapting the cadence to the DSN schedule",
+                        action="store_true")
+
+    parser.add_argument("--no_metrics", help="Don't write fetch metrics (see fetch_metrics.py) to the metrics directory",
+                        action="store_true")
+
     args = parser.parse_args()
     return args
 
@@ -200,11 +251,28 @@ def main():
 
     print('\033[1mHRCSentinel\033[0m | DSN Pass Monitor')
 
-    fetch.data_source.set('maude allow_subset=True')
-
     args = get_args()
     fake_comm = args.fake_comm
     chatty = args.report_errors  # Will be True if user set --report_errors
+    bus = TelemetryBusClient() if args.use_bus else None
+
+    if not args.no_metrics:
+        fetch_metrics.configure('monitor_comms')
+
+    # Poll slowly far from a scheduled pass, and quickly around AOS and LOS
+    scheduler = None if args.fixed_cadence else CommScheduler()
+
+    # Each of these keeps a cursor on the last sample we've seen, so every poll only fetches what's new.
+    # Science units, to match what fetch_sci has always given us.
+    sci_client = FetchClient('maude', allow_subset=True, unit_system='sci')
+    critical_poller = DeltaPoller(
+        critical_comm_msids, client=sci_client, bus=bus)
+    # Every frame (no subset), or thinned-out samples would look like dropouts
+    vcdu_poller = DeltaPoller(['CVCDUCTR', 'CCSDSTMF'], client=FetchClient(
+        'maude', allow_subset=False), bus=bus)
+    # Watches every frame we poll for dropouts, counter resets and format changes
+    vcdu_tracker = VcduTracker()
+    pass_start = None
 
     if fake_comm:
         bot_slack_channel = '#bot-testing'
@@ -221,22 +289,22 @@ def main():
 
         try:
             # if this takes longer than 120 sec, something is wrong, so just try again
-            with force_timeout(120):
+            with Deadline(120, name='monitor_comms iteration'):
                 in_comm = are_we_in_comm(
-                    verbose=False, cadence=2, fake_comm=fake_comm)
+                    verbose=False, cadence=2, fake_comm=fake_comm, bus=bus, scheduler=scheduler)
 
                 if not in_comm:
                     if recently_in_comm:
                         # We might have just had a loss in telemetry. Try again after waiting for a minute
                         time.sleep(60)
-                        in_comm = are_we_in_comm(verbose=False, cadence=2)
+                        in_comm = are_we_in_comm(verbose=False, cadence=2, bus=bus)
                         if in_comm:
                             continue
 
                         # Assuming the end of comm is real, then comm has recently ended and we need to report that.
                         try:
                             telem = grab_critical_telemetry(
-                                start=CxoTime.now() - 1800 * u.s)
+                                start=CxoTime.now() - 1800 * u.s, poller=critical_poller)
                         except Exception as e:
                             telem = None
                             if chatty:
@@ -249,6 +317,7 @@ def main():
                                 message = f"It appears that COMM has ended as of `{CxoTime.now().strftime('%m/%d/%Y %H:%M:%S')}` \n\n WARNING: HRC State Errors Detected! \n\n Last telemetry was in `{telem['Format']}` \n\n *HRC-I* was {telem['HRC-I Status']} \n *HRC-S* was {telem['HRC-S Status']} \n\n *Shields were {telem['Shield State']}* with a count rate of `{telem['Shield Rate']} cps` \n\n *HRC-I* Voltage Steps were (Top/Bottom) = `{telem['HRC-I Voltage Steps'][0]}/{telem['HRC-I Voltage Steps'][1]}` \n *HRC-S* Voltage Steps were (Top/Bottom) = `{telem['HRC-S Voltage Steps'][0]}/{telem['HRC-S Voltage Steps'][1]}`  \n\n *Bus Current* was `{telem['Bus Current (DN)']} DN` (`{telem['Bus Current (A)']} A`)  \n\n *FEA Temperature* was `{telem['FEA Temp']} C` \n *CEA Temperature* was `{telem['CEA Temp']} C` "
                         elif telem is None:
                             message = f"It appears that COMM has ended as of `{CxoTime.now().strftime('%m/%d/%Y %H:%M:%S')}` \n\n Currently having trouble querying telemetry; wait to see if the problem resolves, otherwise contact Grant!"
+                        message += vcdu_pass_report(vcdu_tracker, since=pass_start)
                         send_slack_message(message, channel=bot_slack_channel)
 
                     recently_in_comm = False
@@ -264,15 +333,25 @@ def main():
 
                     if in_comm_counter == 0:
                         # Then start the clock on the comm pass
-                        CxoTime.now()
+                        pass_start = CxoTime.now().secs
 
                     recently_in_comm = True
                     in_comm_counter += 1
                     telemetry_audit_counter += 1
 
                     time.sleep(5)  # Wait a few seconds for MAUDE to refresh
-                    latest_vcdu = fetch.Msid(
-                        'CVCDUCTR', start=start_time).vals[-1]
+                    # Only the frames since the last poll
+                    new_frames = vcdu_poller.poll(start=start_time)
+                    checked_until = vcdu_tracker.last_time
+                    vcdu_tracker.update(
+                        new_frames['CVCDUCTR'].times, new_frames['CVCDUCTR'].vals)
+                    vcdu_tracker.update_format(
+                        new_frames['CCSDSTMF'].times, new_frames['CCSDSTMF'].vals)
+                    latest_vcdu = vcdu_tracker.last_counter
+
+                    for reset in vcdu_tracker.timeline(start=checked_until, kinds=('counter_reset',)):
+                        send_slack_message(
+                            f"WARNING: The VCDU counter jumped from `{reset['from']}` to `{reset['to']}` at `{CxoTime(reset['stop']).strftime('%m/%d/%Y %H:%M:%S')}`. Was there a reset? Check telemetry!", channel=bot_slack_channel)
 
                     print(
                         f'({timestamp_string()} | VCDU {latest_vcdu} | #{in_comm_counter}) In Comm!', end='\r')
@@ -280,7 +359,7 @@ def main():
                     if in_comm_counter == 5:
                         # Now we've waited ~half a minute or so for MAUDE to update
                         telem = grab_critical_telemetry(
-                            start=CxoTime.now() - 8 * u.h)
+                            start=CxoTime.now() - 8 * u.h, poller=critical_poller)
 
                         # Craft a message string using this latest elemetry
                         if telem['Error State'] is False:
@@ -292,8 +371,8 @@ def main():
                         # do a first audit of the telemetry upon announcement
 
                         # Check for a recent SCS 107
-                        safemodes = fetch.get_telem(
-                            'COSCS107S', quiet=True)  # check for SCS 107
+                        safemodes = sci_client.get_telem(
+                            'COSCS107S', start=CxoTime.now() - 8 * u.h)  # check for SCS 107
                         if safemodes['COSCS107S'].vals[-1] == 'DISA':
                             send_slack_message(
                                 'WARNING: SCS 107 may have run! Check telemetry immediately!', channel=bot_slack_channel)
@@ -307,8 +386,8 @@ def main():
                         # audit_telemetry(start=comm_start_timestamp,
                         #                 channel=bot_slack_channel)
 
-        except TimeoutException:
-            print(f"Main event loop timed out! Pressing on...")
+        except TimeoutException as e:
+            print(f"Main event loop timed out ({e})! Pressing on...")
             continue
 
         except Exception as e:
@@ -332,6 +411,9 @@ def main():
                 in_comm_counter -= 1
             continue
 
+        finally:
+            fetch_metrics.end_iteration(label='in_comm' if recently_in_comm else 'not_in_comm')
+
 
 if __name__ == '__main__':
     main()
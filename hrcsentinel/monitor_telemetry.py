@@ -1,26 +1,42 @@
 #!/usr/bin/env conda run -n ska3 python
 
 import argparse
+import asyncio
 import traceback
 import datetime as dt
+import os
 import socket
 import sys
 import time
 import pytz
 
 
+import numpy as np
 import matplotlib.dates as mdate
 import matplotlib.pyplot as plt
-from matplotlib import gridspec
-from cheta import fetch
-from cxotime import CxoTime
 
 from global_configuration import allowed_hosts
 import plot_stylers
-from heartbeat import are_we_in_comm, timestamp_string, force_timeout, TimeoutException
+from heartbeat import are_we_in_comm, timestamp_string, TimeoutException
+from deadlines import Deadline, current_deadline, stage
 from plot_dashboard import (comm_status_stamp, make_ancillary_plots,
                             make_realtime_plot)
 from plot_rates import make_shield_plot
+from telemetry_cache import TelemetryCache
+from fetch_client import FetchClient, start_secs
+from fetch_engine import FetchEngine
+import fetch_metrics
+from comm_scheduler import CommScheduler
+from fetch_planner import plan_refresh, fetch_planned
+from telemetry_bus import TelemetryBusClient
+from async_monitor import AsyncTelemetryMonitor
+from plot_events import AOS, LOS, EventBus, SampleWatcher, dashboard_registry
+from vcdu_tracker import VcduTracker
+from dashboard_renderer import RealtimeDashboard
+from render_pool import RenderPool
+from render_fingerprint import FingerprintStore, realtime_dashboard_inputs, render_if_changed, shield_inputs
+from render_profiles import profiles_for
+from data_publisher import DataSlicePublisher
 
 plot_stylers.styleplots()
 
@@ -40,7 +56,7 @@ def get_args():
     argparser.add_argument("--debug", help="Print useful debugging statements ",
                            action="store_true")
 
-    argparser.add_argument("--force_cheta", help="Trick the code pull from Ska/CXC instead of MAUDE with a switch to fetch.data_source.set() ",
+    argparser.add_argument("--force_cheta", help="Trick the code pull from Ska/CXC instead of MAUDE for the in-comm dashboard refresh ",
                            action="store_true")
 
     argparser.add_argument("--report_errors", help="Print MAUDE exceptions (which are common) to the command line",
@@ -49,6 +65,35 @@ def get_args():
     argparser.add_argument("--show_in_gui", help="Show plots with plt.show()",
                            action="store_true")
 
+    argparser.add_argument("--cache_directory", help="Persist the full-resolution telemetry cache to this directory, so restarts don't re-download five days of data",
+                           default=None)
+
+    argparser.add_argument("--use_bus", help="Get comm status and telemetry from telemetry_bus.py instead of polling MAUDE directly",
+                           action="store_true")
+
+    argparser.add_argument("--fixed_cadence", help="Check for comm every 2 seconds, rather than adapting the cadence to the DSN schedule",
+                           action="store_true")
+
+    argparser.add_argument("--no_metrics", help="Don't write fetch metrics (see fetch_metrics.py) to the metrics directory",
+                           action="store_true")
+
+    argparser.add_argument("--fetch_workers", help="How many telemetry/HTTP fetches to run in parallel. Set to 0 to fetch everything one at a time.",
+                           type=int, default=6)
+
+    argparser.add_argument("--out_of_comm_refresh", help="Out of comm, check for new telemetry every this many seconds",
+                           type=int, default=120)
+
+    argparser.add_argument("--async_engine", help="Run comm checks, fetches, GOES/Kadi downloads and plotting as concurrent tasks (see async_monitor.py) instead of one after another",
+                           action="store_true")
+
+    argparser.add_argument("--always_render", help="Redraw every plot that's due, even if nothing it's drawn from has changed since it was last published",
+                           action="store_true")
+
+    argparser.add_argument("--render_workers", help="How many ancillary plots to draw at once, each in its own process. Set to 0 to draw them one at a time in this process.",
+                           type=int, default=4)
+    argparser.add_argument("--data_dashboard", help="Also publish the dashboard telemetry as data for the web client (see data_publisher.py), and only draw the dashboard PNG at startup and LOS",
+                           action="store_true")
+
     args = argparser.parse_args()
     return args
 
@@ -84,10 +129,32 @@ def main():
     #     backend = 'MacOSX'
     # matplotlib.use(backend, force=True)
 
+    if not args.no_metrics:
+        fetch_metrics.configure('monitor_telemetry')
+
+    # Poll slowly far from a scheduled pass, and quickly around AOS and LOS
+    scheduler = None if args.fixed_cadence else CommScheduler()
+
+    # Keep the dashboard's five-day window in memory so each refresh only fetches new samples.
+    # Six days, because plot_start is floored to the start of the day five days ago.
+    telemetry_cache = TelemetryCache(
+        window_days=6, cache_directory=args.cache_directory)
+    bus = TelemetryBusClient() if args.use_bus else None
+    # If set, this overrides the planned MAUDE clients for the in-comm refresh
+    forced_client = FetchClient('cxc') if args.force_cheta else None
+    # A bounded pool of fetch threads (with keep-alive HTTP sessions) shared by every refresh
+    engine = FetchEngine(
+        max_workers=args.fetch_workers) if args.fetch_workers > 0 else None
+    # Worker processes for the ancillary plots. They can't show anything in a GUI.
+    render_pool = RenderPool(
+        max_workers=args.render_workers) if args.render_workers > 0 and not args.show_in_gui else None
+    # Remembers what each published plot was drawn from, so we don't redraw it from the same data
+    fingerprints = None if args.always_render else FingerprintStore(fig_save_directory)
+    # Each refresh's new samples, as data for the web client to draw (in data/, next to the plots)
+    data_publisher = DataSlicePublisher(os.path.join(fig_save_directory, 'data')) if args.data_dashboard else None
+
     # Initial settings
     recently_in_comm = False
-    in_comm_counter = 0
-    out_of_comm_refresh_counter = 0
     iteration_counter = 0
 
     if args.test is True:
@@ -105,112 +172,168 @@ def main():
                            plot_stop=two_days_hence, sampling='full', date_format=mdate.DateFormatter('%m-%d'), force_limits=True, show_in_gui=args.show_in_gui)
 
         print(f'({timestamp_string()}) Testing ancillary plots...')
-        make_ancillary_plots(fig_save_directory=fig_save_directory)
+        make_ancillary_plots(fig_save_directory=fig_save_directory, engine=engine, render_pool=render_pool)
         plt.close('all')
         print(f'({timestamp_string()}) Tests completed. Exiting.')
         sys.exit()
 
+    if args.async_engine:
+        if args.show_in_gui:
+            sys.exit(
+                f'({timestamp_string()}) --show_in_gui does not work with --async_engine (plots are drawn off the main thread). Exiting.')
+        print(f'({timestamp_string()}) Running with the asyncio engine.')
+        monitor = AsyncTelemetryMonitor(fig_save_directory, hostname, engine=engine if engine is not None else FetchEngine(max_workers=1),
+                                        telemetry_cache=telemetry_cache, scheduler=scheduler, bus=bus, forced_client=forced_client,
+                                        fake_comm=fake_comm, chatty=chatty, debug=args.debug, render_pool=render_pool,
+                                        fingerprints=fingerprints, data_publisher=data_publisher)
+        asyncio.run(monitor.run())
+        return
+
+    # Plots are only redrawn when something they depend on changes (see plot_events.py)
+    events = EventBus()
+    plots = dashboard_registry(events)
+    sample_watcher = SampleWatcher(events)
+    # Watches the frames each comm check fetches, for dropouts and counter resets to mark on the dashboard
+    vcdu_tracker = VcduTracker()
+    # Built on its first refresh and redrawn in place after that (unless it's going to the GUI)
+    realtime_dashboard = None
+    code_start_time = dt.datetime.now(tz=pytz.timezone('US/Eastern'))
+    # The latest telemetry we've fetched, which every redraw shares
+    telem = None
+    telem_includes_motors = False
+    last_out_of_comm_fetch = -np.inf
+
     # Loop infinitely :)
     while True:
 
         try:
-            with force_timeout(600):  # this shouldn't take longer than 10 minutes
+            # This shouldn't take longer than 10 minutes. Every fetch inside (on any thread) is bounded by it.
+            with Deadline(600, name=f'monitor_telemetry iteration {iteration_counter}'):
 
                 in_comm = are_we_in_comm(
-                    verbose=False, cadence=2, fake_comm=fake_comm)
-
-                # Generate the first comm status stamp and create code start date
-                if iteration_counter == 0:
-                    code_start_time = dt.datetime.now(
-                        tz=pytz.timezone('US/Eastern'))
+                    verbose=False, cadence=2, fake_comm=fake_comm, bus=bus, scheduler=scheduler, vcdu_tracker=vcdu_tracker)
 
-                comm_status_stamp(comm_status=in_comm, fig_save_directory=fig_save_directory,
-                                  code_start_time=code_start_time, hostname=hostname, debug_prints=args.debug)
+                if in_comm != recently_in_comm:
+                    events.publish(AOS if in_comm else LOS)
+                    if not in_comm:
+                        # Comm just ended, so this is a good time to write the cache to disk
+                        telemetry_cache.save()
+                recently_in_comm = in_comm
 
-                # We ALWAYS update the comm status stamp
-                if not in_comm:
+                five_days_ago = dt.date.today() - dt.timedelta(days=5)
+                two_days_hence = dt.date.today() + dt.timedelta(days=2)
 
-                    if recently_in_comm:
-                        # Then update the text stamp
-                        comm_status_stamp(comm_status=in_comm, code_start_time=code_start_time,
-                                          fig_save_directory=fig_save_directory, hostname=hostname)
-
-                        make_ancillary_plots(
-                            fig_save_directory=fig_save_directory)
-                        plt.close('all')
-                        # Finally, reset the out-of-comm reset counter, because it can get into a state where it doesn't get below 20 again
-                        out_of_comm_refresh_counter = 0
+                if in_comm:
+                    print(
+                        f"({timestamp_string()}) In Comm! Refreshing Dashboard (Iteration {iteration_counter})                                                       ", end="\r", flush=True)
 
-                    recently_in_comm = False
-                    in_comm_counter = 0
-                    out_of_comm_refresh_counter += 1
+                    # One batched fetch for both the dashboard and the shield plot
+                    telem = fetch_planned(plan_refresh(), start=five_days_ago,
+                                          telemetry_cache=telemetry_cache, bus=bus, client=forced_client, engine=engine)
+                    telem_includes_motors = False
+                    sample_watcher.observe(telem)
+                    if data_publisher is not None:
+                        with stage('data slices', timeout=60):
+                            data_publisher.publish(telem, plot_start=five_days_ago, plot_stop=two_days_hence)
+
+                elif time.time() - last_out_of_comm_fetch > args.out_of_comm_refresh:
+                    # Out of comm, look for new telemetry (e.g. a late dump) every so often, motors included
+                    print(
+                        f"({timestamp_string()}) Checking for new telemetry out of comm...", end="\r", flush=True)
+                    sys.stdout.write("\033[K")
+                    telem = fetch_planned(plan_refresh(motors=True), start=five_days_ago,
+                                          telemetry_cache=telemetry_cache, bus=bus, engine=engine)
+                    telem_includes_motors = True
+                    sample_watcher.observe(telem)
+                    if data_publisher is not None:
+                        with stage('data slices', timeout=60):
+                            data_publisher.publish(telem, plot_start=five_days_ago, plot_stop=two_days_hence)
+                    last_out_of_comm_fetch = time.time()
+
+                else:
                     print(
                         f'({timestamp_string()}) Not in Comm.    ', end='\r')
                     sys.stdout.write("\033[K")
 
-                    if out_of_comm_refresh_counter == 20:
-
-                        # Explicitly set maude each time, because ancillary plots use CXC
-                        fetch.data_source.set('maude allow_subset=False')
-                        # Refresh the plots every 20th iteration out-of-comm
-                        print(
-                            f"({timestamp_string()}) Performing out-of-comm plot refresh...", end="\r", flush=True)
+                # Only redraw what's out of date. A plot that fails to draw waits for its next event,
+                # and the others carry on (see async_monitor.render_plots()).
+                due_plots = plots.take_due()
+                for position, plot in enumerate(due_plots):
+                    try:
+                        # Just the live PNGs, unless the PDFs (etc.) are due too, i.e. at startup and LOS
+                        trigger = plots.render_trigger(plot)
+
+                        if plot == 'comm_status':
+                            comm_status_stamp(comm_status=in_comm, fig_save_directory=fig_save_directory,
+                                              code_start_time=code_start_time, hostname=hostname, debug_prints=args.debug)
+
+                        elif plot == 'realtime_dashboard' and trigger == 'refresh' and data_publisher is not None and not args.show_in_gui:
+                            # The web client draws it from the data slices. The PNG and its archive copies wait for LOS.
+                            continue
+
+                        elif plot == 'realtime_dashboard' and telem is not None:
+                            # If there's a telemetry bus, it's been watching every frame, not just the ones we fetched
+                            if bus is not None:
+                                vcdu_events = bus.vcdu_timeline(start=start_secs(five_days_ago))
+                            else:
+                                vcdu_events = vcdu_tracker.timeline(start=start_secs(five_days_ago))
+                            with stage('realtime dashboard', timeout=120):
+                                if args.show_in_gui:
+                                    make_realtime_plot(plot_start=five_days_ago, fig_save_directory=fig_save_directory,
+                                                       plot_stop=two_days_hence, sampling='full', date_format=mdate.DateFormatter('%m-%d'), force_limits=True, show_in_gui=args.show_in_gui, telem=telem,
+                                                       vcdu_events=vcdu_events, profiles=profiles_for('realtime_dashboard', trigger))
+                                else:
+                                    if realtime_dashboard is None:
+                                        realtime_dashboard = RealtimeDashboard(fig_save_directory=fig_save_directory,
+                                                                               date_format=mdate.DateFormatter('%m-%d'))
+                                    render_if_changed(fingerprints, 'realtime_dashboard',
+                                                      realtime_dashboard_inputs(telem, five_days_ago, two_days_hence, vcdu_events),
+                                                      realtime_dashboard.update, plot_start=five_days_ago, plot_stop=two_days_hence, telem=telem,
+                                                      vcdu_events=vcdu_events, profiles=profiles_for('realtime_dashboard', trigger))
+
+                        elif plot == 'shield' and telem is not None:
+                            with stage('shield plot', timeout=120):
+                                render_if_changed(fingerprints, 'shield', shield_inputs(telem, five_days_ago, two_days_hence),
+                                                  make_shield_plot, fig_save_directory=fig_save_directory,
+                                                  plot_start=five_days_ago, plot_stop=two_days_hence, telem=telem, engine=engine,
+                                                  profiles=profiles_for('shield', trigger))
+
+                        elif plot == 'ancillary':
+                            # Without the motor telemetry, make_ancillary_plots() fetches what it needs itself
+                            with stage('ancillary plots', timeout=300):
+                                make_ancillary_plots(fig_save_directory=fig_save_directory, show_in_gui=args.show_in_gui,
+                                                     telem=telem if telem_includes_motors else None, engine=engine, render_pool=render_pool,
+                                                     fingerprints=fingerprints, trigger=trigger)
+
+                        else:
+                            # Nothing fetched yet, so nothing drawn
+                            continue
+
+                        if trigger == 'los':
+                            plots.mark_archived(plot)
+                        # Clear the command line manually
                         sys.stdout.write("\033[K")
-                        five_days_ago = dt.date.today() - dt.timedelta(days=5)
-                        two_days_hence = dt.date.today() + dt.timedelta(days=2)
-
-                        make_realtime_plot(plot_start=five_days_ago, fig_save_directory=fig_save_directory,
-                                           plot_stop=two_days_hence, sampling='full', date_format=mdate.DateFormatter('%m-%d'), force_limits=True, show_in_gui=args.show_in_gui)
 
-                        make_ancillary_plots(
-                            fig_save_directory=fig_save_directory, show_in_gui=args.show_in_gui)
+                    except TimeoutException as e:
+                        print(f"({timestamp_string()}) {plot} timed out: {e}. Pressing on...")
+                        if current_deadline() is not None and current_deadline().expired():
+                            # No time left for the rest this iteration, so they're first in line next time
+                            plots.invalidate(*due_plots[position + 1:])
+                            break
+
+                    except Exception as e:
+                        if chatty:
+                            print(f"({timestamp_string()}) ERROR drawing {plot}: {e}")
+                            print(traceback.format_exc())
+                        else:
+                            print(
+                                f'({timestamp_string()}) ERROR drawing {plot}! Use --report_errors to display them.', end='\r', flush=True)
+
+                    finally:
+                        # Including whatever a failed render left open
                         plt.close('all')
 
-                        # Reset the refresh counter
-                        out_of_comm_refresh_counter = 0
-
                 if in_comm:
-
-                    recently_in_comm = True
-                    in_comm_counter += 1
-
-                    if in_comm_counter == 1:
-                        # Then update the text stamp
-                        comm_status_stamp(comm_status=in_comm, code_start_time=code_start_time,
-                                          fig_save_directory=fig_save_directory, hostname=hostname)
-
-                    if in_comm_counter == 5:
-                        # Then create the mission-wide status plots
-                        # print("Refreshing longviews (Iteration {}) at {}".format(
-                        #     iteration_counter, dt.datetime.now(tz=pytz.timezone('US/Eastern')).strftime("%Y-%b-%d %H:%M:%S")), flush=True)
-                        make_ancillary_plots(fig_save_directory)
-                        plt.close('all')
-                        sys.stdout.write("\033[K")
-
-                    # Explicitly set maude each time, because ancillary plots use CXC
-                    fetch.data_source.set('maude allow_subset=False')
-                    if args.force_cheta:
-                        fetch.data_source.set('cxc')
-
-                    print(
-                        f"({timestamp_string()}) In Comm! Refreshing Dashboard (Iteration {iteration_counter})                                                       ", end="\r", flush=True)
-
-                    five_days_ago = dt.date.today() - dt.timedelta(days=5)
-                    two_days_hence = dt.date.today() + dt.timedelta(days=2)
-
-                    make_realtime_plot(plot_start=five_days_ago, fig_save_directory=fig_save_directory,
-                                       plot_stop=two_days_hence, sampling='full', date_format=mdate.DateFormatter('%m-%d'), force_limits=True, show_in_gui=args.show_in_gui)
-
-                    make_shield_plot(fig_save_directory=fig_save_directory,
-                                     plot_start=five_days_ago, plot_stop=two_days_hence)
-
-                    # print(
-                    #     f'({timestamp_string()}) Saved Current Status Plots to {fig_save_directory}                                    ', end="\r", flush=True)
-                    # Clear the command line manually
-                    sys.stdout.write("\033[K")
-
-                    plt.close('all')
-
                     sleep_period_seconds = 3
 
                     for i in range(0, sleep_period_seconds):
@@ -221,14 +344,13 @@ def main():
 
                 iteration_counter += 1
 
-        except TimeoutException:
+        except TimeoutException as e:
+            # A DeadlineExceeded says which stage ran out of time
             print(
-                f"({timestamp_string()}) Funtion timed out! Pressing on...                             ", end="\r", flush=True)
+                f"({timestamp_string()}) Timed out: {e}. Pressing on...                             ", end="\r", flush=True)
             continue
 
         except Exception as e:
-            # Then reset the out_of_comm_refresh_counter because it might be higher than 20
-            out_of_comm_refresh_counter = 0
             if chatty:
                 print(
                     f"({timestamp_string()}) ERROR on Iteration {iteration_counter}: {e}")
@@ -240,6 +362,10 @@ def main():
                     f'({timestamp_string()}) ERROR encountered! Use --report_errors to display them.                                   ', end='\r', flush=True)
             continue
 
+        finally:
+            # Log how long this iteration's fetches took (and which ones failed)
+            fetch_metrics.end_iteration(label='in_comm' if recently_in_comm else 'not_in_comm')
+
 
 if __name__ == "__main__":
     main()
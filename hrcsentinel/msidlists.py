@@ -184,6 +184,13 @@ all_relevant_hrc_msids = ["2SHEV1RT",  # HRC AntiCo Shield Rates (1)
                           "2DTSTATT"  # OutDet1 Temperature (c)
                           ]
 
+# What monitor_comms reports to Slack at the start and end of every comm pass
+critical_comm_msids = ['CCSDSTMF', '2SHEV1RT', '2PRBSCR', '2FHTRMZT', '2CHTRPZT', '2IMTPAST',
+                       '2IMBPAST', '2SPTPAST', '2SPBPAST', '2TLEV1RT', '2VLEV1RT']
+
+# What monitor_anomaly scans for a return of the +15 V anomaly and 2CEAHVPT limit violations
+anomaly_msids = ['2P15VAVL', '2CEAHVPT']
+
 spacecraft_orbit_pseudomsids = ["Dist_SatEarth",  # Chandra-Earth distance (from Earth Center) (m)
                                 # Pointing-Solar angle (from center) (deg)
                                 "Point_SunCentAng"
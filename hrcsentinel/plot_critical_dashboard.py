@@ -3,7 +3,6 @@
 import time
 import pytz
 import argparse
-from cheta import fetch_sci as fetch
 import socket
 
 import numpy as np
@@ -15,13 +14,23 @@ from cxotime import CxoTime
 from Chandra.Time import DateTime as chandraDateTime
 
 from heartbeat import are_we_in_comm
+from fetch_client import FetchClient
 from plot_helpers import drawnow, figure, scp_file_to_hrcmonitor
 import plot_stylers
 import event_times
 
 from global_configuration import allowed_hosts
 from heartbeat import timestamp_string
-from chandratime import convert_to_doy, cxc2dt
+from chandratime import convert_to_doy, cxctime_to_plotdate as cxc2pd
+from decimation import decimate_for_axes
+
+
+def decimated(msid_data, ax):
+    '''
+    Cut a full-resolution MSID down to each pixel-bin's min & max, ready for plot_date
+    '''
+    times, vals = decimate_for_axes(ax, msid_data.times, msid_data.vals)
+    return cxc2pd(times), vals
 
 
 def update_plot(telem_start, iteration_count, save_path=None):
@@ -37,39 +46,30 @@ def update_plot(telem_start, iteration_count, save_path=None):
         comm_status_text = 'NOT IN COMM'
         comm_status_color = plot_stylers.red
 
-    # heartbeat.py currently resets to remove the highrate=True flag. You need to reset!
-    fetch.data_source.set('maude allow_subset=False')
-
     msidlist = ['2P15VAVL', '2N15VAVL', '2P05VAVL', '2P24VAVL',
                 '2FHTRMZT', '2CHTRPZT', '2LVPLATM', '2DTSTATT', '2SPINATM', '3FABRAAT', '2CEAHVPT',
                 ]
     print(f'({CxoTime.now().strftime("%m/%d/%Y %H:%M:%S")}) Fetching telemetry...', end='\r')
-    telem = fetch.MSIDset(msidlist, start=telem_start)
+    # Full-resolution MAUDE, in science units (like fetch_sci)
+    telem = FetchClient('maude', allow_subset=False, unit_system='sci').get_telem(msidlist, start=telem_start)
 
     ax1 = plt.subplot(2, 1, 1)
 
-    ax1.plot_date(cxc2dt(telem['2P15VAVL'].times), telem['2P15VAVL'].vals,
+    ax1.plot_date(*decimated(telem['2P15VAVL'], ax1),
                   markersize=weight, label='+15V 2P15VAVL')
-    ax1.plot_date(cxc2dt(telem['2N15VAVL'].times),
-                  telem['2N15VAVL'].vals, markersize=weight, label='-15V 2N15VAVL')
-    ax1.plot_date(cxc2dt(telem['2P05VAVL'].times),
-                  telem['2P05VAVL'].vals, markersize=weight, label='+5V 2P05VAVL')
-    ax1.plot_date(cxc2dt(telem['2P24VAVL'].times),
-                  telem['2P24VAVL'].vals, markersize=weight, label='+24V 2P24VBVL')
+    ax1.plot_date(*decimated(telem['2N15VAVL'], ax1), markersize=weight, label='-15V 2N15VAVL')
+    ax1.plot_date(*decimated(telem['2P05VAVL'], ax1), markersize=weight, label='+5V 2P05VAVL')
+    ax1.plot_date(*decimated(telem['2P24VAVL'], ax1), markersize=weight, label='+24V 2P24VBVL')
 
     ax1.set_ylabel('Bus Voltages (V)')
 
     ax2 = plt.subplot(2, 1, 2, sharex=ax1)
 
-    ax2.plot_date(cxc2dt(telem['2CEAHVPT'].times),
-                  telem['2CEAHVPT'].vals, markersize=weight, label='2CEAHVPT')
+    ax2.plot_date(*decimated(telem['2CEAHVPT'], ax2), markersize=weight, label='2CEAHVPT')
 
-    ax2.plot_date(cxc2dt(telem['2CHTRPZT'].times),
-                  telem['2CHTRPZT'].vals, markersize=weight, label='CEA Temperature 2CHTRPZT')
-    ax2.plot_date(cxc2dt(telem['2FHTRMZT'].times),
-                  telem['2FHTRMZT'].vals, markersize=weight, label='FEA Temperature 2FHTRMZT')
-    ax2.plot_date(cxc2dt(telem['2LVPLATM'].times),
-                  telem['2LVPLATM'].vals, markersize=weight, label='LV Plate 2LVPLATM')
+    ax2.plot_date(*decimated(telem['2CHTRPZT'], ax2), markersize=weight, label='CEA Temperature 2CHTRPZT')
+    ax2.plot_date(*decimated(telem['2FHTRMZT'], ax2), markersize=weight, label='FEA Temperature 2FHTRMZT')
+    ax2.plot_date(*decimated(telem['2LVPLATM'], ax2), markersize=weight, label='LV Plate 2LVPLATM')
 
     ax2.set_xlabel(f'Date')
     ax2.set_ylabel('CEA & FEA Temperature (C)')
@@ -139,7 +139,6 @@ def main():
         print(f'({timestamp_string()}) Recognized host: {hostname}. Plots will be saved to {fig_save_directory}')
 
     plt.ion()
-    fetch.data_source.set('maude allow_subset=False')
     plot_stylers.styleplots(labelsizes=12)
 
     # Grab telemetry starting from 24 hours ago
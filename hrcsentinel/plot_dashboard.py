@@ -6,19 +6,27 @@ import sys
 
 
 try:
-    from cheta import fetch
     from kadi import events
 except ImportError:
     sys.exit("Failed to import cheta (aka ska). Make sure you're using the latest version of the ska runtime environment (and that you have the conda environment initialized!).")
 
 import event_times
 import msidlists
+from fetch_client import FetchClient
+from fetch_planner import fetch_planned, flatten, plan_refresh
+from goes_proxy import get_goes_proxy
+from local_archive import LocalArchive
+from decimation import decimate_for_axes
 import plot_stylers
-from chandratime import convert_to_doy, cxctime_to_datetime as cxc2dt
+from chandratime import cxctime_to_plotdate as cxc2pd
 from monitor_comms import convert_bus_current_to_dn
 from plot_motors import make_motor_plots
-from plot_rates import make_shield_plot
-from plot_thermals import make_thermal_plots
+from plot_rates import fetch_orbit_metadata, make_shield_plot
+from render_pool import RenderError, RenderJob, portable
+from render_profiles import DEFAULT_PROFILES, profiles_for, save_figure
+from render_fingerprint import (fingerprint, missionwide_inputs, motor_inputs, render_if_changed,
+                                shield_inputs, thermal_inputs)
+from plot_thermals import LATEST_THERMAL_CLIENT, make_thermal_plots
 from heartbeat import timestamp_string
 
 import matplotlib
@@ -28,7 +36,7 @@ import numpy as np
 import pytz
 
 
-def comm_status_stamp(comm_status, code_start_time, hostname, fig_save_directory='/proj/web-icxc/htdocs/hrcops/hrcmonitor/plots/', debug_prints=False) -> None:
+def comm_status_stamp(comm_status, code_start_time, hostname, fig_save_directory='/proj/web-icxc/htdocs/hrcops/hrcmonitor/plots/', debug_prints=False, profiles=('stamp',)) -> None:
     '''
     Make the comm status stamp
     '''
@@ -66,19 +74,47 @@ def comm_status_stamp(comm_status, code_start_time, hostname, fig_save_directory
     uptime_text = plt.text(
         0.004, 0.0001, 'HRCMonitor has been running on {} since {} ({} days)'.format(hostname, code_start_time.strftime("%Y %b %d %H:%M:%S"), code_uptime.days), color='slategray', fontsize=9)
 
-    plt.savefig(fig_save_directory + 'comm_status.png', dpi=300)
+    save_figure(fig, fig_save_directory, 'comm_status', profiles)
     plt.close('all')
 
 
-def make_realtime_plot(counter=None, plot_start=dt.datetime(2020, 8, 31, 00), plot_stop=dt.date.today() + dt.timedelta(days=2), sampling='full', current_hline=False, date_format=mdate.DateFormatter('%d %H'), force_limits=False, missionwide=False, fig_save_directory=None, show_in_gui=False, use_cheta=False) -> None:
+def get_dashboard_telem(msid, plot_start, sampling, telemetry_cache=None, telem=None, client=None):
+    '''
+    Return telemetry for one dashboard MSID. Use the pre-fetched telem dict
+    (from fetch_planner) if it has this MSID, then the tail-append cache for
+    full-resolution data if we have one, and a plain fetch with the given
+    FetchClient otherwise.
+    '''
+
+    if telem is not None and msid in telem:
+        return {msid: telem[msid]}
+
+    if telemetry_cache is not None and sampling == 'full':
+        return {msid: telemetry_cache.update(msid, start=plot_start)}
+
+    return client.get_telem(msid, start=plot_start, sampling=sampling)
+
+
+def make_realtime_plot(counter=None, plot_start=dt.datetime(2020, 8, 31, 00), plot_stop=dt.date.today() + dt.timedelta(days=2), sampling='full', current_hline=False, date_format=mdate.DateFormatter('%d %H'), force_limits=False, missionwide=False, fig_save_directory=None, show_in_gui=False, use_cheta=False, telemetry_cache=None, telem=None, client=None, latest_telem=None, vcdu_events=None, profiles=DEFAULT_PROFILES) -> None:
+    '''
+    Make the 12-panel dashboard. latest_telem (a dict keyed by MSID) can carry
+    pre-fetched recent MAUDE data for the yellow lines on the mission-wide version.
+    vcdu_events (a VcduTracker timeline) shades telemetry dropouts and marks VCDU counter resets.
+    '''
     plotnum = -1
 
     fig = plt.figure(figsize=(16, 6), constrained_layout=True)
     gs = fig.add_gridspec(3, 4)
     # gridspec rocks
 
-    if (sampling == 'full') and (use_cheta is False):
-        fetch.data_source.set('maude allow_subset=False')
+    if client is None:
+        if (sampling == 'full') and (use_cheta is False):
+            client = FetchClient('maude', allow_subset=False)
+        else:
+            client = FetchClient('cxc')
+
+    # The yellow "latest value" lines on the mission-wide plot always come from MAUDE
+    latest_client = FetchClient('maude')
 
     if missionwide is False:
         # Then override the existing dashboard_msid* with the missionwide one
@@ -100,8 +136,8 @@ def make_realtime_plot(counter=None, plot_start=dt.datetime(2020, 8, 31, 00), pl
             plotnum += 1
             for msid in dashboard_msids[plotnum]:
 
-                data = fetch.get_telem(msid, start=convert_to_doy(
-                    plot_start), sampling=sampling, max_fetch_Mb=100000, max_output_Mb=100000, quiet=True)
+                data = get_dashboard_telem(
+                    msid, plot_start, sampling, telemetry_cache=telemetry_cache, telem=telem, client=client)
 
                 # print(
                 #     f'({timestamp_string()}) Fetching from {convert_to_doy(plot_start)} at {sampling} resolution: {msid}', end='\r', flush=True)
@@ -109,11 +145,14 @@ def make_realtime_plot(counter=None, plot_start=dt.datetime(2020, 8, 31, 00), pl
                 sys.stdout.write("\033[K")
 
                 if sampling == 'full':
-                    ax.plot_date(cxc2dt(
-                        data[msid].times), data[msid].vals, markersize=1, label=msid, zorder=1, rasterized=True)
+                    # There are far more full-resolution samples than pixels, so only plot each bin's min & max
+                    times, vals = decimate_for_axes(
+                        ax, data[msid].times, data[msid].vals)
+                    ax.plot_date(cxc2pd(times), vals, markersize=1,
+                                 label=msid, zorder=1, rasterized=True)
                 elif sampling == 'daily':
                     # Then plot the means
-                    ax.plot_date(cxc2dt(
+                    ax.plot_date(cxc2pd(
                         data[msid].times), data[msid].means, markersize=1, label=msid, zorder=1, rasterized=True)
                 # Plot a HORIZONTAL line at location of last data point.
                 if current_hline is True:
@@ -125,9 +164,11 @@ def make_realtime_plot(counter=None, plot_start=dt.datetime(2020, 8, 31, 00), pl
                         if plotnum != 0:
                             today = dt.datetime.utcnow().date()
                             yesterday = today - dt.timedelta(days=1)
-                            with fetch.data_source('maude'):
-                                latest_data = fetch.get_telem(
-                                    msid, start=convert_to_doy(yesterday), quiet=True)
+                            if latest_telem is not None and msid in latest_telem:
+                                latest_data = latest_telem
+                            else:
+                                latest_data = latest_client.get_telem(
+                                    msid, start=yesterday)
                             ax.axhline(
                                 latest_data[msid].vals[-1], color=plot_stylers.yellow, zorder=2)
                 if force_limits is True:
@@ -140,17 +181,28 @@ def make_realtime_plot(counter=None, plot_start=dt.datetime(2020, 8, 31, 00), pl
                 ax.axvline(dt.datetime.now(tz=pytz.timezone(
                     'US/Eastern')), color='gray', alpha=0.5)
 
+                if vcdu_events is not None:
+                    for event in vcdu_events:
+                        if event['kind'] == 'dropout':
+                            ax.axvspan(cxc2pd(event['start']), cxc2pd(event['stop']),
+                                       color=plot_stylers.red, alpha=0.2, zorder=0)
+                        elif event['kind'] == 'counter_reset':
+                            ax.axvline(cxc2pd(event['stop']), color=plot_stylers.red,
+                                       linestyle='--', linewidth=0.8, zorder=0)
+
                 if plotnum == 11:
                     try:
                         # then this is the Pitch plot, and I want to underplot spacecraft pitch
-                        fifo_resets = fetch.get_telem('2FIFOAVR', start=convert_to_doy(
-                            plot_start), sampling=sampling, max_fetch_Mb=100000, max_output_Mb=100000, quiet=True)
-                        format_changes = fetch.get_telem('CCSDSTMF', start=convert_to_doy(
-                            plot_start), sampling=sampling, max_fetch_Mb=100000, max_output_Mb=100000, quiet=True)
+                        fifo_resets = get_dashboard_telem(
+                            '2FIFOAVR', plot_start, sampling, telemetry_cache=telemetry_cache, telem=telem, client=client)
+                        format_changes = get_dashboard_telem(
+                            'CCSDSTMF', plot_start, sampling, telemetry_cache=telemetry_cache, telem=telem, client=client)
                         ax_resets = ax.twinx()
-                        ax_resets.plot_date(cxc2dt(
-                            fifo_resets['2FIFOAVR'].times), fifo_resets['2FIFOAVR'].vals, linewidth=0.5, marker=None, fmt="", alpha=0.7,  color=plot_stylers.blue, label='FIFO Reset', zorder=0, rasterized=True)
-                        ax_resets.plot_date(cxc2dt(format_changes['CCSDSTMF'].times), format_changes['CCSDSTMF'].vals,
+                        reset_times, reset_vals = decimate_for_axes(
+                            ax, fifo_resets['2FIFOAVR'].times, fifo_resets['2FIFOAVR'].vals)
+                        ax_resets.plot_date(cxc2pd(
+                            reset_times), reset_vals, linewidth=0.5, marker=None, fmt="", alpha=0.7,  color=plot_stylers.blue, label='FIFO Reset', zorder=0, rasterized=True)
+                        ax_resets.plot_date(cxc2pd(format_changes['CCSDSTMF'].times), format_changes['CCSDSTMF'].vals,
                                             linewidth=0.5, marker=None, fmt="", alpha=0.7,  color=plot_stylers.purple, label='Format Changes', zorder=0, rasterized=True)
                         ax_resets.tick_params(labelright='off')
                         ax_resets.set_yticks([])
@@ -168,9 +220,9 @@ def make_realtime_plot(counter=None, plot_start=dt.datetime(2020, 8, 31, 00), pl
                                        '2N15VAVL'  # +15 V bus EED voltage
                                        ]
                     for msid in voltage_msids_a:
-                        a_side_voltages = fetch.get_telem(msid, start=convert_to_doy(plot_start), stop=convert_to_doy(
-                            event_times.time_of_cap_1543), sampling=sampling, max_fetch_Mb=100000, max_output_Mb=100000, quiet=True)
-                        ax.plot_date(cxc2dt(a_side_voltages[msid].times), a_side_voltages[msid].means,
+                        a_side_voltages = client.get_telem(msid, start=plot_start, stop=event_times.time_of_cap_1543,
+                                                           sampling=sampling)
+                        ax.plot_date(cxc2pd(a_side_voltages[msid].times), a_side_voltages[msid].means,
                                      color=plot_stylers.green, markersize=0.3, alpha=0.3, label=msid, zorder=1, rasterized=True)
 
                     # Label the B-side swap (Aug 2020)
@@ -223,14 +275,7 @@ def make_realtime_plot(counter=None, plot_start=dt.datetime(2020, 8, 31, 00), pl
 
     if fig_save_directory is not None:
         # Then the user wants to save the figure
-        if missionwide is False:
-            plt.savefig(fig_save_directory + 'status.png', dpi=300)
-            plt.savefig(fig_save_directory + 'status.pdf',
-                        dpi=300)
-        elif missionwide is True:
-            plt.savefig(fig_save_directory + 'status_wide.png', dpi=300)
-            plt.savefig(fig_save_directory + 'status_wide.pdf',
-                        dpi=300)
+        save_figure(plt.gcf(), fig_save_directory, 'status_wide' if missionwide else 'status', profiles)
 
     # plt.show()
     if show_in_gui is True:
@@ -239,25 +284,97 @@ def make_realtime_plot(counter=None, plot_start=dt.datetime(2020, 8, 31, 00), pl
     plt.close()
 
 
-def make_ancillary_plots(fig_save_directory, show_in_gui=False):
+def render_missionwide_dashboard(fig_save_directory, latest_telem=None, archive=None, profiles=DEFAULT_PROFILES):
+    '''
+    The mission-wide dashboard, from the local archive. A RenderPool worker leaves archive
+    as None and opens its own (it's all memory-mapped files, so that's cheap).
     '''
-    Create the thermal and motor plots
+    if archive is None:
+        archive = LocalArchive(unit_system='eng')
+
+    make_realtime_plot(fig_save_directory=fig_save_directory, plot_start=dt.datetime(
+        2000, 1, 4), plot_stop=None, sampling='daily', date_format=mdate.DateFormatter('%Y'), current_hline=True, missionwide=True, force_limits=True,
+        client=archive, latest_telem=latest_telem, profiles=profiles)
+
+
+def make_ancillary_plots(fig_save_directory, show_in_gui=False, telem=None, engine=None, render_pool=None, fingerprints=None,
+                         trigger='los'):
+    '''
+    Create the thermal and motor plots. If telem (from fetch_planner) is given,
+    the shield and motor plots use it instead of fetching their own telemetry.
+
+    If engine (a FetchEngine) is given, everything the shield, mission-wide and
+    motor plots need is fetched up front and in parallel, and only then plotted.
+
+    The mission-wide dashboard and the thermal plots read their daily stats from
+    the local memory-mapped archive (see local_archive.py) rather than the CXC archive.
+
+    If render_pool (a RenderPool) is given, everything is fetched here first, and then
+    all the plots are drawn at once, each in its own worker process. Plots that fail
+    (or time out) don't stop the others, and are raised together as a RenderError.
+
+    If fingerprints (a FingerprintStore) is given, plots whose inputs haven't changed since
+    they were last published aren't drawn again (see render_fingerprint.py).
+
+    trigger picks the render profiles each plot is saved with (see render_profiles.py): 'refresh'
+    for just the cheap live PNGs, 'los' for the PDFs and high-dpi copies too.
     '''
 
     five_days_ago = dt.date.today() - dt.timedelta(days=5)
     two_days_hence = dt.date.today() + dt.timedelta(days=2)
 
-    fetch.data_source.set('maude allow_subset=True')
+    latest_telem = None
+    yesterday = dt.datetime.utcnow().date() - dt.timedelta(days=1)
+
+    # Top up every mission-wide MSID in one batched request (if it's due), rather than one MSID per panel
+    missionwide_msids = flatten(msidlists.dashboard_msids_missionwide)
+    missionwide_archive = LocalArchive(unit_system='eng')
+    missionwide_archive.update(missionwide_msids)
+    # Same for the thermal plots' MSIDs (in science units)
+    thermal_archive = LocalArchive(unit_system='sci')
+    thermal_archive.update(msidlists.monitor_temperature_msids)
+    latest_thermals = None
+
+    if engine is not None:
+        ancillary_futures = []
+        if telem is None:
+            for planned_client, msids in plan_refresh(dashboard=False, shield=True, motors=True).items():
+                ancillary_futures.extend(engine.submit_batches(
+                    planned_client, msids, five_days_ago))
+        latest_futures = engine.submit_batches(
+            FetchClient('maude'), missionwide_msids, yesterday)
+        thermal_futures = engine.submit_batches(
+            LATEST_THERMAL_CLIENT, msidlists.monitor_temperature_msids, '2020:340')
+
+        if telem is None:
+            telem = engine.gather(ancillary_futures, stage='shield and motor fetch')
+        latest_telem = engine.gather(latest_futures, stage='latest mission-wide fetch')
+        latest_thermals = engine.gather(thermal_futures, stage='latest thermal fetch')
+
+    if render_pool is not None:
+        render_ancillary_plots(render_pool, fig_save_directory, five_days_ago, two_days_hence,
+                               telem=telem, latest_telem=latest_telem, latest_thermals=latest_thermals,
+                               engine=engine, fingerprints=fingerprints, trigger=trigger)
+        return
+
+    if latest_telem is None:
+        # One batched fetch, rather than one per mission-wide panel
+        latest_telem = FetchClient('maude').get_telem(missionwide_msids, start=yesterday)
+    if latest_thermals is None:
+        latest_thermals = LATEST_THERMAL_CLIENT.get_telem(msidlists.monitor_temperature_msids, start='2020:340')
+
     print('Updating Event Rates Plot', end="\r", flush=True)
-    make_shield_plot(fig_save_directory=fig_save_directory,
-                     plot_start=five_days_ago, plot_stop=two_days_hence, show_in_gui=show_in_gui)
+    render_if_changed(fingerprints, 'shield', shield_inputs(telem, five_days_ago, two_days_hence),
+                      make_shield_plot, fig_save_directory=fig_save_directory,
+                      plot_start=five_days_ago, plot_stop=two_days_hence, show_in_gui=show_in_gui, telem=telem, engine=engine,
+                      profiles=profiles_for('shield', trigger))
     print('Done', end="\r", flush=True)
     # Clear the command line manually
     sys.stdout.write("\033[K")
 
-    fetch.data_source.set('cxc')
-    make_realtime_plot(fig_save_directory=fig_save_directory, plot_start=dt.datetime(
-        2000, 1, 4), plot_stop=None, sampling='daily', date_format=mdate.DateFormatter('%Y'), current_hline=True, missionwide=True, force_limits=True)
+    render_if_changed(fingerprints, 'missionwide', missionwide_inputs(missionwide_archive, latest_telem),
+                      render_missionwide_dashboard, fig_save_directory, latest_telem=latest_telem, archive=missionwide_archive,
+                      profiles=profiles_for('missionwide', trigger))
 
     print('Saved Mission-Wide Plots to {}'.format(
         fig_save_directory), end="\r", flush=True)
@@ -265,8 +382,10 @@ def make_ancillary_plots(fig_save_directory, show_in_gui=False):
     sys.stdout.write("\033[K")
 
     print('Updating Motor Plots', end="\r", flush=True)
-    make_motor_plots(fig_save_directory=fig_save_directory, plot_start=five_days_ago,
-                     plot_end=two_days_hence, sampling='full', date_format=mdate.DateFormatter('%m-%d'))
+    render_if_changed(fingerprints, 'motors', motor_inputs(telem, five_days_ago, two_days_hence),
+                      make_motor_plots, fig_save_directory=fig_save_directory, plot_start=five_days_ago,
+                      plot_end=two_days_hence, sampling='full', date_format=mdate.DateFormatter('%m-%d'), telem=telem,
+                      profiles=profiles_for('motors', trigger))
     print('Done', end="\r", flush=True)
     # Clear the command line manually
     sys.stdout.write("\033[K")
@@ -277,7 +396,9 @@ def make_ancillary_plots(fig_save_directory, show_in_gui=False):
     sys.stdout.write("\033[K")
 
     print('Updating Thermal Plots', end="\r", flush=True)
-    make_thermal_plots(fig_save_directory=fig_save_directory)
+    render_if_changed(fingerprints, 'thermals', thermal_inputs(thermal_archive, latest_thermals),
+                      make_thermal_plots, fig_save_directory=fig_save_directory, archive=thermal_archive,
+                      latest_datapoints=latest_thermals, profiles=profiles_for('thermals', trigger))
     print('Done', end="\r", flush=True)
     # Clear the command line manually
     sys.stdout.write("\033[K")
@@ -290,6 +411,82 @@ def make_ancillary_plots(fig_save_directory, show_in_gui=False):
     plt.close('all')
 
 
+def render_ancillary_plots(render_pool, fig_save_directory, plot_start, plot_stop, telem=None, latest_telem=None,
+                           latest_thermals=None, engine=None, fingerprints=None, trigger='los'):
+    '''
+    The pooled half of make_ancillary_plots(): fetch whatever's still missing, then draw the shield,
+    mission-wide, motor and thermal plots (in the render profiles that have changed, if fingerprints
+    is given) in parallel on the RenderPool's worker processes.
+    '''
+    yesterday = dt.datetime.utcnow().date() - dt.timedelta(days=1)
+    maude_client = FetchClient('maude')
+
+    # The workers should only draw, so every download happens here (at the same time, with an engine)
+    if engine is not None:
+        goes_future = engine.submit_download(get_goes_proxy)
+        orbit_future = engine.submit_download(fetch_orbit_metadata, plot_start)
+        if latest_thermals is None:
+            thermal_futures = engine.submit_batches(LATEST_THERMAL_CLIENT, msidlists.monitor_temperature_msids, '2020:340')
+    if telem is None:
+        telem = fetch_planned(plan_refresh(dashboard=False, shield=True, motors=True), plot_start, engine=engine)
+    if latest_telem is None:
+        latest_telem = maude_client.get_telem(flatten(msidlists.dashboard_msids_missionwide), start=yesterday)
+
+    if engine is not None:
+        if latest_thermals is None:
+            latest_thermals = engine.gather(thermal_futures, stage='latest thermal fetch')
+        orbit_metadata, stale_orbit_metadata = orbit_future.result(timeout=engine.timeout)
+    else:
+        if latest_thermals is None:
+            latest_thermals = LATEST_THERMAL_CLIENT.get_telem(msidlists.monitor_temperature_msids, start='2020:340')
+        orbit_metadata, stale_orbit_metadata = fetch_orbit_metadata(plot_start)
+
+    try:
+        goes_data = goes_future.result(timeout=engine.timeout) if engine is not None else get_goes_proxy()
+    except Exception:
+        # Better a shield plot without GOES than no shield plot
+        goes_data = ([], [])
+
+    # What each plot is drawn from, so the ones that haven't changed can be left alone (and for the manifest)
+    plot_fingerprints = {'shield': fingerprint(**shield_inputs(telem, plot_start, plot_stop, goes_data, orbit_metadata, stale_orbit_metadata)),
+                         'missionwide': fingerprint(**missionwide_inputs(LocalArchive(unit_system='eng'), latest_telem)),
+                         'motors': fingerprint(**motor_inputs(telem, plot_start, plot_stop)),
+                         'thermals': fingerprint(**thermal_inputs(LocalArchive(unit_system='sci'), latest_thermals))}
+
+    telem = portable(telem)
+    jobs = [RenderJob('shield', make_shield_plot, dict(fig_save_directory=fig_save_directory, plot_start=plot_start, plot_stop=plot_stop,
+                                                        telem=telem, orbit_metadata=orbit_metadata,
+                                                        stale_orbit_metadata=stale_orbit_metadata, goes_data=goes_data)),
+            RenderJob('missionwide', render_missionwide_dashboard, dict(fig_save_directory=fig_save_directory,
+                                                                        latest_telem=portable(latest_telem))),
+            RenderJob('motors', make_motor_plots, dict(fig_save_directory=fig_save_directory, plot_start=plot_start, plot_end=plot_stop,
+                                                       sampling='full', date_format=mdate.DateFormatter('%m-%d'), telem=telem)),
+            RenderJob('thermals', make_thermal_plots, dict(fig_save_directory=fig_save_directory,
+                                                           latest_datapoints=portable(latest_thermals)))]
+    for job in jobs:
+        job.kwargs['profiles'] = profiles_for(job.name, trigger)
+        job.fingerprint = plot_fingerprints[job.name]
+        if fingerprints is not None:
+            job.kwargs['profiles'] = fingerprints.stale(job.name, plot_fingerprints[job.name], job.kwargs['profiles'])
+    jobs = [job for job in jobs if len(job.kwargs['profiles']) > 0]
+    if len(jobs) == 0:
+        return {}
+
+    print(f'({timestamp_string()}) Rendering {len(jobs)} ancillary plots in parallel', end='\r', flush=True)
+    results = render_pool.run(jobs)
+
+    rendered_profiles = {job.name: job.kwargs['profiles'] for job in jobs}
+    for name, result in results.items():
+        if result.ok and fingerprints is not None:
+            fingerprints.record(name, plot_fingerprints[name], rendered_profiles[name])
+
+    failures = [result for result in results.values() if not result.ok]
+    if len(failures) > 0:
+        raise RenderError(failures)
+
+    return results
+
+
 def valid_date(s):
     try:
         return dt.datetime.strptime(s, "%Y-%m-%d")
@@ -336,9 +533,6 @@ def main() -> None:
     elif args.plot_stop is None:
         plot_stop = dt.date.today() + dt.timedelta(days=2)
 
-    if args.use_cheta:
-        fetch.data_source.set('cxc')
-
     make_realtime_plot(plot_start=plot_start, plot_stop=plot_stop,
                        current_hline=False, sampling=args.sampling, force_limits=args.force_limits, show_in_gui=True, use_cheta=args.use_cheta)
 
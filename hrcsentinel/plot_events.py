@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+'''
+Event-driven plot refresh.
+
+Instead of redrawing every plot on fixed iteration counts (the old
+in_comm_counter == 5 and out_of_comm_refresh_counter == 20), the monitors
+publish what actually happened on an EventBus:
+
+    AOS, LOS                    comm started or ended
+    NEW_SAMPLES                 new telemetry arrived (with the set of MSIDs it arrived for)
+    GOES_UPDATED                a new GOES proxy download came in
+    ORBIT_METADATA_UPDATED      a new web-Kadi orbit & DSN schedule came in
+
+and each plot declares, in a PlotRegistry, which events (and which MSIDs'
+new samples) make it out of date. The monitors then only redraw what's due:
+
+    >>> events = EventBus()
+    >>> plots = dashboard_registry(events)
+    >>> plots.take_due()  # nothing's been drawn yet
+    ['comm_status', 'realtime_dashboard', 'shield', 'ancillary']
+    >>> events.publish(NEW_SAMPLES, msids={'2SHEV1RT'})
+    >>> plots.take_due()
+    ['realtime_dashboard', 'shield']
+
+The registry also keeps track of which plots owe their archive copies (the
+expensive render profiles, see render_profiles.py). Every plot does until
+it's first drawn successfully with them, and again after each of its
+archive events (LOS):
+
+    >>> plots.render_trigger('shield')
+    'los'
+    >>> plots.mark_archived('shield')
+    >>> plots.render_trigger('shield')
+    'refresh'
+'''
+
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+import msidlists
+from fetch_planner import DASHBOARD_OVERLAY_MSIDS, flatten
+
+AOS = 'AOS'
+LOS = 'LOS'
+NEW_SAMPLES = 'NEW_SAMPLES'
+GOES_UPDATED = 'GOES_UPDATED'
+ORBIT_METADATA_UPDATED = 'ORBIT_METADATA_UPDATED'
+
+
+class EventBus:
+    '''
+    A tiny synchronous publish/subscribe hub. Subscribers are called, in the
+    order they subscribed, on whichever thread publishes.
+    '''
+
+    def __init__(self):
+        self._subscribers = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def subscribe(self, kind, callback):
+        '''
+        Call callback(kind, payload) every time an event of this kind is published
+        '''
+        with self._lock:
+            self._subscribers[kind].append(callback)
+
+    def publish(self, kind, **payload):
+        with self._lock:
+            subscribers = list(self._subscribers[kind])
+        for callback in subscribers:
+            callback(kind, payload)
+
+
+class SampleWatcher:
+    '''
+    Compares each batch of fetched telemetry with the last one, and publishes
+    NEW_SAMPLES for the MSIDs whose latest sample is newer than before.
+    '''
+
+    def __init__(self, events):
+        self.events = events
+        self.last_times = {}
+
+    def observe(self, telem):
+        '''
+        :param telem: A dict of MSID-like objects keyed by MSID (e.g. from fetch_planned)
+        :return: The set of MSIDs that got new samples
+        '''
+        new_samples = set()
+        for msid, data in telem.items():
+            if len(data.times) == 0:
+                continue
+            last_time = float(np.asarray(data.times)[-1])
+            if last_time > self.last_times.get(msid, -np.inf):
+                self.last_times[msid] = last_time
+                new_samples.add(msid)
+
+        if new_samples:
+            self.events.publish(NEW_SAMPLES, msids=frozenset(new_samples))
+
+        return new_samples
+
+
+class PlotRegistry:
+    '''
+    Keeps track of which plots are out of date.
+
+    A plot is due when one of its events is published, when new samples
+    arrive for one of its MSIDs, when it's older than its max_age (for plots
+    with a "Now" line or an uptime that drift even without new data), or if
+    it has never been drawn at all.
+    '''
+
+    def __init__(self, events):
+        self.events = events
+        self._plots = {}
+        self._invalidated = set()
+        self._rendered_at = {}
+        self._archive_due = set()
+        self._lock = threading.Lock()
+        self._subscribed = set()
+
+    def register(self, name, events=(), msids=(), max_age=None, archive_events=()):
+        '''
+        :param name: What to call the plot (the monitors map names to plotting functions)
+        :param events: Event kinds that make this plot out of date
+        :param msids: New samples for any of these MSIDs make this plot out of date
+        :param max_age: Redraw after this many seconds even if nothing happened (None for never)
+        :param archive_events: Event kinds that make this plot (and its archive copies) out of date
+        '''
+        with self._lock:
+            self._plots[name] = {'events': set(events), 'msids': frozenset(msids), 'max_age': max_age,
+                                 'archive_events': set(archive_events)}
+            # Never drawn, so it's due
+            self._invalidated.add(name)
+            self._archive_due.add(name)
+
+        kinds = set(events) | set(archive_events) | ({NEW_SAMPLES} if msids else set())
+        for kind in kinds - self._subscribed:
+            self.events.subscribe(kind, self._on_event)
+            self._subscribed.add(kind)
+
+    def _on_event(self, kind, payload):
+        with self._lock:
+            for name, plot in self._plots.items():
+                if kind == NEW_SAMPLES and plot['msids'] & payload.get('msids', frozenset()):
+                    self._invalidated.add(name)
+                elif kind in plot['events']:
+                    self._invalidated.add(name)
+                if kind in plot['archive_events']:
+                    self._invalidated.add(name)
+                    self._archive_due.add(name)
+
+    def invalidate(self, *names):
+        with self._lock:
+            self._invalidated.update(names)
+
+    def render_trigger(self, name):
+        '''
+        'los' if this plot's archive copies are due (draw it with render_profiles.profiles_for(name, 'los')),
+        'refresh' otherwise
+        '''
+        with self._lock:
+            return 'los' if name in self._archive_due else 'refresh'
+
+    def mark_archived(self, name):
+        '''
+        Call once a plot has been drawn (successfully) with its 'los' render trigger
+        '''
+        with self._lock:
+            self._archive_due.discard(name)
+
+    def _is_due(self, name, now):
+        if name in self._invalidated:
+            return True
+        max_age = self._plots[name]['max_age']
+        return max_age is not None and now - self._rendered_at.get(name, -np.inf) >= max_age
+
+    def take_due(self, now=None):
+        '''
+        Return the plots that need redrawing (in the order they were registered),
+        and count them as drawn from now. Anything that invalidates them while
+        they're being drawn makes them due again.
+        '''
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            due = [name for name in self._plots if self._is_due(name, now)]
+            for name in due:
+                self._invalidated.discard(name)
+                self._rendered_at[name] = now
+        return due
+
+    def seconds_until_due(self, now=None):
+        '''
+        How long until the next plot becomes due through age alone (0 if one is due already,
+        None if nothing ever will be without an event).
+        '''
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self._invalidated:
+                return 0.0
+            waits = [self._rendered_at.get(name, -np.inf) + plot['max_age'] - now
+                     for name, plot in self._plots.items() if plot['max_age'] is not None]
+        return max(0.0, min(waits)) if waits else None
+
+
+def dashboard_registry(events):
+    '''
+    The plots monitor_telemetry keeps up to date, in the order they should be drawn
+    '''
+    plots = PlotRegistry(events)
+
+    # The uptime on the stamp is in days, so hourly is plenty
+    plots.register('comm_status', events=(AOS, LOS), max_age=3600)
+    # These two have a "Now" line, which moves whether or not there's new data
+    # In comm they're only saved as live PNGs, and get their PDFs (etc.) at LOS
+    plots.register('realtime_dashboard', msids=flatten(msidlists.dashboard_msids_latest) + DASHBOARD_OVERLAY_MSIDS,
+                   max_age=600, archive_events=(LOS,))
+    plots.register('shield', events=(GOES_UPDATED, ORBIT_METADATA_UPDATED), msids=msidlists.rate_msids,
+                   max_age=600, archive_events=(LOS,))
+    # Mission-wide, motor and thermal plots: after each pass, whenever the motors move, and every half hour
+    plots.register('ancillary', msids=flatten(msidlists.motor_dashboard_msids),
+                   max_age=1800, archive_events=(LOS,))
+
+    return plots
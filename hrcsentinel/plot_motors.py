@@ -11,7 +11,6 @@ import time
 import pytz
 import traceback
 
-from Ska.engarchive import fetch_sci as fetch
 import Chandra.Time
 
 from astropy.table import Table
@@ -20,16 +19,27 @@ import datetime as dt
 import matplotlib.dates as mdate
 from matplotlib import gridspec
 
-from chandratime import convert_to_doy
+from chandratime import cxctime_to_plotdate as cxc2pd
+from fetch_client import FetchClient
+from decimation import decimate_for_axes
+from render_profiles import DEFAULT_PROFILES, save_figure
 
 
 import matplotlib.pyplot as plt
 # plt.switch_backend('agg')
 
 
-def make_motor_plots(counter=None, fig_save_directory='/proj/web-icxc/htdocs/hrcops/hrcmonitor/plots/', plot_start=dt.datetime(2020, 8, 31, 00), plot_end=dt.date.today() + dt.timedelta(days=2), sampling='full', current_hline=False, date_format=mdate.DateFormatter('%d %H'), force_limits=False, missionwide=False):
+def make_motor_plots(counter=None, fig_save_directory='/proj/web-icxc/htdocs/hrcops/hrcmonitor/plots/', plot_start=dt.datetime(2020, 8, 31, 00), plot_end=dt.date.today() + dt.timedelta(days=2), sampling='full', current_hline=False, date_format=mdate.DateFormatter('%d %H'), force_limits=False, missionwide=False, telem=None, client=None, profiles=DEFAULT_PROFILES):
+    '''
+    Make the 12-panel motor dashboard. If telem (a dict of pre-fetched telemetry
+    keyed by MSID, e.g. from fetch_planner) is given, it's used instead of
+    fetching each MSID one at a time.
+    '''
 
-    fetch.data_source.set('maude allow_subset=True')
+    if client is None:
+        # These are state MSIDs, and we plot their raw values, so we need cheta's state codes
+        client = FetchClient('maude', allow_subset=True,
+                             state_codes=True, unit_system='sci')
 
     plt.style.use('ggplot')
     labelsizes = 8
@@ -50,8 +60,11 @@ def make_motor_plots(counter=None, fig_save_directory='/proj/web-icxc/htdocs/hrc
             ax = fig.add_subplot(gs[i, j])
             plotnum += 1
             for msid in motor_dashboard_msids[plotnum]:
-                data = fetch.get_telem(
-                    msid, start=convert_to_doy(plot_start), sampling=sampling, max_fetch_Mb=100000, max_output_Mb=100000, quiet=True)
+                if telem is not None and msid in telem:
+                    data = telem
+                else:
+                    data = client.get_telem(
+                        msid, start=plot_start, sampling=sampling)
 
                 # print('Fetching from {} at {} resolution: {}'.format(
                 #     convert_to_doy(plot_start), sampling, msid), end='\r', flush=True)
@@ -59,8 +72,10 @@ def make_motor_plots(counter=None, fig_save_directory='/proj/web-icxc/htdocs/hrc
                 # sys.stdout.write("\033[K")
 
                 # plotting the absolute value here to ignore -1
-                ax.plot_date(cxc2dt(
-                    data[msid].times), abs(data[msid].raw_vals), markersize=1, label=msid, zorder=1, rasterized=True, alpha=0.8)
+                times, raw_vals = decimate_for_axes(
+                    ax, data[msid].times, abs(data[msid].raw_vals))
+                ax.plot_date(cxc2pd(times), raw_vals, markersize=1,
+                             label=msid, zorder=1, rasterized=True, alpha=0.8)
 
                 # Plot a HORIZONTAL line at location of last data point.
                 if current_hline is True:
@@ -91,12 +106,8 @@ def make_motor_plots(counter=None, fig_save_directory='/proj/web-icxc/htdocs/hrc
         plt.suptitle(t='Updated as of {} EST'.format(dt.datetime.now(
         ).strftime("%Y-%b-%d %H:%M:%S")), color='slategray', size=6)
 
-    fig.savefig(fig_save_directory + 'motors.png',
-                dpi=300, bbox_inches='tight')
-    fig.savefig(fig_save_directory + 'motors.pdf',
-                dpi=300, bbox_inches='tight')
+    save_figure(fig, fig_save_directory, 'motors', profiles, bbox_inches='tight')
     plt.close()
-    fetch.data_source.set('cxc')
 
 
 if __name__ == "__main__":
@@ -17,27 +17,32 @@ import yaml
 from astropy.table import Table
 from astropy.time import Time
 from Chandra.Time import DateTime as cxcDateTime
-from cheta import fetch
 from kadi import events
 from matplotlib import pyplot as plt
 from matplotlib.patches import Rectangle
-from Ska.Matplotlib import cxctime2plotdate as cxc2pd
 
 from global_configuration import allowed_hosts
 import plot_stylers
-from chandratime import cxctime_to_datetime as cxc2dt, convert_to_doy
+from chandratime import cxctime_to_plotdate as cxc2pd, convert_to_doy
+from fetch_client import FetchClient
+from decimation import decimate_for_axes
 from goes_proxy import get_goes_proxy
 from plot_helpers import drawnow
+from render_profiles import DEFAULT_PROFILES, save_figure
 
 from heartbeat import timestamp_string
+from artifact_publisher import write_atomically
 
 
-def grab_orbit_metadata(plot_start=dt.date.today() - dt.timedelta(days=5)):
+def grab_orbit_metadata(plot_start=dt.date.today() - dt.timedelta(days=5), session=None):
     '''
     Use the web-Kadi API to grab orbit metadata.
     This allows us to query Kadi and avoid the events.db3 update hiccup
 
     See here for web-Kadi: https://kadi.cfa.harvard.edu/api/
+
+    If session (a requests.Session, e.g. from a FetchEngine) is given, both
+    requests go over its keep-alive connection.
     '''
     orbit_metadata = {}
 
@@ -45,36 +50,55 @@ def grab_orbit_metadata(plot_start=dt.date.today() - dt.timedelta(days=5)):
 
         request_string = f"https://kadi.cfa.harvard.edu/api/ska_api/kadi/events/{event}/filter?start={convert_to_doy(plot_start)}&stop={convert_to_doy(dt.date.today() + dt.timedelta(days=3))}"
 
-        with urllib.request.urlopen(request_string, timeout=40) as url:
-            orbit_metadata[event] = json.load(url)
+        if session is not None:
+            response = session.get(request_string, timeout=40)
+            response.raise_for_status()
+            orbit_metadata[event] = response.json()
+        else:
+            with urllib.request.urlopen(request_string, timeout=40) as url:
+                orbit_metadata[event] = json.load(url)
 
         time.sleep(10)
 
     return orbit_metadata
 
 
-def make_shield_plot(fig_save_directory='/proj/web-icxc/htdocs/hrcops/hrcmonitor/plots/', plot_start=dt.date.today() - dt.timedelta(days=5), plot_stop=dt.date.today() + dt.timedelta(days=3), custom_ylims=None, show_plot=False, custom_save_name=None, figure_size=(16, 8), save_dpi=300, show_in_gui=False):
+def save_orbit_metadata(orbit_metadata, path="last_orbit_metadata.json"):
     '''
-    Create a shield plot. Fix this.
+    Save orbit metadata for the next time web-Kadi won't answer. Atomically, because
+    fetch_orbit_metadata() and the CommScheduler both write (and read) the same file,
+    sometimes at the same time.
+    '''
+    def write(temp_path):
+        with open(temp_path, "w") as orbit_metadata_json_file:
+            json.dump(orbit_metadata, orbit_metadata_json_file)
+
+    write_atomically(path, write)
+
+
+def fetch_orbit_metadata(plot_start=dt.date.today() - dt.timedelta(days=5), session=None, max_attempts=4):
     '''
+    grab_orbit_metadata(), but don't die if it fails. Try a few times, and if
+    web-Kadi still won't answer, fall back to the last copy we saved.
 
+    Returns (orbit_metadata, using_stale_orbit_metadata). orbit_metadata is
+    None if there's no saved copy either.
+    '''
     # Get the orbit metadata. Don't die if it fails. Try three times.
     attempts = 0
-    max_attempts = 4  # how many times to try to get the metadata
     using_stale_orbit_metadata = True
     while attempts <= max_attempts:
         try:
             orbit_metadata = grab_orbit_metadata(
-                plot_start=plot_start)
+                plot_start=plot_start, session=session)
             # Save that successfully fetched orbit metadata as a json file for loading just in case
-            with open("last_orbit_metadata.json", "w") as orbit_metadata_json_file:
-                json.dump(orbit_metadata, orbit_metadata_json_file)
+            save_orbit_metadata(orbit_metadata)
             using_stale_orbit_metadata = False
             # print(
             #     f'Successfully fetched orbit metadata and saved it as last_orbit_metadata.json.')
             break
 
-        except HTTPError:
+        except (HTTPError, requests.HTTPError):
             attempts += 1
             time.sleep(10)  # give the server a few to chill...
             # You can print this, but it's annoying
@@ -96,7 +120,41 @@ def make_shield_plot(fig_save_directory='/proj/web-icxc/htdocs/hrcops/hrcmonitor
                 f'({timestamp_string()}) This will probably resolve soon, so we will press on.')
             orbit_metadata = None
 
-    fetch.data_source.set('maude allow_subset=False')
+    return orbit_metadata, using_stale_orbit_metadata
+
+
+def make_shield_plot(fig_save_directory='/proj/web-icxc/htdocs/hrcops/hrcmonitor/plots/', plot_start=dt.date.today() - dt.timedelta(days=5), plot_stop=dt.date.today() + dt.timedelta(days=3), custom_ylims=None, show_plot=False, custom_save_name=None, figure_size=(16, 8), save_dpi=300, show_in_gui=False, telem=None, client=None, engine=None, orbit_metadata=None, stale_orbit_metadata=False, goes_data=None, profiles=DEFAULT_PROFILES):
+    '''
+    Create a shield plot. Fix this.
+
+    If telem (a dict of pre-fetched telemetry keyed by MSID, e.g. from fetch_planner) is given,
+    the event rates are taken from it rather than fetched here. Otherwise they're
+    fetched with client (full-resolution MAUDE by default).
+
+    If engine (a FetchEngine) is given, the GOES download runs in the background
+    while we wait on Kadi, and both use the engine's pooled HTTP sessions.
+
+    If orbit_metadata (from fetch_orbit_metadata()) and/or goes_data (the
+    (times, rates) from get_goes_proxy()) are given, they're used as-is and
+    nothing is downloaded here. Pass stale_orbit_metadata=True if the metadata
+    is an old copy, so the title says so.
+    '''
+
+    session = engine.session() if engine is not None else None
+    # Unless we've been handed the GOES data, start downloading it now so it arrives while we wait on Kadi
+    if engine is not None and goes_data is None:
+        goes_future = engine.submit_download(get_goes_proxy)
+    else:
+        goes_future = None
+
+    if orbit_metadata is None:
+        orbit_metadata, using_stale_orbit_metadata = fetch_orbit_metadata(
+            plot_start=plot_start, session=session)
+    else:
+        using_stale_orbit_metadata = stale_orbit_metadata
+
+    if client is None:
+        client = FetchClient('maude', allow_subset=False)
 
     msidlist = ['2TLEV1RT', '2VLEV1RT', '2SHEV1RT']
     namelist = ['Total Event Rate', 'Valid Event Rate', 'AntiCo Shield Rate']
@@ -104,15 +162,24 @@ def make_shield_plot(fig_save_directory='/proj/web-icxc/htdocs/hrcops/hrcmonitor
     fig, ax = plt.subplots(figsize=figure_size)
 
     for i, msid in enumerate(msidlist):
-        data = fetch.get_telem(msid, start=convert_to_doy(
-            plot_start), sampling='full', max_fetch_Mb=100000, max_output_Mb=100000, quiet=True)
+        if telem is not None and msid in telem:
+            data = telem
+        else:
+            data = client.get_telem(msid, start=plot_start)
         # ax.plot(data[msid].times, data[msid].vals, label=msid)
-        ax.plot_date(cxc2dt(
-            data[msid].times), data[msid].vals, marker='o', fmt="", markersize=1.5, label=namelist[i])
+        # Plot each bin's min & max rather than every sample. Spikes survive, since they're always a bin's max.
+        times, vals = decimate_for_axes(ax, data[msid].times, data[msid].vals)
+        ax.plot_date(cxc2pd(times), vals, marker='o', fmt="",
+                     markersize=1.5, label=namelist[i])
 
     # Try to plot the GOES proxy rates. Don't die if it fails.
     try:
-        goes_times, goes_rates = get_goes_proxy()
+        if goes_data is not None:
+            goes_times, goes_rates = goes_data
+        elif goes_future is not None:
+            goes_times, goes_rates = goes_future.result(timeout=engine.timeout)
+        else:
+            goes_times, goes_rates = get_goes_proxy()
         ax.plot_date(goes_times, goes_rates, marker=None, fmt="",
                      alpha=0.8, zorder=1, label='GOES-16 Proxy')
     except Exception as e:
@@ -148,9 +215,9 @@ def make_shield_plot(fig_save_directory='/proj/web-icxc/htdocs/hrcops/hrcmonitor
             comm_start_raw = comm['tstart'] + 3600
             comm_stop_raw = comm['tstop']
 
-            comm_start = cxc2dt(comm_start_raw)
-            comm_stop = cxc2dt(comm_stop_raw)
-            comm_midpoint = cxc2dt(
+            comm_start = cxc2pd(comm_start_raw)
+            comm_stop = cxc2pd(comm_stop_raw)
+            comm_midpoint = cxc2pd(
                 (comm_stop_raw + comm_start_raw) / 2)
 
             # comm_midpoint = mdate.num2date((cxc2pd(cxcDateTime(
@@ -174,10 +241,10 @@ def make_shield_plot(fig_save_directory='/proj/web-icxc/htdocs/hrcops/hrcmonitor
             radzone_start_raw = orbit['t_perigee'] + orbit['dt_start_radzone']
             radzone_stop_raw = orbit['t_perigee'] + orbit['dt_stop_radzone']
 
-            radzone_start = cxc2dt(radzone_start_raw)
-            radzone_stop = cxc2dt(radzone_stop_raw)
+            radzone_start = cxc2pd(radzone_start_raw)
+            radzone_stop = cxc2pd(radzone_stop_raw)
 
-            radzone_midpoint = cxc2dt(
+            radzone_midpoint = cxc2pd(
                 (radzone_stop_raw + radzone_start_raw) / 2)
 
             ax.axvspan(radzone_start, radzone_stop,
@@ -192,10 +259,7 @@ def make_shield_plot(fig_save_directory='/proj/web-icxc/htdocs/hrcops/hrcmonitor
     plt.yticks(fontsize=12)
 
     if custom_save_name is None:
-        fig.savefig(fig_save_directory + 'events.png',
-                    dpi=save_dpi, bbox_inches='tight')
-        fig.savefig(fig_save_directory + 'events.pdf',
-                    dpi=save_dpi, bbox_inches='tight')
+        save_figure(fig, fig_save_directory, 'events', profiles, bbox_inches='tight')
     elif custom_save_name is not None:
         fig.savefig(custom_save_name, dpi=save_dpi, bbox_inches='tight')
 
@@ -1,11 +1,10 @@
 #!/usr/bin/env conda run -n ska3 python
 
-from msidlists import *
+from msidlists import monitor_temperature_msids
 import pandas as pd
 import numpy as np
 import sys
 
-from Ska.engarchive import fetch_sci as fetch
 import Chandra.Time
 
 from astropy.table import Table
@@ -15,12 +14,20 @@ import pytz
 import matplotlib.dates as mdate
 from matplotlib import gridspec
 
-from chandratime import cxctime_to_datetime, convert_to_doy
+from chandratime import cxctime_to_plotdate, convert_to_doy
+from fetch_client import FetchClient
+from local_archive import LocalArchive
+from render_profiles import DEFAULT_PROFILES, save_figure
 
 
 import matplotlib.pyplot as plt
 # plt.switch_backend('agg')
 
+# The latest thermal values, in science units (deg C) like the mission-long trends they're plotted
+# against. Asking for science units sends the fetch through cheta's get_telem(), which also
+# filters out bad data, just as fetch.Msid(..., filter_bad=True) used to.
+LATEST_THERMAL_CLIENT = FetchClient('maude', unit_system='sci')
+
 
 def compute_yearly_average(values, window):
 
@@ -40,13 +47,33 @@ def compute_yearly_average(values, window):
     return moving_ave_array
 
 
-def make_thermal_plots(counter=None, fig_save_directory='/proj/web-icxc/htdocs/hrcops/hrcmonitor/plots/'):
-
-    # Fetch all MSIDs
-    msids_daily = fetch.Msidset(
-        monitor_temperature_msids, start='2001:001', stat='daily', filter_bad=True)
-    msids_5min = fetch.MSIDset(
-        monitor_temperature_msids, start='2001:001', stat='5min', filter_bad=True)
+def make_thermal_plots(counter=None, fig_save_directory='/proj/web-icxc/htdocs/hrcops/hrcmonitor/plots/', engine=None, archive=None, latest_datapoints=None, profiles=DEFAULT_PROFILES):
+    '''
+    Make the mission-lifetime thermal plots (thermals and thermal_trends). If latest_datapoints
+    (the latest MAUDE telemetry for monitor_temperature_msids, keyed by MSID) is given, it's
+    used instead of fetching it here.
+    '''
+
+    # Mission-long trends come from the local (memory-mapped) copy of the CXC archive, and the latest values straight from MAUDE.
+    if archive is None:
+        archive = LocalArchive(unit_system='sci')
+
+    # Fetch all MSIDs. The latest MAUDE values are grabbed in one go (rather than once per MSID per figure),
+    # and with a FetchEngine that happens while the local archive is read (and topped up, if it's due).
+    if latest_datapoints is not None:
+        msids_daily = archive.get_telem(
+            monitor_temperature_msids, start='2001:001', sampling='daily')
+    elif engine is not None:
+        latest_futures = engine.submit_batches(
+            LATEST_THERMAL_CLIENT, monitor_temperature_msids, start='2020:340')
+        msids_daily = archive.get_telem(
+            monitor_temperature_msids, start='2001:001', sampling='daily')
+        latest_datapoints = engine.gather(latest_futures, stage='latest thermal fetch')
+    else:
+        msids_daily = archive.get_telem(
+            monitor_temperature_msids, start='2001:001', sampling='daily')
+        latest_datapoints = LATEST_THERMAL_CLIENT.get_telem(
+            monitor_temperature_msids, start='2020:340')
 
     ave_table = Table()  # Instantiate an empty AstroPy table that we can later sort
 
@@ -100,14 +127,13 @@ def make_thermal_plots(counter=None, fig_save_directory='/proj/web-icxc/htdocs/h
             msid), end='\r', flush=True)
         # Clear the command line manually
         sys.stdout.write("\033[K")
-        ax.plot_date(cxctime_to_datetime(msids_daily[msid].times),
+        ax.plot_date(cxctime_to_plotdate(msids_daily[msid].times),
                      msids_daily[msid].means, '.', alpha=1.0, markersize=2.5, label='{}'.format(msid), color=plt.cm.RdYlBu_r(i),  rasterized=rasterized)
 
         # Draw a large point line where the current data point is
-        with fetch.data_source('maude'):
-            latest_datapoint = fetch.Msid(msid, start='2020:340')
-            ax.plot_date(cxctime_to_datetime(latest_datapoint.times)[
-                         -1], latest_datapoint.vals[-1], markersize=8, color=plt.cm.RdYlBu_r(i), rasterized=rasterized, zorder=4)
+        latest_datapoint = latest_datapoints[msid]
+        ax.plot_date(cxctime_to_plotdate(latest_datapoint.times)[
+                     -1], latest_datapoint.vals[-1], markersize=8, color=plt.cm.RdYlBu_r(i), rasterized=rasterized, zorder=4)
 
     ax.set_ylabel("Temperature (C)", fontsize=10)
     ax.set_xlabel("Date", fontsize=10)
@@ -136,17 +162,12 @@ def make_thermal_plots(counter=None, fig_save_directory='/proj/web-icxc/htdocs/h
     ax.set_xlim(dt.datetime(2001, 1, 1),
                 dt.date.today() + dt.timedelta(days=180))
 
-    fig.savefig(fig_save_directory + 'thermals.png',
-                dpi=300, bbox_inches='tight')
-    fig.savefig(fig_save_directory + 'thermals.pdf',
-                dpi=300, bbox_inches='tight')
+    save_figure(fig, fig_save_directory, 'thermals', profiles, bbox_inches='tight')
 
     plt.close()
 
     # Make the moving averages figure
 
-    fetch.data_source.set('cxc')
-
     fig, ax = plt.subplots(figsize=(17, 8))
 
     n_lines = len(ordered_msidlist)
@@ -159,7 +180,7 @@ def make_thermal_plots(counter=None, fig_save_directory='/proj/web-icxc/htdocs/h
         # Clear the command line manually
         sys.stdout.write("\033[K")
 
-        times = cxctime_to_datetime(msids_daily[msid].times)
+        times = cxctime_to_plotdate(msids_daily[msid].times)
         # ax.plot(all_trends["{}_trend".format(msidname)], lw=3.0, label=msidname, color=plt.cm.coolwarm(i))
         ax.plot_date(times[time_corrector:], all_trends["{}_trend".format(
             msid)], '-', label='{}'.format(msid), lw=3.0, color=plt.cm.RdYlBu_r(i), rasterized=rasterized)
@@ -167,10 +188,9 @@ def make_thermal_plots(counter=None, fig_save_directory='/proj/web-icxc/htdocs/h
             msid)], all_trends["{}_trend".format(msid)] - all_trends["{}_stds".format(msid)], facecolor='gray', alpha=0.4)
 
         # Draw a large point line where the current data point is
-        with fetch.data_source('maude'):
-            latest_datapoint = fetch.Msid(msid, start='2020:340')
-            ax.plot_date(cxctime_to_datetime(latest_datapoint.times)[
-                         -1], latest_datapoint.vals[-1], markersize=8, color=plt.cm.RdYlBu_r(i), rasterized=rasterized, zorder=4)
+        latest_datapoint = latest_datapoints[msid]
+        ax.plot_date(cxctime_to_plotdate(latest_datapoint.times)[
+                     -1], latest_datapoint.vals[-1], markersize=8, color=plt.cm.RdYlBu_r(i), rasterized=rasterized, zorder=4)
 
     ax.legend(prop={'size': 13}, loc='center left',
               bbox_to_anchor=(1, 0.5))
@@ -200,10 +220,7 @@ def make_thermal_plots(counter=None, fig_save_directory='/proj/web-icxc/htdocs/h
 
     ax.set_ylim(0, 40)
 
-    fig.savefig(fig_save_directory + 'thermal_trends.png',
-                dpi=300, bbox_inches='tight')
-    fig.savefig(fig_save_directory + 'thermal_trends.pdf',
-                dpi=300, bbox_inches='tight')
+    save_figure(fig, fig_save_directory, 'thermal_trends', profiles, bbox_inches='tight')
 
     plt.close()
 
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+'''
+Skip re-rendering plots whose inputs haven't changed.
+
+Plenty of refreshes redraw a plot from exactly the data it was last drawn
+from: out of comm nothing new arrives for hours, and the mission-wide and
+thermal plots are built from daily stats that change once a day. Before each
+plot is drawn, we boil what it's drawn from down to a fingerprint:
+
+    - the number of samples and the last timestamp of every MSID on it,
+    - the plot window,
+    - the last archived day (for plots made from the local archive),
+    - versions of the GOES and orbit metadata downloads,
+    - and a coarse clock, so the "Now" line still creeps along,
+
+and if that matches the fingerprint of the last copy we published (and
+that copy is still on disk), the whole render and savefig is skipped:
+
+    >>> fingerprints = FingerprintStore(fig_save_directory)
+    >>> render_if_changed(fingerprints, 'motors', motor_inputs(telem, plot_start, plot_stop),
+    ...                   make_motor_plots, fig_save_directory=fig_save_directory, telem=telem)
+    False
+
+Each render profile (see render_profiles.py) of a plot is fingerprinted on
+its own, so the archive copies made at LOS are only redrawn if something's
+changed since the last LOS, and the function is only asked for the profiles
+that are actually out of date.
+
+The fingerprints are kept in a small JSON file (render_fingerprint_path in
+global_configuration.py), so they survive a restart.
+'''
+
+import datetime as dt
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+import msidlists
+from artifact_publisher import publishing
+from fetch_planner import DASHBOARD_OVERLAY_MSIDS, flatten
+from global_configuration import render_fingerprint_path
+from render_profiles import DEFAULT_PROFILES, artifact_files
+
+# What each plot is saved as (without extensions; which files that means depends on the render profile).
+# If any of them has gone missing, redraw it.
+ARTIFACTS = {'realtime_dashboard': ('status',),
+             'shield': ('events',),
+             'missionwide': ('status_wide',),
+             'motors': ('motors',),
+             'thermals': ('thermals', 'thermal_trends')}
+
+
+def telemetry_state(telem, msids):
+    '''
+    How many samples each MSID has, and when the last one was. None if we can't tell
+    (no telem, or an MSID missing from it, which the plot would then fetch itself).
+    '''
+    if telem is None:
+        return None
+    state = {}
+    for msid in msids:
+        if msid not in telem:
+            return None
+        times = np.asarray(telem[msid].times)
+        state[msid] = (len(times), float(times[-1]) if len(times) > 0 else None)
+    return state
+
+
+def archive_state(archive, msids):
+    '''
+    The last archived day of each MSID in a LocalArchive
+    '''
+    return {msid: archive.last_time(msid) for msid in msids}
+
+
+def data_version(data):
+    '''
+    A short hash of a download (e.g. the GOES proxy or the web-Kadi orbit metadata)
+    '''
+    if data is None:
+        return None
+    return hashlib.blake2b(json.dumps(data, sort_keys=True, default=str).encode(), digest_size=8).hexdigest()
+
+
+def clock(resolution):
+    '''
+    Ticks over every resolution seconds. For plots with a "Now" line (or an "Updated as of"),
+    which should still be redrawn every so often even when nothing else has changed.
+    '''
+    return int(time.time() // resolution)
+
+
+def fingerprint(**inputs):
+    '''
+    A hash of everything a plot is drawn from, or None if any of it is unknown (and so the plot should just be drawn).
+    '''
+    if any(value is None for value in inputs.values()):
+        return None
+    return hashlib.blake2b(json.dumps(inputs, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+
+def realtime_dashboard_inputs(telem, plot_start, plot_stop, vcdu_events=None):
+    msids = flatten(msidlists.dashboard_msids_latest) + DASHBOARD_OVERLAY_MSIDS
+    return dict(telem=telemetry_state(telem, msids), window=(plot_start, plot_stop),
+                vcdu=data_version(vcdu_events or []), now=clock(1800))
+
+
+def shield_inputs(telem, plot_start, plot_stop, goes_data=None, orbit_metadata=None, stale_orbit_metadata=False):
+    '''
+    Without goes_data and orbit_metadata, make_shield_plot() downloads them itself, so all we can do is
+    redraw it as often as GOES updates.
+    '''
+    downloads = dict(goes=data_version(goes_data), orbits=data_version(orbit_metadata), stale=stale_orbit_metadata,
+                     now=clock(1800)) \
+        if goes_data is not None and orbit_metadata is not None else dict(now=clock(300))
+    return dict(telem=telemetry_state(telem, msidlists.rate_msids), window=(plot_start, plot_stop), **downloads)
+
+
+def missionwide_inputs(archive, latest_telem):
+    msids = flatten(msidlists.dashboard_msids_missionwide)
+    return dict(archive=archive_state(archive, msids), latest=telemetry_state(latest_telem, msids),
+                day=dt.date.today())
+
+
+def motor_inputs(telem, plot_start, plot_stop):
+    return dict(telem=telemetry_state(telem, flatten(msidlists.motor_dashboard_msids)),
+                window=(plot_start, plot_stop), now=clock(3600))
+
+
+def thermal_inputs(archive, latest_datapoints):
+    return dict(archive=archive_state(archive, msidlists.monitor_temperature_msids),
+                latest=telemetry_state(latest_datapoints, msidlists.monitor_temperature_msids),
+                day=dt.date.today())
+
+
+class FingerprintStore:
+    '''
+    The fingerprint of the last published copy of each plot
+    '''
+
+    def __init__(self, fig_save_directory, path=render_fingerprint_path):
+        self.fig_save_directory = fig_save_directory
+        self.path = path
+        try:
+            with open(path) as fingerprint_file:
+                self.fingerprints = json.load(fingerprint_file)
+        except (OSError, ValueError):
+            self.fingerprints = {}
+
+    def unchanged(self, name, plot_fingerprint, profile='live'):
+        '''
+        Is the published copy of this plot (in this render profile) already drawn from exactly these inputs?
+        '''
+        if plot_fingerprint is None or self.fingerprints.get(f'{name}/{profile}') != plot_fingerprint:
+            return False
+        return all(os.path.exists(os.path.join(self.fig_save_directory, artifact))
+                   for base_name in ARTIFACTS.get(name, ()) for artifact in artifact_files(base_name, (profile,)))
+
+    def stale(self, name, plot_fingerprint, profiles=DEFAULT_PROFILES):
+        '''
+        The profiles of this plot that need drawing
+        '''
+        return tuple(profile for profile in profiles if not self.unchanged(name, plot_fingerprint, profile))
+
+    def record(self, name, plot_fingerprint, profiles=DEFAULT_PROFILES):
+        '''
+        Remember what a plot was just published from. Only call this once it's actually been saved.
+        '''
+        if plot_fingerprint is None:
+            return
+        for profile in profiles:
+            self.fingerprints[f'{name}/{profile}'] = plot_fingerprint
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as fingerprint_file:
+            json.dump(self.fingerprints, fingerprint_file)
+        os.replace(temp_path, self.path)
+
+
+def render_if_changed(fingerprints, name, inputs, function, *args, profiles=DEFAULT_PROFILES, **kwargs):
+    '''
+    Call function(*args, profiles=..., **kwargs) to draw a plot in whichever of these render profiles
+    fingerprints (a FingerprintStore, or None to always draw) says weren't drawn from the same inputs.
+    Returns True if it drew. Whatever it publishes is recorded with the fingerprint (see artifact_publisher.py).
+    '''
+    plot_fingerprint = fingerprint(**inputs)
+    if fingerprints is None:
+        with publishing(plot_fingerprint):
+            function(*args, profiles=profiles, **kwargs)
+        return True
+
+    stale = fingerprints.stale(name, plot_fingerprint, profiles)
+    if not stale:
+        return False
+
+    with publishing(plot_fingerprint):
+        function(*args, profiles=stale, **kwargs)
+    fingerprints.record(name, plot_fingerprint, stale)
+    return True
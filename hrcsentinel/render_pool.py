@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+'''
+Render plots in parallel, each in its own worker process.
+
+make_ancillary_plots() draws the shield plot, the mission-wide dashboard, the
+motor dashboard and the thermal plots one after another, and each one spends
+most of its time in matplotlib (which holds the GIL, so threads don't help).
+A RenderPool keeps a few long-lived worker processes around instead, each
+with its own matplotlib (Agg, and our plot styles), and hands them render
+jobs. Fetch everything a job needs first, in this process, and pass it in:
+
+    >>> pool = RenderPool(max_workers=4)
+    >>> results = pool.run([RenderJob('motors', make_motor_plots, {'telem': portable(telem), ...}),
+    ...                     RenderJob('thermals', make_thermal_plots, {...}, timeout=300)])
+    >>> results['motors'].ok
+    True
+
+Every job gets its own timeout. A job that runs over, or that takes its
+worker down with it (a segfault in some C extension, say), fails on its own:
+its worker is killed and replaced, and every other job carries on.
+
+Workers are spawned rather than forked, since the monitors have plenty of
+threads (fetch engine, render thread...) running that a fork would copy in
+whatever state they happen to be in.
+'''
+
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from artifact_publisher import publishing
+from deadlines import effective_timeout
+from fetch_client import CachedMsid
+
+
+class RenderJob:
+    '''
+    One call to a plotting function. function has to be importable by name (i.e. defined at
+    module level), and its kwargs picklable, since both are sent to a worker process.
+    fingerprint is recorded with whatever it publishes (see artifact_publisher.py).
+    '''
+
+    def __init__(self, name, function, kwargs=None, timeout=None, fingerprint=None):
+        self.name = name
+        self.function = function
+        self.kwargs = kwargs if kwargs is not None else {}
+        self.timeout = timeout
+        self.fingerprint = fingerprint
+
+
+class RenderResult:
+
+    def __init__(self, name, ok, elapsed, error=None, traceback=None):
+        self.name = name
+        self.ok = ok
+        self.elapsed = elapsed
+        self.error = error
+        # The worker's traceback, if the job raised
+        self.traceback = traceback
+
+    def __repr__(self):
+        status = 'ok' if self.ok else f'failed: {self.error}'
+        return f'RenderResult({self.name}, {status}, {self.elapsed:.1f} s)'
+
+
+class RenderError(Exception):
+    '''
+    Raised (once every job has finished) for the jobs that failed
+    '''
+
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__('; '.join(f'{result.name} render failed: {result.error}' for result in failures))
+
+
+def portable(telem):
+    '''
+    A copy of a telemetry dict that's cheap to pickle: just the times, vals (and raw_vals, for
+    state MSIDs) of each MSID, as CachedMsids, rather than whole cheta MSID objects.
+    '''
+    if telem is None:
+        return None
+    return {msid: CachedMsid(msid, np.asarray(data.times), np.asarray(data.vals),
+                             raw_vals=getattr(data, 'raw_vals', None))
+            for msid, data in telem.items()}
+
+
+def _worker_main(conn):
+    # Ctrl-C is for the parent, which shuts us down itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+    import matplotlib.pyplot as plt
+    import plot_stylers
+    plot_stylers.styleplots()
+
+    while True:
+        try:
+            function, kwargs, fingerprint = conn.recv()
+        except EOFError:
+            # The pool's gone
+            return
+
+        started = time.monotonic()
+        try:
+            with publishing(fingerprint):
+                function(**kwargs)
+            conn.send((True, time.monotonic() - started, None, None))
+        except Exception as e:
+            conn.send((False, time.monotonic() - started, f'{type(e).__name__}: {e}', traceback.format_exc()))
+        finally:
+            # Nothing one job draws should leak into the next
+            plt.close('all')
+
+
+class _Worker:
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True,
+                                       name='hrcsentinel-render-worker')
+        self.process.start()
+        # Only the worker holds its end now, so we'll see EOF if it dies
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class RenderPool:
+    '''
+    A fixed number of render worker processes, started on first use and kept for the life of the pool.
+    '''
+
+    def __init__(self, max_workers=4, default_timeout=600):
+        '''
+        :param max_workers: How many jobs to render at once
+        :param default_timeout: Seconds a job may take, unless it sets its own timeout
+        '''
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = [None] * max_workers
+
+    def run(self, jobs, timeout=None):
+        '''
+        Render every job, up to max_workers at a time, and wait for them all.
+
+        :param timeout: An overall limit (seconds) on top of each job's own. The current deadline (see deadlines.py) applies too.
+        :return: A dict of RenderResults keyed by job name
+        '''
+        overall = effective_timeout(timeout)
+        expires = None if overall is None else time.monotonic() + overall
+
+        pending = queue.Queue()
+        for job in jobs:
+            pending.put(job)
+        results = {}
+
+        def dispatch(slot):
+            while True:
+                try:
+                    job = pending.get_nowait()
+                except queue.Empty:
+                    return
+                results[job.name] = self._run_one(slot, job, expires)
+
+        dispatchers = [threading.Thread(target=dispatch, args=(slot,), daemon=True,
+                                        name=f'hrcsentinel-render-dispatch-{slot}')
+                       for slot in range(min(self.max_workers, len(jobs)))]
+        for dispatcher in dispatchers:
+            dispatcher.start()
+        for dispatcher in dispatchers:
+            dispatcher.join()
+
+        return results
+
+    def _run_one(self, slot, job, expires):
+        timeout = job.timeout if job.timeout is not None else self.default_timeout
+        if expires is not None:
+            timeout = min(timeout, max(0.0, expires - time.monotonic()))
+
+        started = time.monotonic()
+        worker = self._workers[slot]
+        if worker is None or not worker.process.is_alive():
+            worker = self._workers[slot] = _Worker(self._context)
+
+        try:
+            worker.conn.send((job.function, job.kwargs, job.fingerprint))
+            if worker.conn.poll(timeout):
+                ok, elapsed, error, worker_traceback = worker.conn.recv()
+                return RenderResult(job.name, ok, elapsed, error, worker_traceback)
+            error = f'timed out after {timeout:.3g} s'
+        except (EOFError, OSError):
+            worker.process.join(1)
+            error = f'worker died (exit code {worker.process.exitcode})'
+        except Exception as e:
+            # e.g. the job's arguments couldn't be pickled. The worker's fine, but its pipe might not be.
+            error = f'{type(e).__name__}: {e}'
+
+        # Whatever state the worker's in now, start the next job on a fresh one
+        worker.kill()
+        self._workers[slot] = None
+        return RenderResult(job.name, False, time.monotonic() - started, error)
+
+    def close(self):
+        for slot, worker in enumerate(self._workers):
+            if worker is not None:
+                worker.kill()
+                self._workers[slot] = None
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+'''
+Named render profiles: which files each plot is saved as, at what dpi.
+
+Every plot used to be saved as both a PNG and a PDF at 300 dpi on every
+refresh (and the comm status stamp as a 300 dpi PNG, just to show a line of
+text). The PDF alone costs more than drawing the figure. Now each save
+names the profiles it wants:
+
+    live        a PNG at screen resolution, for the status page. Cheap.
+    archive     the PDF, plus a 300 dpi PNG, for the record
+    thumbnail   a small PNG, for an index page
+    stamp       the comm status stamp (a line of text doesn't need 300 dpi)
+
+and the monitors only write the live profile on the hot path, leaving the
+expensive ones for LOS (and startup):
+
+    >>> save_figure(fig, fig_save_directory, 'motors', profiles_for('motors', 'refresh'))
+    # writes motors.png (120 dpi)
+    >>> save_figure(fig, fig_save_directory, 'motors', profiles_for('motors', 'los'))
+    # writes motors.png, motors.pdf, motors_hires.png and motors_thumb.png
+'''
+
+from artifact_publisher import ArtifactPublisher
+
+
+class RenderProfile:
+    '''
+    A named set of outputs, each a (suffix, format, dpi). A plot named 'status' saved with
+    the output ('_thumb', 'png', 30) goes to status_thumb.png at 30 dpi.
+    '''
+
+    def __init__(self, name, outputs):
+        self.name = name
+        self.outputs = outputs
+
+    def files(self, name):
+        return [f'{name}{suffix}.{file_format}' for suffix, file_format, _ in self.outputs]
+
+
+PROFILES = {profile.name: profile for profile in (
+    RenderProfile('live', [('', 'png', 120)]),
+    RenderProfile('archive', [('', 'pdf', 300), ('_hires', 'png', 300)]),
+    RenderProfile('thumbnail', [('_thumb', 'png', 30)]),
+    RenderProfile('stamp', [('', 'png', 100)]),
+)}
+
+# Which profiles each kind of refresh writes. 'refresh' is the hot path (every new sample, in comm);
+# 'los' is once per pass (and at startup), when there's time for the expensive formats.
+TRIGGER_PROFILES = {'refresh': ('live',),
+                    'los': ('live', 'archive', 'thumbnail')}
+
+# Plots that don't follow TRIGGER_PROFILES
+ARTIFACT_PROFILES = {'comm_status': {'refresh': ('stamp',), 'los': ('stamp',)}}
+
+# What a plotting function writes if nobody tells it otherwise (e.g. when it's run by hand):
+# everything it used to, a PNG and a PDF
+DEFAULT_PROFILES = ('live', 'archive')
+
+
+def profiles_for(artifact, trigger='refresh'):
+    '''
+    The profiles to write for this artifact on this kind of refresh ('refresh' or 'los')
+    '''
+    return ARTIFACT_PROFILES.get(artifact, TRIGGER_PROFILES)[trigger]
+
+
+def artifact_files(name, profiles=DEFAULT_PROFILES):
+    '''
+    Every file saving name with these profiles writes (relative to the save directory)
+    '''
+    return [file_name for profile in profiles for file_name in PROFILES[profile].files(name)]
+
+
+def save_figure(fig, fig_save_directory, name, profiles=DEFAULT_PROFILES, bbox_inches=None):
+    '''
+    Save a figure once for every output of every profile. Each file is published atomically,
+    with its previous versions kept (see artifact_publisher.py).
+
+    :param fig: A matplotlib Figure
+    :param name: The file name, without an extension (e.g. 'status')
+    :param profiles: Names of profiles in PROFILES
+    :param bbox_inches: Passed straight on to savefig (e.g. 'tight')
+    '''
+    publisher = ArtifactPublisher(fig_save_directory)
+    for profile in profiles:
+        for suffix, file_format, dpi in PROFILES[profile].outputs:
+            publisher.publish_figure(fig, f'{name}{suffix}.{file_format}', dpi=dpi, file_format=file_format,
+                                     bbox_inches=bbox_inches)
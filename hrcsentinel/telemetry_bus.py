@@ -0,0 +1,349 @@
+#!/usr/bin/env conda run -n ska3 python
+
+'''
+A single producer process that owns all MAUDE access for HRCSentinel.
+
+monitor_telemetry.py, monitor_comms.py and monitor_anomaly.py used to each poll
+CVCDUCTR and re-fetch overlapping MSIDs on their own. Run this script once, start
+the monitors with --use_bus, and they'll ask the bus (over a local Unix socket)
+for telemetry instead. Every monitor then sees the same telemetry, and MAUDE
+only gets queried once.
+
+The bus also publishes its comm state to shared memory (see comm_state.py), and
+every are_we_in_comm() on the box reads it from there, --use_bus or not.
+'''
+
+import argparse
+import os
+import threading
+import time
+import traceback
+from multiprocessing.connection import Client, Listener
+
+import astropy.units as u
+from cxotime import CxoTime
+
+import fetch_metrics
+import msidlists
+from comm_scheduler import CommScheduler
+from comm_state import CommStateWriter
+from fetch_client import FetchClient, start_secs
+from fetch_planner import plan_refresh
+from global_configuration import comm_state_path, telemetry_bus_address, telemetry_bus_authkey
+from heartbeat import timestamp_string, TimeoutException
+from deadlines import Deadline
+from telemetry_cache import TelemetryCache
+from vcdu_tracker import VcduTracker
+
+
+class TelemetryBusError(Exception):
+    pass
+
+
+class TelemetryBus:
+    '''
+    Keep shared TelemetryCaches fresh and serve them to any number of local consumers.
+
+    There's one cache per (unit_system, state_codes) that's been asked for, since the
+    same MSID in engineering and science units (or with and without state codes) are
+    different telemetry. monitor_comms and monitor_anomaly work in science units, the
+    dashboards in engineering units, and the motor plots need state codes.
+    '''
+
+    def __init__(self, address=telemetry_bus_address, window_days=6, comm_state_path=comm_state_path):
+        self.address = address
+        self.window_days = window_days
+        # {(unit_system, state_codes): TelemetryCache}
+        self.caches = {}
+        # {(unit_system, state_codes): [MSIDs to keep fresh in that cache]}
+        self.watched = {}
+        self.comm_client = FetchClient('maude', allow_subset=True)
+        # Every frame the comm checks see goes through this, so consumers can ask about dropouts
+        self.vcdu = VcduTracker()
+
+        # Start out watching everything the three monitors are known to ask for, in the units they ask for it in.
+        # Anything else a consumer asks for is added on the fly.
+        for client, msids in plan_refresh().items():
+            self.watch(msids, unit_system=client.unit_system, state_codes=client.state_codes)
+        self.watch(msidlists.critical_comm_msids, unit_system='sci')
+        self.watch(msidlists.anomaly_msids, unit_system='sci')
+
+        self.comm_state = {'in_comm': False,
+                           'aos_time': None,
+                           'last_vcdu': None,
+                           'last_frame_time': None,
+                           'frame_rate': None,
+                           'updated': None}
+        # Every process on the box reads the comm state from here, without a round trip to us (or MAUDE)
+        self.shared_comm_state = CommStateWriter(comm_state_path)
+
+        # The cache isn't thread-safe, so only one consumer (or the refresh loop) may touch it at a time
+        self.lock = threading.Lock()
+
+    def cache(self, unit_system='eng', state_codes=False):
+        '''
+        The TelemetryCache for this unit system (and with or without state codes), made on first use
+        '''
+        key = (unit_system, state_codes)
+        if key not in self.caches:
+            self.caches[key] = TelemetryCache(
+                window_days=self.window_days,
+                client=FetchClient('maude', allow_subset=False, state_codes=state_codes, unit_system=unit_system))
+        return self.caches[key]
+
+    def watch(self, msids, unit_system='eng', state_codes=False):
+        key = (unit_system, state_codes)
+        self.cache(unit_system, state_codes)
+        self.watched[key] = list(dict.fromkeys(self.watched.get(key, []) + list(msids)))
+
+    @property
+    def watched_msids(self):
+        '''
+        Every MSID we keep fresh, in any unit system
+        '''
+        return list(dict.fromkeys(msid for msids in self.watched.values() for msid in msids))
+
+    def check_comm(self):
+        '''
+        The same check as heartbeat.are_we_in_comm(): are there any VCDU frames in the last 60 seconds?
+        '''
+        ref_vcdu = self.comm_client.get_telem(
+            'CVCDUCTR', start=CxoTime.now() - 60 * u.s)['CVCDUCTR']
+
+        in_comm = len(ref_vcdu) > 0
+        self.vcdu.update(ref_vcdu.times, ref_vcdu.vals)
+
+        if in_comm and not self.comm_state['in_comm']:
+            self.comm_state['aos_time'] = CxoTime.now().secs
+        if in_comm:
+            self.comm_state['last_vcdu'] = ref_vcdu.vals[-1]
+            self.comm_state['last_frame_time'] = ref_vcdu.times[-1]
+
+        self.comm_state['in_comm'] = in_comm
+        self.comm_state['frame_rate'] = self.vcdu.frame_rate
+        self.comm_state['updated'] = CxoTime.now().secs
+        self.shared_comm_state.publish(self.comm_state)
+
+        return in_comm
+
+    def refresh(self):
+        '''
+        Fetch anything new for every watched MSID in one batched request.
+        '''
+        window_start = CxoTime.now().secs - self.window_days * 86400
+        with self.lock:
+            for (unit_system, state_codes), msids in self.watched.items():
+                self.cache(unit_system, state_codes).update_many(msids, start=window_start)
+            eng_cache = self.cache('eng', False)
+            if 'CCSDSTMF' in eng_cache:
+                formats = eng_cache.window('CCSDSTMF', window_start)
+                self.vcdu.update_format(formats.times, formats.vals)
+
+    def handle(self, request):
+        '''
+        Answer one request from a TelemetryBusClient.
+        '''
+
+        if request['request'] == 'comm_state':
+            return dict(self.comm_state)
+
+        if request['request'] == 'vcdu_timeline':
+            return self.vcdu.timeline(start=request.get('start'), stop=request.get('stop'), kinds=request.get('kinds'))
+
+        if request['request'] == 'vcdu_summary':
+            return self.vcdu.summary(start=request.get('start'), stop=request.get('stop'))
+
+        if request['request'] == 'telem':
+            msids = request['msids']
+            start = request['start']
+            # (Consumers from before there was a cache per unit system only ever asked for engineering units)
+            unit_system = request.get('unit_system', 'eng')
+            state_codes = request.get('state_codes', False)
+            if unit_system not in ('eng', 'sci', 'cxc'):
+                raise TelemetryBusError(f"Unknown unit system '{unit_system}'")
+            with self.lock:
+                cache = self.cache(unit_system, state_codes)
+                new_msids = [msid for msid in msids if msid not in cache]
+
+            if len(new_msids) > 0:
+                # Fetch anything we've never been asked for before, and keep it fresh from now on. The cache only
+                # ever grows at its tail, so seed it with the whole window (like refresh() does), not just what this
+                # consumer asked for, or every later consumer would get the same truncated window. It's fetched
+                # without holding the lock, so nobody else waits on it.
+                window_start = CxoTime.now().secs - self.window_days * 86400
+                seed = cache.client.get_telem(new_msids, start=window_start)
+                with self.lock:
+                    # Another consumer may have seeded some of these in the meantime
+                    cache.ingest({msid: data for msid, data in seed.items() if msid not in cache})
+                    self.watch(new_msids, unit_system=unit_system, state_codes=state_codes)
+
+            with self.lock:
+                return {msid: cache.window(msid, start) for msid in msids}
+
+        raise TelemetryBusError(f"Unknown request {request['request']}")
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    # The consumer hung up
+                    return
+                try:
+                    reply = {'ok': True, 'result': self.handle(request)}
+                except Exception as e:
+                    reply = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+                conn.send(reply)
+
+    def serve_forever(self):
+        '''
+        Accept consumers on the Unix socket, each in its own thread.
+        '''
+        # Clear out a stale socket from a previous run
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+        with Listener(self.address, family='AF_UNIX', authkey=telemetry_bus_authkey) as listener:
+            while True:
+                conn = listener.accept()
+                threading.Thread(target=self._serve_connection,
+                                 args=(conn,), daemon=True).start()
+
+
+class TelemetryBusClient:
+    '''
+    What the monitors use to talk to a running telemetry_bus.py. The results of
+    get_telem() behave like the output of fetch.MSIDset() (i.e. telem[msid].times and .vals).
+    '''
+
+    def __init__(self, address=telemetry_bus_address):
+        self.address = address
+        self._conn = None
+
+    def _request(self, **request):
+        if self._conn is None:
+            self._conn = Client(self.address, family='AF_UNIX',
+                                authkey=telemetry_bus_authkey)
+        try:
+            self._conn.send(request)
+            reply = self._conn.recv()
+        except (EOFError, OSError):
+            # The bus probably restarted. Reconnect on the next request.
+            self._conn = None
+            raise
+
+        if not reply['ok']:
+            raise TelemetryBusError(reply['error'])
+
+        return reply['result']
+
+    def comm_state(self):
+        return self._request(request='comm_state')
+
+    def in_comm(self):
+        return self.comm_state()['in_comm']
+
+    def vcdu_timeline(self, start=None, stop=None, kinds=None):
+        '''
+        The bus's VcduTracker timeline (dropouts, counter resets, format changes), see vcdu_tracker.py
+        '''
+        return self._request(request='vcdu_timeline', start=start, stop=stop, kinds=kinds)
+
+    def vcdu_summary(self, start=None, stop=None):
+        return self._request(request='vcdu_summary', start=start, stop=stop)
+
+    def get_telem(self, msids, start, unit_system='eng', state_codes=False):
+        '''
+        :param msids: A list of MSIDs
+        :param start: The beginning of the window, as a datetime/date, CxoTime, or CXC seconds
+        :param unit_system: 'eng' (what MAUDE serves), 'sci' or 'cxc', exactly as for a FetchClient
+        :param state_codes: Whether state MSIDs should come with raw_vals, exactly as for a FetchClient
+        '''
+        with fetch_metrics.recorder.measure('bus', msids, start_secs(start)) as measurement:
+            telem = self._request(
+                request='telem', msids=list(msids), start=start_secs(start),
+                unit_system=unit_system, state_codes=state_codes)
+            measurement.result(telem)
+        return telem
+
+
+def get_args():
+    '''Fetch command line args, if given'''
+
+    argparser = argparse.ArgumentParser(
+        description='Own all MAUDE access for HRCSentinel and share the telemetry with every monitor.')
+
+    argparser.add_argument("--cadence", help="Seconds between comm checks", type=float, default=2)
+
+    argparser.add_argument("--out_of_comm_refresh", help="Out of comm, refresh the watched MSIDs every Nth iteration (to catch backorbit dumps)",
+                           type=int, default=30)
+
+    argparser.add_argument("--report_errors", help="Print MAUDE exceptions (which are common) to the command line",
+                           action="store_true")
+
+    argparser.add_argument("--fixed_cadence", help="Always wait --cadence seconds between comm checks, rather than adapting to the DSN schedule",
+                           action="store_true")
+
+    argparser.add_argument("--no_metrics", help="Don't write fetch metrics (see fetch_metrics.py) to the metrics directory",
+                           action="store_true")
+
+    args = argparser.parse_args()
+    return args
+
+
+def main():
+    '''
+    Serve consumers in a background thread, and keep the comm state and cache fresh in this one.
+    '''
+
+    print('\033[1mHRCSentinel\033[0m | Telemetry Bus')
+
+    args = get_args()
+
+    if not args.no_metrics:
+        fetch_metrics.configure('telemetry_bus')
+
+    bus = TelemetryBus()
+    scheduler = None if args.fixed_cadence else CommScheduler(
+        in_comm_cadence=args.cadence)
+    threading.Thread(target=bus.serve_forever, daemon=True).start()
+    print(f'({timestamp_string()}) Serving telemetry on {bus.address}')
+
+    iteration_counter = 0
+
+    while True:
+        try:
+            with Deadline(120, name='telemetry_bus iteration'):
+                in_comm = bus.check_comm()
+
+                if in_comm or iteration_counter % args.out_of_comm_refresh == 0:
+                    bus.refresh()
+
+                status = 'In Comm!' if in_comm else 'Not in Comm.'
+                print(
+                    f'({timestamp_string()}) {status} Watching {len(bus.watched_msids)} MSIDs (Iteration {iteration_counter})        ', end='\r', flush=True)
+
+        except TimeoutException as e:
+            print(
+                f"({timestamp_string()}) Timed out: {e}. Pressing on...                             ", end="\r", flush=True)
+
+        except Exception as e:
+            if args.report_errors:
+                print(f'({timestamp_string()}) ERROR: {e}')
+                print(traceback.format_exc())
+            else:
+                print(
+                    f'({timestamp_string()}) ERROR encountered! Use --report_errors to display them.                                   ', end='\r', flush=True)
+
+        fetch_metrics.end_iteration()
+        iteration_counter += 1
+        if scheduler is not None:
+            scheduler.observe(bus.comm_state['in_comm'])
+            time.sleep(scheduler.next_cadence())
+        else:
+            time.sleep(args.cadence)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+import os
+
+import numpy as np
+from cxotime import CxoTime
+
+from fetch_client import CachedMsid, FetchClient, start_secs
+
+
+class TelemetryCache:
+    '''
+    Keep the last few days of full-resolution telemetry for each MSID in memory
+    (and optionally on disk), so that every dashboard refresh only asks MAUDE
+    for samples newer than the last one we already have.
+
+    Without this, every in-comm iteration of monitor_telemetry re-downloaded
+    five full days of full-resolution data for ~40 MSIDs.
+    '''
+
+    def __init__(self, window_days=6, cache_directory=None, client=None):
+        '''
+        :param window_days: How many days of telemetry to keep. Older samples are trimmed from the head of the window.
+        :param cache_directory: If given, the cache is loaded from (and saved to) .npz files in this directory.
+        :param client: The FetchClient used for tail fetches. Defaults to full-resolution MAUDE.
+        '''
+        self.window_days = window_days
+        self.cache_directory = cache_directory
+        self.client = client if client is not None else FetchClient(
+            'maude', allow_subset=False)
+        self._cache = {}
+
+        if cache_directory is not None:
+            os.makedirs(cache_directory, exist_ok=True)
+            self.load()
+
+    def __contains__(self, msid):
+        return msid in self._cache
+
+    def __getitem__(self, msid):
+        return self._cache[msid]
+
+    def last_time(self, msid):
+        '''
+        Return the CXC time (seconds) of the last cached sample for this MSID, or None.
+        '''
+        if msid not in self._cache or len(self._cache[msid]) == 0:
+            return None
+        return self._cache[msid].times[-1]
+
+    def update(self, msid, start):
+        '''
+        Fetch only the samples newer than the last cached timestamp for this MSID,
+        append them to the cache, trim the head of the window, and return a
+        CachedMsid covering everything from start onward.
+
+        :param msid: The MSID to refresh
+        :param start: The beginning of the plot window, as a datetime/date, CxoTime, or CXC seconds. Only used for the very first fetch of an MSID.
+        '''
+        return self.update_many([msid], start)[msid]
+
+    def update_many(self, msids, start, client=None, engine=None):
+        '''
+        Like update(), but for a list of MSIDs. MSIDs we already have are
+        refreshed with a single batched fetch starting at the oldest of their
+        last cached timestamps, and MSIDs we've never seen are fetched together
+        from the start of the window. Returns a dict of CachedMsids keyed by MSID.
+
+        :param client: A FetchClient to use for this update instead of the cache's own
+        :param engine: A FetchEngine. If given, the batches are fetched in parallel on its thread pool.
+        '''
+
+        if client is None:
+            client = self.client
+
+        new_msids = [msid for msid in msids if self.last_time(msid) is None]
+        known_msids = [msid for msid in msids if msid not in new_msids]
+
+        batches = []
+        if len(new_msids) > 0:
+            batches.append((new_msids, start_secs(start)))
+        if len(known_msids) > 0:
+            oldest_last_time = min(self.last_time(msid) for msid in known_msids)
+            batches.append((known_msids, oldest_last_time))
+
+        if engine is not None:
+            futures = [future for batch_msids, fetch_start in batches
+                       for future in engine.submit_batches(client, batch_msids, fetch_start)]
+            data = engine.gather(futures, stage='telemetry cache update')
+        else:
+            data = {}
+            for batch_msids, fetch_start in batches:
+                data.update(client.get_telem(batch_msids, start=fetch_start))
+
+        # Only ever touch the cache itself from this thread
+        self.ingest({msid: data[msid] for msid in msids if msid in data})
+
+        return {msid: self.window(msid, start) for msid in msids}
+
+    def ingest(self, telem):
+        '''
+        Add telemetry that was fetched elsewhere (a dict keyed by MSID, e.g. from FetchClient.get_telem())
+        to the cache, exactly as if update_many() had fetched it.
+        '''
+        for msid, data in telem.items():
+            self._append(msid, data)
+            self._trim(msid)
+
+    def _append(self, msid, data):
+
+        times = np.asarray(data.times)
+        vals = np.asarray(data.vals)
+        raw_vals = getattr(data, 'raw_vals', None)
+        if raw_vals is not None:
+            raw_vals = np.asarray(raw_vals)
+
+        if msid not in self._cache:
+            self._cache[msid] = CachedMsid(msid, times, vals, raw_vals)
+            return
+
+        cached = self._cache[msid]
+        # MAUDE hands back the sample AT the start time too, so only keep what's genuinely new
+        new = times > cached.times[-1] if len(cached) > 0 else np.ones(len(times), dtype=bool)
+
+        if np.any(new):
+            cached.times = np.concatenate([cached.times, times[new]])
+            cached.vals = np.concatenate([cached.vals, vals[new]])
+            if cached.raw_vals is not None:
+                if raw_vals is None and vals.dtype.kind in 'iuf':
+                    # A numeric MSID's raw values are just its values (see FetchClient._get_maude())
+                    raw_vals = vals
+                if raw_vals is not None:
+                    cached.raw_vals = np.concatenate([cached.raw_vals, raw_vals[new]])
+                else:
+                    # Better no raw_vals at all than raw_vals that don't line up with times
+                    cached.raw_vals = None
+
+    def _trim(self, msid):
+        oldest_allowed = CxoTime.now().secs - self.window_days * 86400
+        cached = self._cache[msid]
+        keep = cached.times >= oldest_allowed
+        if not np.all(keep):
+            cached.times = cached.times[keep]
+            cached.vals = cached.vals[keep]
+            if cached.raw_vals is not None:
+                cached.raw_vals = cached.raw_vals[keep]
+
+    def window(self, msid, start):
+        '''
+        Return a CachedMsid with everything we have for this MSID from start onward, without fetching anything.
+        '''
+        cached = self._cache[msid]
+        first = np.searchsorted(cached.times, start_secs(start))
+        raw_vals = cached.raw_vals[first:] if cached.raw_vals is not None else None
+        return CachedMsid(msid, cached.times[first:], cached.vals[first:], raw_vals)
+
+    def save(self):
+        '''
+        Write every cached MSID to its own .npz file in the cache directory.
+        '''
+        if self.cache_directory is None:
+            return
+
+        for msid, cached in self._cache.items():
+            final_path = os.path.join(self.cache_directory, f'{msid}.npz')
+            # Write to a temporary file first so we never leave a half-written cache behind
+            temp_path = final_path + '.tmp.npz'
+            if cached.raw_vals is not None:
+                np.savez(temp_path, times=cached.times, vals=cached.vals, raw_vals=cached.raw_vals)
+            else:
+                np.savez(temp_path, times=cached.times, vals=cached.vals)
+            os.replace(temp_path, final_path)
+
+    def load(self):
+        '''
+        Load any previously saved MSIDs from the cache directory.
+        '''
+        for filename in os.listdir(self.cache_directory):
+            if not filename.endswith('.npz') or filename.endswith('.tmp.npz'):
+                continue
+            msid = filename[:-len('.npz')]
+            with np.load(os.path.join(self.cache_directory, filename)) as saved:
+                raw_vals = saved['raw_vals'] if 'raw_vals' in saved else None
+                self._cache[msid] = CachedMsid(
+                    msid, saved['times'], saved['vals'], raw_vals)
+            self._trim(msid)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+'''
+Streaming VCDU frame-gap and dropout detection.
+
+heartbeat.are_we_in_comm() boils CVCDUCTR down to "are there any frames in
+the last minute?". A VcduTracker instead watches every frame counter sample
+as it comes in (the comm checks already fetch them every couple of seconds),
+doing a constant amount of work per frame, and keeps:
+
+    - the frame rate (frames per second, smoothed),
+    - dropouts: gaps in the stream during a pass, and how many frames went missing,
+    - no-signal intervals: gaps long enough to be the time between passes,
+    - counter resets: jumps the counter can't have made in the time that passed (e.g. after a CTU reset),
+    - format changes, from CCSDSTMF.
+
+as a timeline that the dashboards, the telemetry bus and the Slack bot can query:
+
+    >>> tracker = VcduTracker()
+    >>> tracker.update(telem['CVCDUCTR'].times, telem['CVCDUCTR'].vals)
+    >>> tracker.timeline(start=CxoTime.now().secs - 3600, kinds=('dropout',))
+    [{'kind': 'dropout', 'start': ..., 'stop': ..., 'missing_frames': 153}]
+
+Timeline events are plain dicts (with times in CXC seconds), so they pickle
+over the telemetry bus and dump straight to JSON.
+'''
+
+import threading
+from collections import deque
+
+import numpy as np
+
+# A VCDU (minor frame) goes down every 0.25625 seconds
+VCDU_PERIOD = 0.25625
+# CVCDUCTR is a 24-bit counter, so it wraps around every ~50 days
+COUNTER_MODULUS = 2 ** 24
+
+
+class VcduTracker:
+    '''
+    Incrementally tracks the VCDU frame counter (and telemetry format) stream.
+    Feed it overlapping windows as often as you like; samples it has already
+    seen are skipped. Thread-safe.
+    '''
+
+    def __init__(self, gap_threshold=10.0, no_signal_threshold=600.0, rate_smoothing=0.05,
+                 max_events=10000, frame_period=VCDU_PERIOD):
+        '''
+        :param gap_threshold: A gap in the stream longer than this (seconds) counts as a dropout
+        :param no_signal_threshold: A gap longer than this (seconds) is the time between passes, not a dropout
+        :param rate_smoothing: Weight given to each new frame in the smoothed frame rate
+        :param max_events: How many timeline events to keep (the oldest are dropped first)
+        :param frame_period: The nominal time between frames (seconds)
+        '''
+        self.gap_threshold = gap_threshold
+        self.no_signal_threshold = no_signal_threshold
+        self.rate_smoothing = rate_smoothing
+        self.frame_period = frame_period
+
+        self.last_time = None
+        self.last_counter = None
+        self.frame_rate = None
+        self.frames_seen = 0
+        self.missing_frames = 0
+
+        self.last_format_time = None
+        self.last_format = None
+
+        self.events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+
+    def update(self, times, counters):
+        '''
+        Consume CVCDUCTR samples (times in CXC seconds). Returns how many were new.
+        '''
+        times = np.asarray(times, dtype=float)
+        counters = np.asarray(counters)
+
+        with self._lock:
+            # The comm checks fetch overlapping windows, so skip straight past what we've seen
+            first_new = 0 if self.last_time is None else np.searchsorted(
+                times, self.last_time, side='right')
+
+            for t, counter in zip(times[first_new:], counters[first_new:]):
+                counter = int(counter)
+                if self.last_time is not None:
+                    self._step(float(t), counter)
+                self.last_time = float(t)
+                self.last_counter = counter
+                self.frames_seen += 1
+
+        return len(times) - first_new
+
+    def _step(self, t, counter):
+        elapsed = t - self.last_time
+        advance = (counter - self.last_counter) % COUNTER_MODULUS
+        expected = elapsed / self.frame_period
+
+        # The counter should have moved on by one per frame period (give or take timestamp jitter).
+        # If it didn't, it was reset (or jumped), and nothing else about this step means anything.
+        if abs(advance - expected) > max(2.0, 0.01 * expected):
+            self.events.append({'kind': 'counter_reset', 'start': self.last_time, 'stop': t,
+                                'from': self.last_counter, 'to': counter})
+            return
+
+        if elapsed > self.gap_threshold:
+            missing_frames = max(0, advance - 1)
+            if elapsed >= self.no_signal_threshold:
+                self.events.append({'kind': 'no_signal', 'start': self.last_time, 'stop': t,
+                                    'missing_frames': missing_frames})
+            else:
+                self.missing_frames += missing_frames
+                self.events.append({'kind': 'dropout', 'start': self.last_time, 'stop': t,
+                                    'missing_frames': missing_frames})
+            return
+
+        rate = advance / elapsed if elapsed > 0 else 0.0
+        if self.frame_rate is None:
+            self.frame_rate = rate
+        else:
+            self.frame_rate += self.rate_smoothing * (rate - self.frame_rate)
+
+    def update_format(self, times, formats):
+        '''
+        Consume CCSDSTMF samples (e.g. 'FMT1', 'FMT2'). Returns how many were new.
+        '''
+        times = np.asarray(times, dtype=float)
+        formats = np.asarray(formats)
+
+        with self._lock:
+            first_new = 0 if self.last_format_time is None else np.searchsorted(
+                times, self.last_format_time, side='right')
+
+            for t, telemetry_format in zip(times[first_new:], formats[first_new:]):
+                telemetry_format = str(telemetry_format).strip()
+                if self.last_format is not None and telemetry_format != self.last_format:
+                    self.events.append({'kind': 'format_change', 'start': float(t), 'stop': float(t),
+                                        'from': self.last_format, 'to': telemetry_format})
+                self.last_format = telemetry_format
+                self.last_format_time = float(t)
+
+        return len(times) - first_new
+
+    def timeline(self, start=None, stop=None, kinds=None):
+        '''
+        Every event that overlaps [start, stop] (CXC seconds, either can be None), oldest first.
+
+        :param kinds: Only these kinds of event, e.g. ('dropout', 'counter_reset')
+        '''
+        with self._lock:
+            events = list(self.events)
+
+        return [dict(event) for event in events
+                if (start is None or event['stop'] >= start)
+                and (stop is None or event['start'] <= stop)
+                and (kinds is None or event['kind'] in kinds)]
+
+    def summary(self, start=None, stop=None):
+        '''
+        A digest of [start, stop] for the Slack bot and the telemetry bus
+        '''
+        events = self.timeline(start=start, stop=stop)
+        dropouts = [event for event in events if event['kind'] == 'dropout']
+
+        return {'last_time': self.last_time,
+                'last_counter': self.last_counter,
+                'format': self.last_format,
+                'frame_rate': self.frame_rate,
+                'dropouts': len(dropouts),
+                'dropout_seconds': sum(event['stop'] - event['start'] for event in dropouts),
+                'missing_frames': sum(event['missing_frames'] for event in dropouts),
+                'counter_resets': [event for event in events if event['kind'] == 'counter_reset'],
+                'format_changes': [event for event in events if event['kind'] == 'format_change']}
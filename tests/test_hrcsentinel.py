@@ -1,5 +1,45 @@
+import asyncio
+import contextlib
+import datetime as dt
+import functools
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+import requests
+
 from hrcsentinel import monitor_telemetry
+from hrcsentinel import telemetry_cache
+from hrcsentinel import local_archive
+from hrcsentinel import delta_poller
+from hrcsentinel import decimation
+from hrcsentinel import comm_scheduler
+from hrcsentinel import deadlines
+from hrcsentinel import plot_events
+from hrcsentinel import vcdu_tracker
+from hrcsentinel import comm_state
+from hrcsentinel import render_fingerprint
+from hrcsentinel import render_profiles
+from hrcsentinel import artifact_publisher
+from hrcsentinel import chandratime
+from hrcsentinel import data_publisher
+from hrcsentinel import telemetry_bus
+from hrcsentinel import fetch_client
+from hrcsentinel import heartbeat
+from hrcsentinel import render_pool
+from hrcsentinel import dashboard_renderer
+from hrcsentinel import fetch_metrics
+from hrcsentinel import fetch_engine
+from hrcsentinel import async_monitor
+from hrcsentinel import maude_standin
+
 
 class TestMakeShieldPlot(unittest.TestCase):
     def test_make_shield_plot(self):
@@ -9,5 +49,940 @@ class TestMakeShieldPlot(unittest.TestCase):
         result = monitor_telemetry.make_shield_plot(fig_save_directory, plot_start, plot_stop)
         self.assertEqual(result, True)
 
+
+class TestTelemetryCache(unittest.TestCase):
+    def test_only_new_samples_are_appended(self):
+        cache = telemetry_cache.TelemetryCache(window_days=6)
+        cache._append('2SHEV1RT', telemetry_cache.CachedMsid(
+            '2SHEV1RT', np.array([1.0, 2.0, 3.0]), np.array([10, 20, 30])))
+        # MAUDE returns the sample at the start time again, which must not be duplicated
+        cache._append('2SHEV1RT', telemetry_cache.CachedMsid(
+            '2SHEV1RT', np.array([3.0, 4.0]), np.array([30, 40])))
+        np.testing.assert_array_equal(cache['2SHEV1RT'].times, [1.0, 2.0, 3.0, 4.0])
+        np.testing.assert_array_equal(cache['2SHEV1RT'].vals, [10, 20, 30, 40])
+
+    def test_raw_vals_stay_in_step_with_times(self):
+        cache = telemetry_cache.TelemetryCache(window_days=6)
+        cache._append('2PRBSCR', telemetry_cache.CachedMsid(
+            '2PRBSCR', np.array([1.0, 2.0]), np.array([1.5, 1.6]), np.array([1.5, 1.6])))
+        # e.g. a fetch from a source that doesn't hand back raw_vals for numeric MSIDs
+        cache._append('2PRBSCR', telemetry_cache.CachedMsid(
+            '2PRBSCR', np.array([3.0]), np.array([1.7])))
+        np.testing.assert_array_equal(cache['2PRBSCR'].raw_vals, [1.5, 1.6, 1.7])
+
+        # A state MSID whose new samples come without raw values loses them altogether
+        cache._append('CCSDSTMF', telemetry_cache.CachedMsid(
+            'CCSDSTMF', np.array([1.0]), np.array(['FMT1']), np.array([1])))
+        cache._append('CCSDSTMF', telemetry_cache.CachedMsid(
+            'CCSDSTMF', np.array([2.0]), np.array(['FMT2'])))
+        self.assertIsNone(cache['CCSDSTMF'].raw_vals)
+        self.assertEqual(len(cache.window('CCSDSTMF', 0.0)), 2)
+
+    def test_head_of_window_is_trimmed(self):
+        cache = telemetry_cache.TelemetryCache(window_days=1)
+        now = 800000000.0
+        cache._append('2SHEV1RT', telemetry_cache.CachedMsid(
+            '2SHEV1RT', np.array([now - 2 * 86400, now - 3600, now]), np.array([1, 2, 3])))
+        with mock.patch.object(telemetry_cache.CxoTime, 'now', return_value=mock.Mock(secs=now)):
+            cache._trim('2SHEV1RT')
+        np.testing.assert_array_equal(cache['2SHEV1RT'].vals, [2, 3])
+
+
+class TestLocalArchive(unittest.TestCase):
+    def test_only_new_days_are_appended(self):
+        with tempfile.TemporaryDirectory() as archive_directory:
+            archive = local_archive.LocalArchive(archive_directory=archive_directory)
+            days = mock.Mock(times=np.array([1.0, 2.0]), means=np.array([10.0, 20.0]),
+                             mins=np.zeros(2), maxes=np.zeros(2), stds=np.zeros(2))
+            archive._append('2CEAHVPT', days)
+            # The CXC archive hands back the last archived day again
+            days = mock.Mock(times=np.array([2.0, 3.0]), means=np.array([20.0, 30.0]),
+                             mins=np.zeros(2), maxes=np.zeros(2), stds=np.zeros(2))
+            archive._append('2CEAHVPT', days)
+            archived = archive.read('2CEAHVPT', start=2.0)
+            np.testing.assert_array_equal(archived.times, [2.0, 3.0])
+            np.testing.assert_array_equal(archived.means, [20.0, 30.0])
+
+    def test_a_failed_append_leaves_the_published_columns_alone(self):
+        with tempfile.TemporaryDirectory() as archive_directory:
+            archive = local_archive.LocalArchive(archive_directory=archive_directory)
+            days = mock.Mock(times=np.array([1.0, 2.0]), means=np.array([10.0, 20.0]),
+                             mins=np.zeros(2), maxes=np.zeros(2), stds=np.zeros(2))
+            archive._append('2CEAHVPT', days)
+            published = archive.read('2CEAHVPT')
+
+            # Die after the new times are written, but before the rest of the columns
+            days = mock.Mock(times=np.array([3.0]), means=np.array([30.0]), mins=np.zeros(1), maxes=np.zeros(1), stds=None)
+            with self.assertRaises(Exception):
+                archive._append('2CEAHVPT', days)
+            archived = archive.read('2CEAHVPT')
+            for column in local_archive.COLUMNS:
+                self.assertEqual(len(getattr(archived, column)), 2)
+            # Whoever was reading the old version still can
+            np.testing.assert_array_equal(published.means, [10.0, 20.0])
+            # and the half-written version is gone
+            self.assertEqual(len([entry for entry in os.listdir(archive.directory)
+                                  if os.path.isdir(os.path.join(archive.directory, entry))]), 1)
+
+
+class TestFetchEngine(unittest.TestCase):
+    def setUp(self):
+        self.engine = fetch_engine.FetchEngine(max_workers=4, batch_size=2)
+        self.addCleanup(self.engine.shutdown)
+
+    def test_batches_are_fetched_at_once_and_merged(self):
+        client = mock.Mock()
+        client.get_telem.side_effect = lambda msids, start, stop=None, sampling='full': {
+            msid: (start, threading.current_thread().name) for msid in msids}
+        telem = self.engine.fetch(client, ['A', 'B', 'C', 'D', 'E'], start=1.0)
+        self.assertEqual(sorted(telem), ['A', 'B', 'C', 'D', 'E'])
+        self.assertEqual(client.get_telem.call_count, 3)
+        self.assertTrue(all(thread.startswith('hrcsentinel-fetch') for _, thread in telem.values()))
+
+    def test_a_slow_batch_is_reported_as_a_named_timeout(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        futures = [self.engine.submit_call(release.wait, 10)]
+        with self.assertRaises(fetch_engine.DeadlineExceeded) as raised:
+            self.engine.gather(futures, timeout=0.1, stage='latest thermal fetch')
+        self.assertIn('latest thermal fetch', str(raised.exception))
+
+    def test_abandoned_calls_still_count_against_max_workers(self):
+        engine = fetch_engine.FetchEngine(max_workers=2, timeout=0.5)
+        self.addCleanup(engine.shutdown)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        call_with_timeout = module_of(fetch_engine.DeadlineExceeded).call_with_timeout
+
+        # These give up after 0.1 s, which frees their workers, but the requests themselves are still hanging
+        hung = [engine.submit_call(call_with_timeout, release.wait, 10, timeout=0.1, stage='hung fetch') for _ in range(2)]
+        for future in hung:
+            with self.assertRaises(fetch_engine.DeadlineExceeded):
+                future.result(timeout=5)
+
+        # So there's no room for another one...
+        with self.assertRaises(fetch_engine.DeadlineExceeded) as raised:
+            engine.submit_call(lambda: 'done').result(timeout=5)
+        self.assertIn('free slot', str(raised.exception))
+
+        # ...until they return
+        release.set()
+        self.assertEqual(engine.submit_call(lambda: 'done').result(timeout=5), 'done')
+
+
+class TestFetchMetrics(unittest.TestCase):
+    def test_each_iteration_is_logged_and_the_totals_carry_on(self):
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = fetch_metrics.FetchMetrics()
+            recorder.configure('test_monitor', directory=directory)
+
+            with recorder.measure('maude allow_subset=False', ['2PRBSCR', '2TLEV1RT'], 800000000.0) as measurement:
+                measurement.result({'2PRBSCR': fetch_client.CachedMsid('2PRBSCR', np.zeros(3), np.zeros(3)),
+                                    '2TLEV1RT': fetch_client.CachedMsid('2TLEV1RT', np.zeros(1), np.zeros(1))})
+            with self.assertRaises(ValueError):
+                # A failed fetch is still counted, and the exception still raised
+                with recorder.measure('cxc', ['2CEAHVPT'], 800000000.0):
+                    raise ValueError('MAUDE said no')
+
+            summary = recorder.end_iteration()
+            self.assertEqual(summary['sources']['maude allow_subset=False']['rows'], 4)
+            self.assertEqual(summary['sources']['cxc']['failures'], 1)
+            self.assertEqual(summary['errors'][0]['error'], 'ValueError: MAUDE said no')
+            # The next iteration starts from zero
+            self.assertEqual(recorder.end_iteration()['sources'], {})
+
+            with open(os.path.join(directory, 'test_monitor.jsonl')) as log_file:
+                self.assertEqual(len(log_file.readlines()), 2)
+            with open(os.path.join(directory, 'test_monitor.prom')) as prom_file:
+                self.assertIn('test_monitor', prom_file.read())
+
+
+class TestDeltaPoller(unittest.TestCase):
+    def test_only_samples_past_the_cursor_are_returned(self):
+        client = mock.Mock()
+        poller = delta_poller.DeltaPoller(['2PRBSCR'], client=client)
+
+        client.get_telem.return_value = {'2PRBSCR': mock.Mock(
+            times=np.array([10.0, 11.0, 12.0]), vals=np.array([0.1, 0.2, 0.3]))}
+        new = poller.poll(start=10.0)
+        np.testing.assert_array_equal(new['2PRBSCR'].vals, [0.1, 0.2, 0.3])
+
+        # The next poll starts at the cursor, and the sample AT the cursor isn't handed back again
+        client.get_telem.return_value = {'2PRBSCR': mock.Mock(
+            times=np.array([12.0, 13.0]), vals=np.array([0.3, 0.4]))}
+        new = poller.poll(start=10.0)
+        self.assertEqual(client.get_telem.call_args[1]['start'], 12.0)
+        np.testing.assert_array_equal(new['2PRBSCR'].vals, [0.4])
+        np.testing.assert_array_equal(poller.window()['2PRBSCR'].vals, [0.4])
+
+
+class TestDecimation(unittest.TestCase):
+    def test_spikes_survive_decimation(self):
+        times = np.arange(100000.0)
+        vals = np.ones(100000)
+        vals[54321] = 65535  # a single-sample shield rate spike
+        decimated_times, decimated_vals = decimation.minmax_decimate(times, vals, n_bins=500)
+        self.assertLessEqual(len(decimated_times), 1000)
+        self.assertIn(54321.0, decimated_times)
+        self.assertEqual(decimated_vals.max(), 65535)
+        self.assertTrue(np.all(np.diff(decimated_times) > 0))
+
+
+class TestCommScheduler(unittest.TestCase):
+    def test_cadence_ramps_up_towards_a_scheduled_pass(self):
+        scheduler = comm_scheduler.CommScheduler(min_cadence=0.5, max_cadence=60, in_comm_cadence=2)
+        scheduler.set_schedule([{'tstart': 10000.0, 'tstop': 13600.0}])
+
+        self.assertEqual(scheduler.next_cadence(now=0.0), 60)  # hours away
+        self.assertEqual(scheduler.next_cadence(now=9400.0), 60)  # ten minutes away
+        self.assertEqual(scheduler.next_cadence(now=9900.0), 10)  # 100 seconds away
+        self.assertEqual(scheduler.next_cadence(now=9999.0), 0.5)  # right at AOS
+        self.assertEqual(scheduler.next_cadence(now=11000.0), 2)  # mid-pass
+
+    def test_unknown_schedule_falls_back_to_the_old_cadence(self):
+        scheduler = comm_scheduler.CommScheduler(in_comm_cadence=2)
+        scheduler.set_schedule([])
+        self.assertEqual(scheduler.next_cadence(now=0.0), 2)
+
+    def test_a_slow_schedule_refresh_doesnt_hold_up_the_cadence(self):
+        scheduler = comm_scheduler.CommScheduler(in_comm_cadence=2, refresh_interval=3600)
+        refreshing = threading.Event()
+        finish = threading.Event()
+
+        def slow_refresh(now=None):
+            # e.g. grab_orbit_metadata() waiting on web-Kadi
+            refreshing.set()
+            finish.wait(10)
+            scheduler.set_schedule([{'tstart': 10000.0, 'tstop': 13600.0}])
+
+        with mock.patch.object(scheduler, 'refresh_schedule', side_effect=slow_refresh):
+            started = time.monotonic()
+            self.assertEqual(scheduler.next_cadence(now=0.0), 2)
+            self.assertTrue(refreshing.wait(5))
+            # Still refreshing: we don't wait for it, and don't start another
+            self.assertEqual(scheduler.next_cadence(now=0.0), 2)
+            self.assertLess(time.monotonic() - started, 5)
+            self.assertEqual(scheduler.refresh_schedule.call_count, 1)
+
+            finish.set()
+            scheduler._refresh_thread.join(5)
+            self.assertEqual(scheduler.next_cadence(now=0.0), 60)
+
+
+class TestDeadlines(unittest.TestCase):
+    def test_timeout_works_off_the_main_thread(self):
+        errors = []
+
+        def worker():
+            try:
+                deadlines.call_with_timeout(time.sleep, 5, timeout=0.1, stage='slow fetch')
+            except deadlines.DeadlineExceeded as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join(2)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0].stage, 'slow fetch')
+
+    def test_deadline_bounds_calls_inside_it(self):
+        with deadlines.Deadline(0.1, name='iteration'):
+            with self.assertRaises(deadlines.DeadlineExceeded) as raised:
+                deadlines.call_with_timeout(time.sleep, 5, timeout=60, stage='slow fetch')
+        self.assertEqual(raised.exception.deadline_name, 'iteration')
+        # The old handlers still catch it
+        self.assertIsInstance(raised.exception, deadlines.TimeoutException)
+
+    def test_asyncio_tasks_get_named_timeouts(self):
+        async def slow_task():
+            await deadlines.wait_for(asyncio.sleep(5), timeout=0.1, stage='goes download')
+
+        with self.assertRaises(deadlines.DeadlineExceeded) as raised:
+            asyncio.run(slow_task())
+        self.assertEqual(raised.exception.stage, 'goes download')
+
+
+class TestPlotEvents(unittest.TestCase):
+    def setUp(self):
+        self.events = plot_events.EventBus()
+        self.plots = plot_events.PlotRegistry(self.events)
+        self.plots.register('stamp', events=(plot_events.AOS, plot_events.LOS))
+        self.plots.register('shield', events=(plot_events.GOES_UPDATED,), msids=['2SHEV1RT'], max_age=600)
+        # Everything is drawn once at startup
+        self.assertEqual(self.plots.take_due(now=0), ['stamp', 'shield'])
+
+    def test_only_invalidated_plots_are_due(self):
+        self.assertEqual(self.plots.take_due(now=1), [])
+
+        self.events.publish(plot_events.NEW_SAMPLES, msids=frozenset({'2PRBSCR'}))
+        self.assertEqual(self.plots.take_due(now=2), [])
+
+        self.events.publish(plot_events.NEW_SAMPLES, msids=frozenset({'2SHEV1RT'}))
+        self.events.publish(plot_events.LOS)
+        self.assertEqual(self.plots.take_due(now=3), ['stamp', 'shield'])
+
+    def test_archive_copies_are_due_at_startup_and_los(self):
+        self.plots.register('dashboard', msids=['2SHEV1RT'], archive_events=(plot_events.LOS,))
+        self.assertEqual(self.plots.take_due(now=1), ['dashboard'])
+        self.assertEqual(self.plots.render_trigger('dashboard'), 'los')
+        self.plots.mark_archived('dashboard')
+        self.assertEqual(self.plots.render_trigger('dashboard'), 'refresh')
+
+        self.events.publish(plot_events.LOS)
+        self.assertIn('dashboard', self.plots.take_due(now=2))
+        self.assertEqual(self.plots.render_trigger('dashboard'), 'los')
+
+    def test_plots_expire(self):
+        self.assertEqual(self.plots.seconds_until_due(now=100), 500)
+        self.assertEqual(self.plots.take_due(now=600), ['shield'])
+
+    def test_sample_watcher_only_reports_new_samples(self):
+        watcher = plot_events.SampleWatcher(self.events)
+        telem = {'2SHEV1RT': telemetry_cache.CachedMsid('2SHEV1RT', np.array([1.0, 2.0]), np.array([5.0, 6.0]))}
+        self.assertEqual(watcher.observe(telem), {'2SHEV1RT'})
+        self.assertEqual(watcher.observe(telem), set())
+        self.assertEqual(self.plots.take_due(now=1), ['shield'])
+
+
+class TestVcduTracker(unittest.TestCase):
+    def setUp(self):
+        self.tracker = vcdu_tracker.VcduTracker(gap_threshold=10, no_signal_threshold=600)
+        self.period = vcdu_tracker.VCDU_PERIOD
+
+    def test_dropout(self):
+        # 100 frames, 40 frames (~10 s) missing, then 100 more
+        counters = np.concatenate([np.arange(100), np.arange(140, 240)])
+        self.tracker.update(counters * self.period, counters)
+
+        dropouts = self.tracker.timeline(kinds=('dropout',))
+        self.assertEqual(len(dropouts), 1)
+        self.assertEqual(dropouts[0]['missing_frames'], 40)
+        self.assertAlmostEqual(self.tracker.frame_rate, 1 / self.period)
+
+    def test_wraparound_is_not_a_reset(self):
+        counters = (np.arange(100) + 2 ** 24 - 50) % 2 ** 24
+        self.tracker.update(np.arange(100) * self.period, counters)
+        self.assertEqual(self.tracker.timeline(), [])
+
+    def test_counter_reset_and_format_change(self):
+        self.tracker.update(np.arange(10) * self.period, np.arange(1000, 1010))
+        self.tracker.update(np.arange(10, 20) * self.period, np.arange(10))
+        self.tracker.update_format([0, 1, 2], ['FMT2', 'FMT2', 'FMT1'])
+
+        self.assertEqual([event['kind'] for event in self.tracker.timeline()], ['counter_reset', 'format_change'])
+
+    def test_overlapping_windows_are_only_counted_once(self):
+        counters = np.arange(100)
+        self.assertEqual(self.tracker.update(counters[:60] * self.period, counters[:60]), 60)
+        self.assertEqual(self.tracker.update(counters * self.period, counters), 40)
+        self.assertEqual(self.tracker.frames_seen, 100)
+        self.assertEqual(self.tracker.timeline(), [])
+
+
+class TestCommState(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f'{directory.name}/comm_state'
+        self.writer = comm_state.CommStateWriter(self.path)
+        self.reader = comm_state.CommStateReader(self.path)
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+
+    def test_round_trip(self):
+        self.assertIsNone(self.reader.read())
+
+        self.writer.publish({'in_comm': True, 'aos_time': 100.0, 'last_vcdu': 12345,
+                             'last_frame_time': 160.0, 'frame_rate': None, 'updated': 161.0})
+        state = self.reader.read(max_age=60)
+        self.assertTrue(state['in_comm'])
+        self.assertEqual(state['last_vcdu'], 12345)
+        self.assertIsNone(state['frame_rate'])
+
+    def test_stale_and_torn_records_are_ignored(self):
+        self.writer.publish({'in_comm': False})
+        with mock.patch('time.time', return_value=time.time() + 1000):
+            self.assertIsNone(self.reader.read(max_age=150))
+
+        # A writer that died mid-write leaves the sequence number odd
+        comm_state.HEADER.pack_into(self.writer._map, 0, comm_state.MAGIC, self.writer.sequence + 1)
+        self.assertIsNone(self.reader.read())
+
+        # Its replacement carries on from where it left off
+        replacement = comm_state.CommStateWriter(self.path)
+        replacement.publish({'in_comm': True})
+        self.assertTrue(self.reader.read()['in_comm'])
+        replacement.close()
+
+    def test_comm_checks_that_need_frames_skip_the_shared_state(self):
+        self.writer.publish({'in_comm': True, 'last_vcdu': 12345})
+        frames = fetch_client.CachedMsid('CVCDUCTR', np.array([100.0, 100.25]), np.array([1, 2]))
+        patches = [mock.patch.object(heartbeat, 'comm_state_reader', self.reader),
+                   mock.patch.object(heartbeat.comm_check_client, 'get_telem', return_value={'CVCDUCTR': frames}),
+                   mock.patch.object(heartbeat, 'CxoTime', mock.MagicMock()),
+                   mock.patch.object(heartbeat, 'time', mock.Mock())]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.assertTrue(heartbeat.are_we_in_comm(cadence=0))
+        heartbeat.comm_check_client.get_telem.assert_not_called()
+
+        # A vcdu_tracker gets the frames MAUDE handed back
+        tracker = mock.Mock()
+        heartbeat.are_we_in_comm(cadence=0, vcdu_tracker=tracker)
+        tracker.update.assert_called_once()
+
+        # and a replayed pass isn't overridden by the real one
+        heartbeat.comm_check_client.get_telem.return_value = {'CVCDUCTR': fetch_client.CachedMsid(
+            'CVCDUCTR', np.array([]), np.array([]))}
+        with mock.patch.object(heartbeat, 'maude_standin_url', 'http://localhost:8765'):
+            self.assertFalse(heartbeat.are_we_in_comm(cadence=0))
+
+
+class TestRenderPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = render_pool.RenderPool(max_workers=2, default_timeout=60)
+        self.addCleanup(self.pool.close)
+
+    def test_a_hung_or_crashed_job_only_fails_itself(self):
+        # Jobs are sent to spawned workers, so they have to be picklable by reference
+        results = self.pool.run([render_pool.RenderJob('hangs', functools.partial(time.sleep, 600), timeout=5),
+                                 render_pool.RenderJob('crashes', functools.partial(os._exit, 1)),
+                                 render_pool.RenderJob('raises', functools.partial(int, 'not a number')),
+                                 render_pool.RenderJob('works', functools.partial(len, 'fine'))])
+
+        self.assertIn('timed out', results['hangs'].error)
+        self.assertIn('worker died', results['crashes'].error)
+        self.assertIn('ValueError', results['raises'].error)
+        self.assertIsNotNone(results['raises'].traceback)
+        self.assertTrue(results['works'].ok)
+
+        # The dead and hung workers were replaced
+        results = self.pool.run([render_pool.RenderJob(name, functools.partial(len, name)) for name in ('again', 'and again')])
+        self.assertTrue(all(result.ok for result in results.values()))
+
+
+class TestRealtimeDashboard(unittest.TestCase):
+    def telem(self, level):
+        msids = [msid for panel in dashboard_renderer.msidlists.dashboard_msids_latest for msid in panel] + ['2FIFOAVR']
+        times = np.linspace(9.08e8, 9.08e8 + 86400, 500)
+        telem = {msid: fetch_client.CachedMsid(msid, times, np.full(500, level)) for msid in msids}
+        telem['CCSDSTMF'] = fetch_client.CachedMsid('CCSDSTMF', times, np.array(['FMT2'] * 250 + ['FMT1'] * 250))
+        return telem
+
+    def test_update_redraws_the_same_figure_in_place(self):
+        with tempfile.TemporaryDirectory() as fig_save_directory:
+            client = mock.Mock()
+            dashboard = dashboard_renderer.RealtimeDashboard(fig_save_directory=fig_save_directory, client=client)
+            fig, lines = dashboard.fig, dict(dashboard.lines)
+            artist_counts = [len(ax.get_children()) for ax in dashboard.axes]
+            window = (dt.datetime(2026, 10, 13), dt.datetime(2026, 10, 20))
+            dropout = [{'kind': 'dropout', 'start': 9.08e8 + 100, 'stop': 9.08e8 + 200}]
+
+            dashboard.update(*window, telem=self.telem(1.0), vcdu_events=dropout)
+            dashboard.update(*window, telem=self.telem(2.0), vcdu_events=dropout)
+
+            self.assertIs(dashboard.fig, fig)
+            self.assertEqual(dashboard.lines, lines)
+            for msid, line in lines.items():
+                self.assertTrue(np.all(np.asarray(line.get_ydata()) == 2.0), msid)
+            # The dropout shading was replaced, not piled up
+            self.assertEqual([len(ax.get_children()) for ax in dashboard.axes], [count + 1 for count in artist_counts])
+            self.assertIn('Latest Bus Current', dashboard.suptitle.get_text())
+            # Everything came from telem
+            client.get_telem.assert_not_called()
+            self.assertTrue(any(file_name.startswith('status') for file_name in os.listdir(fig_save_directory)))
+
+
+class TestRenderFingerprint(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.store = render_fingerprint.FingerprintStore(self.directory, path=f'{self.directory}/fingerprints.json')
+        self.telem = {'2SHEV1RT': telemetry_cache.CachedMsid('2SHEV1RT', np.array([1.0, 2.0]), np.array([5.0, 6.0]))}
+        self.renders = []
+
+    def render(self, profiles):
+        self.renders.append(profiles)
+        for name in render_fingerprint.ARTIFACTS['shield']:
+            for artifact in render_profiles.artifact_files(name, profiles):
+                open(f'{self.directory}/{artifact}', 'w').close()
+
+    def test_unchanged_inputs_are_skipped(self):
+        inputs = dict(telem=render_fingerprint.telemetry_state(self.telem, ['2SHEV1RT']), window=('a', 'b'))
+        self.assertTrue(render_fingerprint.render_if_changed(self.store, 'shield', inputs, self.render))
+        self.assertFalse(render_fingerprint.render_if_changed(self.store, 'shield', inputs, self.render))
+
+        # New samples, or a restart, don't fool it
+        self.telem['2SHEV1RT'].times = np.array([1.0, 2.0, 3.0])
+        self.telem['2SHEV1RT'].vals = np.array([5.0, 6.0, 7.0])
+        inputs['telem'] = render_fingerprint.telemetry_state(self.telem, ['2SHEV1RT'])
+        restarted = render_fingerprint.FingerprintStore(self.directory, path=f'{self.directory}/fingerprints.json')
+        self.assertTrue(render_fingerprint.render_if_changed(restarted, 'shield', inputs, self.render))
+        self.assertEqual(len(self.renders), 2)
+
+    def test_unknown_inputs_and_missing_artifacts_are_redrawn(self):
+        unknown = dict(telem=render_fingerprint.telemetry_state(self.telem, ['2SHEV1RT', '2TLEV1RT']))
+        self.assertIsNone(render_fingerprint.fingerprint(**unknown))
+        self.assertTrue(render_fingerprint.render_if_changed(self.store, 'shield', unknown, self.render))
+        self.assertTrue(render_fingerprint.render_if_changed(self.store, 'shield', unknown, self.render))
+
+        inputs = dict(window=('a', 'b'))
+        self.store.record('missionwide', render_fingerprint.fingerprint(**inputs))
+        # status_wide.png was never actually written
+        self.assertTrue(render_fingerprint.render_if_changed(self.store, 'missionwide', inputs, self.render))
+
+    def test_only_stale_profiles_are_drawn(self):
+        inputs = dict(window=('a', 'b'))
+        live = render_profiles.profiles_for('shield', 'refresh')
+        los = render_profiles.profiles_for('shield', 'los')
+        render_fingerprint.render_if_changed(self.store, 'shield', inputs, self.render, profiles=live)
+        # At LOS, the live PNG is already up to date, so only the archive copies get drawn
+        render_fingerprint.render_if_changed(self.store, 'shield', inputs, self.render, profiles=los)
+        self.assertFalse(render_fingerprint.render_if_changed(self.store, 'shield', inputs, self.render, profiles=los))
+        self.assertEqual(self.renders, [('live',), ('archive', 'thumbnail')])
+        self.assertTrue(os.path.exists(f'{self.directory}/events_hires.png'))
+
+
+
+class TestArtifactPublisher(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.publisher = artifact_publisher.ArtifactPublisher(self.directory, history=3)
+
+    def write(self, contents):
+        def write(path):
+            with open(path, 'w') as output:
+                output.write(contents)
+        return write
+
+    def test_versions_are_kept_and_pruned(self):
+        for version in range(5):
+            with artifact_publisher.publishing(fingerprint=f'fingerprint {version}'):
+                self.publisher.publish('status.png', self.write(f'version {version}'))
+
+        with open(f'{self.directory}/status.png') as published:
+            self.assertEqual(published.read(), 'version 4')
+        # No temp files left lying around, and only the last 3 versions kept
+        self.assertEqual(sorted(os.listdir(self.directory)), ['history', 'manifest.json', 'manifest.json.lock', 'status.png'])
+        self.assertEqual(len(os.listdir(f'{self.directory}/history')), 3)
+
+        artifact = self.publisher.manifest()['artifacts']['status.png']
+        self.assertEqual(artifact['current']['fingerprint'], 'fingerprint 4')
+        self.assertEqual([version['fingerprint'] for version in artifact['versions']],
+                         ['fingerprint 4', 'fingerprint 3', 'fingerprint 2'])
+        with open(f'{self.directory}/{artifact["versions"][1]["path"]}') as previous:
+            self.assertEqual(previous.read(), 'version 3')
+
+    def test_failed_write_leaves_the_published_copy_alone(self):
+        self.publisher.publish('status.png', self.write('good'))
+
+        def broken(path):
+            self.write('torn')(path)
+            raise RuntimeError('savefig blew up')
+
+        with self.assertRaises(RuntimeError):
+            self.publisher.publish('status.png', broken)
+        with open(f'{self.directory}/status.png') as published:
+            self.assertEqual(published.read(), 'good')
+        self.assertFalse(any(name.endswith('.tmp') for name in os.listdir(self.directory)))
+
+    def test_threads_can_write_the_same_file_at_once(self):
+        # e.g. the CommScheduler and the monitor both saving last_orbit_metadata.json
+        both_writing = threading.Barrier(2)
+        errors = []
+
+        def save(contents):
+            def write(path):
+                self.write(contents)(path)
+                both_writing.wait(5)
+            try:
+                artifact_publisher.write_atomically(f'{self.directory}/last_orbit_metadata.json', write)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=save, args=(contents,)) for contents in ('{"from": "scheduler"}', '{"from": "monitor"}')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(errors, [])
+        with open(f'{self.directory}/last_orbit_metadata.json') as saved:
+            self.assertIn(saved.read(), ('{"from": "scheduler"}', '{"from": "monitor"}'))
+
+
+
+class TestChandratime(unittest.TestCase):
+    def test_known_times(self):
+        # The CXC epoch (1998-01-01T00:00:00 TT) was 63.184 s before midnight UTC
+        self.assertEqual(chandratime.cxctime_to_unix(63.184), 883612800.0)
+        self.assertEqual(chandratime.cxctime_to_doy(694224069.184), '2020:001:00:00:00.000')
+        np.testing.assert_array_equal(chandratime.cxctime_to_datetime64([63.184, 694224069.184]),
+                                      np.array(['1998-01-01', '2020-01-01'], dtype='datetime64[ns]'))
+        self.assertEqual(chandratime.cxctime_to_datetime(694224069.184), dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc))
+
+    def test_leap_seconds(self):
+        # Either side of the leap second at the end of 2016
+        times = np.array([599616067.684, 599616069.184])
+        np.testing.assert_array_equal(chandratime.cxctime_to_doy(times),
+                                      ['2016:366:23:59:59.500', '2017:001:00:00:00.000'])
+        # Arrays straddling it (slow path) and not (fast path) agree
+        self.assertEqual(chandratime.cxctime_to_unix(times)[1], chandratime.cxctime_to_unix(times[1:])[0])
+        self.assertEqual(chandratime.cxctime_to_doy([]).shape, (0,))
+
+
+class TestDataPublisher(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.publisher = data_publisher.DataSlicePublisher(self.directory, msidlist=[['2PRBSCR'], ['2TLEV1RT', '2SHEV1RT']],
+                                                           tiles=['Current', 'Rates'], units=['A', 'Counts'],
+                                                           limits=[(0, 3), (0, 64000)], points_per_panel=100, fan_in=4)
+
+    def telem(self, stop):
+        times = np.arange(7.0e8, stop, 32.8)
+        return {'2PRBSCR': mock.Mock(times=times, vals=np.full(len(times), 2.0)),
+                '2TLEV1RT': mock.Mock(times=times, vals=times - 7.0e8)}
+
+    def series(self, msid):
+        # What the web client would put together from data.json and the chunks
+        manifest = self.publisher.manifest
+        times = []
+        for chunk in manifest['chunks']:
+            series = self.publisher._read_chunk(chunk)
+            if msid in series:
+                times.append(series[msid][0])
+        return np.concatenate(times)
+
+    def test_only_new_samples_are_published(self):
+        window = (7.0e8, 7.0e8 + 6 * 86400)
+        # Five days of samples, decimated to 2 points in each of the 50 bins
+        self.assertLessEqual(self.publisher.publish(self.telem(7.0e8 + 5 * 86400), *window), 2 * 2 * 51)
+        self.assertEqual(self.publisher.publish(self.telem(7.0e8 + 5 * 86400), *window), 0)
+        # A few new samples, each refresh
+        for refresh in range(1, 10):
+            self.assertEqual(self.publisher.publish(self.telem(7.0e8 + 5 * 86400 + refresh * 32.8), *window), 2)
+
+        manifest = self.publisher.manifest
+        self.assertEqual([panel['msids'] for panel in manifest['panels']], [['2PRBSCR'], ['2TLEV1RT', '2SHEV1RT']])
+        # The chunks were merged as they piled up, and the series still runs in order
+        self.assertEqual([chunk['level'] for chunk in manifest['chunks']], [1, 1, 0, 0])
+        times = self.series('2TLEV1RT')
+        self.assertTrue(np.all(np.diff(times) > 0))
+        last_sample = self.telem(7.0e8 + 5 * 86400 + 9 * 32.8)['2TLEV1RT'].times[-1]
+        self.assertAlmostEqual(times[-1], chandratime.cxctime_to_unix(last_sample), delta=0.01)
+
+        # A restart carries on where the last run left off
+        restarted = data_publisher.DataSlicePublisher(self.directory, msidlist=[['2PRBSCR'], ['2TLEV1RT', '2SHEV1RT']],
+                                                      tiles=['Current', 'Rates'], units=['A', 'Counts'], limits=[(0, 3), (0, 64000)])
+        self.assertEqual(restarted.publish(self.telem(7.0e8 + 5 * 86400 + 9 * 32.8), *window), 0)
+        self.assertIn('index.html', os.listdir(self.directory))
+
+
+def module_of(thing):
+    # The modules in hrcsentinel/ import each other by bare name, so what they see can be a different module object from ours
+    return sys.modules[thing.__module__]
+
+
+FAKE_NOW = 800000100.0
+
+
+def fake_maude(client, msids, start, stop, sampling):
+    # Stands in for FetchClient._get_telem(): 2CEAHVPT is 100 C (212 F), and CCSDSTMF only has raw values with state codes.
+    # There's a sample every 32.8 s until FAKE_NOW, on a fixed grid so that fetches from different starts line up.
+    telem = {}
+    for msid in msids:
+        times = np.arange(np.ceil(start_secs_or(start) / 32.8), np.floor(FAKE_NOW / 32.8) + 1) * 32.8
+        if msid == 'CCSDSTMF' or msid in telemetry_bus.msidlists.motor_dashboard_msids[0]:
+            odd = np.round(times / 32.8) % 2 == 1
+            raw_vals = odd + 1 if client.state_codes else None
+            telem[msid] = telemetry_cache.CachedMsid(msid, times, np.where(odd, 'FMT2', 'FMT1'), raw_vals)
+        else:
+            vals = np.full(len(times), 100.0 if client.unit_system == 'sci' else 212.0)
+            telem[msid] = telemetry_cache.CachedMsid(msid, times, vals, vals)
+    return telem
+
+
+def start_secs_or(start):
+    return float(start) if isinstance(start, (int, float, np.number)) else 800000000.0
+
+
+class TestTelemetryBus(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patches = [mock.patch.object(telemetry_bus.FetchClient, '_get_telem', autospec=True, side_effect=fake_maude),
+                   # The caches trim anything older than their window, relative to now
+                   mock.patch.object(module_of(telemetry_bus.TelemetryCache), 'CxoTime', mock.Mock(now=mock.Mock(return_value=mock.Mock(secs=FAKE_NOW)))),
+                   mock.patch.object(telemetry_bus, 'CxoTime', mock.Mock(now=mock.Mock(return_value=mock.Mock(secs=FAKE_NOW))))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        with mock.patch.object(telemetry_bus, 'plan_refresh', return_value={}):
+            self.bus = telemetry_bus.TelemetryBus(address=f'{directory.name}/bus',
+                                                  comm_state_path=f'{directory.name}/comm_state')
+
+    def test_bus_serves_the_units_it_was_asked_for(self):
+        for unit_system in ('eng', 'sci'):
+            direct = telemetry_bus.FetchClient('maude', allow_subset=False, unit_system=unit_system).get_telem(
+                ['2CEAHVPT'], start=800000000.0)
+            served = self.bus.handle({'request': 'telem', 'msids': ['2CEAHVPT'], 'start': 800000000.0,
+                                      'unit_system': unit_system})
+            np.testing.assert_array_equal(served['2CEAHVPT'].vals, direct['2CEAHVPT'].vals)
+        # Each unit system has its own cache, kept fresh from now on
+        self.assertEqual(self.bus.watched[('sci', False)], list(dict.fromkeys(
+            telemetry_bus.msidlists.critical_comm_msids + telemetry_bus.msidlists.anomaly_msids + ['2CEAHVPT'])))
+        self.assertIn('2CEAHVPT', self.bus.watched[('eng', False)])
+
+    def test_a_short_first_request_doesnt_truncate_the_window(self):
+        # The first consumer only wants the last minute, but the bus keeps the whole window for whoever asks next
+        self.bus.handle({'request': 'telem', 'msids': ['2CEAHVPT'], 'start': FAKE_NOW - 60, 'unit_system': 'sci'})
+        five_days = self.bus.handle({'request': 'telem', 'msids': ['2CEAHVPT'], 'start': FAKE_NOW - 5 * 86400,
+                                     'unit_system': 'sci'})['2CEAHVPT']
+        self.assertLess(five_days.times[0], FAKE_NOW - 5 * 86400 + 32.8)
+
+    def test_new_msids_are_fetched_without_holding_the_lock(self):
+        def check_unlocked(*args, **kwargs):
+            self.assertTrue(self.bus.lock.acquire(blocking=False))
+            self.bus.lock.release()
+            return fake_maude(*args, **kwargs)
+
+        telemetry_bus.FetchClient._get_telem.side_effect = check_unlocked
+        self.bus.handle({'request': 'telem', 'msids': ['2CEAHVPT'], 'start': FAKE_NOW - 60, 'unit_system': 'eng'})
+        telemetry_bus.FetchClient._get_telem.assert_called()
+
+    def test_planned_fetch_through_the_bus_matches_the_direct_one(self):
+        fetch_planner = module_of(telemetry_bus.plan_refresh)
+        bus = mock.Mock()
+        bus.get_telem.side_effect = lambda msids, start, unit_system='eng', state_codes=False: self.bus.handle(
+            {'request': 'telem', 'msids': msids, 'start': start, 'unit_system': unit_system, 'state_codes': state_codes})
+
+        # The motor plots' state MSIDs need raw_vals, which only come with state codes
+        plan = fetch_planner.plan_refresh(motors=True)
+        direct = fetch_planner.fetch_planned(plan, start=800000000.0)
+        served = fetch_planner.fetch_planned(plan, start=800000000.0, bus=bus)
+        self.assertEqual(sorted(served), sorted(direct))
+        for msid in direct:
+            np.testing.assert_array_equal(served[msid].vals, direct[msid].vals)
+            if direct[msid].raw_vals is None:
+                self.assertIsNone(served[msid].raw_vals)
+            else:
+                np.testing.assert_array_equal(served[msid].raw_vals, direct[msid].raw_vals)
+        self.assertIsNotNone(served['2DRLSOP'].raw_vals)
+
+
+class TestFetchClient(unittest.TestCase):
+    def setUp(self):
+        self.maude = mock.Mock()
+        self.maude.get_msids.return_value = {'data': [{'msid': '2CEAHVPT', 'times': [800000000.0], 'values': [212.0]}]}
+        self.fetch = mock.MagicMock()
+        self.fetch.get_telem.return_value = {'2CEAHVPT': fetch_client.CachedMsid('2CEAHVPT', np.array([800000000.0]), np.array([100.0]))}
+        patches = [mock.patch.object(fetch_client, 'maude', self.maude),
+                   mock.patch.object(fetch_client, 'fetch', self.fetch),
+                   mock.patch.object(fetch_client, 'CxoTime', mock.Mock(return_value=mock.Mock(date='2023:131:09:46:40.000'))),
+                   mock.patch.object(fetch_client, 'maude_standin_url', None)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_engineering_units_come_straight_from_maude(self):
+        telem = fetch_client.FetchClient('maude').get_telem('2CEAHVPT', start=800000000.0)
+        self.assertEqual(telem['2CEAHVPT'].vals[0], 212.0)
+        self.fetch.get_telem.assert_not_called()
+
+    def test_other_unit_systems_go_through_cheta(self):
+        telem = fetch_client.FetchClient('maude', unit_system='sci').get_telem('2CEAHVPT', start=800000000.0)
+        self.assertEqual(telem['2CEAHVPT'].vals[0], 100.0)
+        self.maude.get_msids.assert_not_called()
+        self.fetch.data_source.assert_called_once_with('maude allow_subset=True')
+        self.assertEqual(self.fetch.get_telem.call_args.kwargs['unit_system'], 'sci')
+        # Clients that differ only in units aren't interchangeable (e.g. as cache or batch keys)
+        self.assertNotEqual(fetch_client.FetchClient('maude', unit_system='sci'), fetch_client.FetchClient('maude'))
+
+    def test_a_hung_cheta_fetch_doesnt_wedge_the_ones_after_it(self):
+        hung = threading.Event()
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def hang_once(*args, **kwargs):
+            if not hung.is_set():
+                hung.set()
+                release.wait(10)
+            return {'2CEAHVPT': fetch_client.CachedMsid('2CEAHVPT', np.array([800000000.0]), np.array([100.0]))}
+        self.fetch.get_telem.side_effect = hang_once
+
+        client = fetch_client.FetchClient('maude', unit_system='sci', timeout=0.2)
+        with self.assertRaises(fetch_client.DeadlineExceeded):
+            client.get_telem('2CEAHVPT', start=800000000.0)
+
+        # The hung fetch still has the lock, so this one gives up (and says why) rather than queueing behind it
+        started = time.monotonic()
+        with self.assertRaises(fetch_client.DeadlineExceeded) as raised:
+            client.get_telem('2CEAHVPT', start=800000000.0)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertIn('cheta lock', str(raised.exception))
+
+        # Once the hung fetch returns, it hands the lock back
+        release.set()
+        for _ in range(50):
+            if fetch_client._cheta_lock.acquire(timeout=0.1):
+                fetch_client._cheta_lock.release()
+                break
+        self.assertEqual(client.get_telem('2CEAHVPT', start=800000000.0)['2CEAHVPT'].vals[0], 100.0)
+
+
+class TestAsyncTelemetryMonitor(unittest.TestCase):
+    def setUp(self):
+        # The GOES and web-Kadi downloads hang until the test is over
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        downloads = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(downloads.shutdown, wait=False)
+        engine = mock.Mock()
+        engine.submit_download.side_effect = lambda function, *args, **kwargs: downloads.submit(function, *args, **kwargs)
+
+        def hang(result):
+            def download(*args, **kwargs):
+                self.release.wait(30)
+                return result
+            return download
+
+        self.patches = {'are_we_in_comm': mock.Mock(return_value=True),
+                        'get_goes_proxy': mock.Mock(side_effect=hang(([], []))),
+                        'fetch_orbit_metadata': mock.Mock(side_effect=hang((None, True))),
+                        'plan_refresh': mock.Mock(return_value={}),
+                        'fetch_planned': mock.Mock(return_value={}),
+                        'comm_status_stamp': mock.Mock()}
+        for name, replacement in self.patches.items():
+            patch = mock.patch.object(async_monitor, name, replacement)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.monitor = async_monitor.AsyncTelemetryMonitor('test_figures/', 'test', engine, mock.Mock(),
+                                                           scheduler=mock.Mock(next_cadence=mock.Mock(return_value=0.01)))
+        self.addCleanup(self.monitor._stage_executor.shutdown, wait=False)
+        self.addCleanup(self.monitor._render_executor.shutdown, wait=False)
+        # The drawing itself is tested elsewhere
+        for draw in ('_draw_realtime', '_draw_shield', '_draw_ancillary'):
+            setattr(self.monitor, draw, mock.Mock())
+        self.monitor._vcdu_timeline = mock.Mock(return_value=[])
+        self.monitor._report = mock.Mock(wraps=self.monitor._report)
+
+    def run_until(self, done, timeout=5):
+        async def run():
+            task = asyncio.create_task(self.monitor.run())
+            started = time.monotonic()
+            while not done() and time.monotonic() - started < timeout:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(run())
+        return done()
+
+    def test_slow_downloads_dont_hold_up_the_comm_status_stamp(self):
+        started = time.monotonic()
+        self.assertTrue(self.run_until(lambda: self.patches['comm_status_stamp'].called))
+        self.assertLess(time.monotonic() - started, 5)
+        # ...while both downloads were still hanging
+        self.patches['get_goes_proxy'].assert_called()
+        self.patches['fetch_orbit_metadata'].assert_called()
+        self.assertFalse(self.release.is_set())
+        self.assertTrue(self.patches['comm_status_stamp'].call_args.kwargs['comm_status'])
+
+    def test_a_failed_render_doesnt_skip_the_rest(self):
+        self.monitor.telem = {}
+        self.monitor._draw_shield.side_effect = RuntimeError('no GOES')
+        self.assertTrue(self.run_until(lambda: self.monitor._draw_ancillary.called and self.patches['comm_status_stamp'].called))
+        self.monitor._draw_shield.assert_called()
+        self.monitor._draw_realtime.assert_called()
+        self.monitor._report.assert_any_call(mock.ANY, 'shield render')
+
+    def test_timeouts_are_reported_with_their_stage(self):
+        async def time_out(wait, *args, stage):
+            try:
+                await wait(*args, timeout=0.05, stage=stage)
+            except async_monitor.TimeoutException as e:
+                return e
+
+        for wait, args, stage in [(self.monitor._in_thread, (time.sleep, 1), 'telemetry refresh'),
+                                  (self.monitor._download, (async_monitor.get_goes_proxy,), 'GOES download')]:
+            e = asyncio.run(time_out(wait, *args, stage=stage))
+            self.assertEqual(e.stage, stage)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                self.monitor._report(e, stage)
+            self.assertIn(f'Timed out: {stage} exceeded', output.getvalue())
+
+
+class TestMaudeStandin(unittest.TestCase):
+    def test_replay_clock_speeds_up_and_loops(self):
+        now = mock.Mock(secs=0.0)
+        with mock.patch.object(maude_standin, 'CxoTime', mock.Mock(now=mock.Mock(return_value=now))):
+            clock = maude_standin.ReplayClock(1000.0, 2000.0, acceleration=60, lead_seconds=100.0)
+            looping_clock = maude_standin.ReplayClock(1000.0, 2000.0, acceleration=60, lead_seconds=100.0, loop=True)
+
+            # 60 recorded seconds go by for every real one
+            self.assertEqual(clock.replay_position(now=1.0), 1160.0)
+            self.assertEqual(clock.replay_position(now=20.0), 2300.0)
+            # ...and a looping replay starts over at the end of the fixture
+            self.assertEqual(looping_clock.replay_position(now=20.0), 1300.0)
+
+            now.secs = 1.0
+            self.assertEqual(clock.to_real(1160.0), 1.0)
+            self.assertEqual(clock.to_fixture(0.0), 1100.0)
+            self.assertEqual(clock.to_real(clock.to_fixture(0.5)), 0.5)
+
+    def test_recorded_telemetry_comes_back_from_the_server(self):
+        times = 700000000.0 + np.arange(100.0)
+        recorded = {'2CEAHVPT': fetch_client.CachedMsid('2CEAHVPT', times, np.arange(100.0), np.arange(100.0)),
+                    'CCSDSTMF': fetch_client.CachedMsid('CCSDSTMF', times, np.array(['FMT1', 'FMT2'] * 50),
+                                                        np.array([1, 2] * 50))}
+        fixture_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(fixture_directory.cleanup)
+
+        with mock.patch.object(maude_standin.FetchClient, '_get_telem', autospec=True,
+                               side_effect=lambda client, msids, *args: {msid: recorded[msid] for msid in msids}), \
+                contextlib.redirect_stdout(io.StringIO()):
+            maude_standin.record(fixture_directory.name, start=times[0], stop=times[-1], msids=list(recorded))
+
+        # Replay it at the end of the fixture, so all of it has "arrived"
+        server = maude_standin.start_in_background(fixture_directory.name, port=0, lead_seconds=times[-1] - times[0])
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f'http://localhost:{server.server_address[1]}'
+        start = maude_standin.CxoTime.now().secs - 200
+
+        patches = [mock.patch.object(module_of(maude_standin.FetchClient), 'maude_standin_url', url),
+                   mock.patch.object(maude_standin, 'SUBSET_MAX_SAMPLES', 10)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        every_frame = maude_standin.FetchClient('maude', allow_subset=False).get_telem(list(recorded), start=start)
+        np.testing.assert_array_equal(every_frame['2CEAHVPT'].vals, recorded['2CEAHVPT'].vals)
+        np.testing.assert_allclose(np.diff(every_frame['2CEAHVPT'].times), 1.0)
+        np.testing.assert_array_equal(every_frame['CCSDSTMF'].vals, recorded['CCSDSTMF'].vals)
+        np.testing.assert_array_equal(every_frame['CCSDSTMF'].raw_vals, recorded['CCSDSTMF'].raw_vals)
+
+        # With allow_subset, a big window is thinned out, just like MAUDE does
+        subset = maude_standin.FetchClient('maude', allow_subset=True).get_telem('2CEAHVPT', start=start)
+        np.testing.assert_array_equal(subset['2CEAHVPT'].vals, recorded['2CEAHVPT'].vals[::10])
+
+        # A request without a start is a bad request, not a server error
+        self.assertEqual(requests.get(f'{url}/msids', params={'msids': '2CEAHVPT'}, timeout=10).status_code, 400)
+        self.assertEqual(requests.get(f'{url}/msids', params={'msids': '2CEAHVPT', 'start': 'yesterday'},
+                                      timeout=10).status_code, 400)
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()